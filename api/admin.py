@@ -1,7 +1,10 @@
 from django.contrib import admin
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from .models import FeverUser, Config, Feed, Group, FeedGroup, Item, Favicon, Link
+from .models import (
+    FeverUser, Config, Feed, Group, FeedGroup, Item, ItemIdCache, Favicon, Link, HotLinkBucket, RefreshJob, Source,
+)
+from .response_cache import bump_versions
 
 
 def format_ts(ts):
@@ -49,8 +52,8 @@ class FeedAdmin(admin.ModelAdmin):
     list_filter = ('user', 'is_spark')
     search_fields = ('title', 'user_title', 'url', 'domain')
     raw_id_fields = ('user', 'favicon')
-    readonly_fields = ('title', 'url_checksum', 'last_refreshed_date', 'last_updated_date', 'last_added_date')
-    fields = ('user', 'url', 'user_title', 'title', 'site_url', 'domain', 'is_spark', 'favicon', 'url_checksum', 'last_refreshed_date', 'last_updated_date', 'last_added_date')
+    readonly_fields = ('title', 'source', 'url_checksum', 'last_refreshed_date', 'last_updated_date', 'last_added_date')
+    fields = ('user', 'url', 'source', 'user_title', 'title', 'site_url', 'domain', 'is_spark', 'favicon', 'retention_days', 'retention_min_items', 'url_checksum', 'last_refreshed_date', 'last_updated_date', 'last_added_date')
 
     def last_refreshed_date(self, obj):
         return format_ts(obj.last_refreshed_on_time)
@@ -65,6 +68,23 @@ class FeedAdmin(admin.ModelAdmin):
     last_added_date.admin_order_field = 'last_added_on_time'
 
 
+@admin.register(Source)
+class SourceAdmin(admin.ModelAdmin):
+    list_display = ('title', 'url', 'error_count', 'last_refreshed_date', 'next_refresh_date', 'last_fetch_ms',
+                    'claimed_by')
+    search_fields = ('title', 'url', 'domain')
+    readonly_fields = ('url_checksum', 'last_refreshed_date', 'next_refresh_date', 'etag', 'last_modified',
+                       'fetch_url', 'last_fetch_ms', 'last_fetch_bytes', 'claimed_by', 'lease_expires')
+
+    def last_refreshed_date(self, obj):
+        return format_ts(obj.last_refreshed_on_time)
+    last_refreshed_date.admin_order_field = 'last_refreshed_on_time'
+
+    def next_refresh_date(self, obj):
+        return format_ts(obj.next_refresh_on_time)
+    next_refresh_date.admin_order_field = 'next_refresh_on_time'
+
+
 @admin.register(FeedGroup)
 class FeedGroupAdmin(admin.ModelAdmin):
     list_display = ('feed', 'group')
@@ -74,14 +94,25 @@ class FeedGroupAdmin(admin.ModelAdmin):
 @admin.register(Item)
 class ItemAdmin(admin.ModelAdmin):
     list_display = ('title', 'feed', 'author', 'is_saved', 'read_date', 'created_date')
-    list_filter = ('is_saved', 'feed__user')
-    search_fields = ('title', 'author', 'description')
-    raw_id_fields = ('feed',)
+    list_filter = ('state__is_saved', 'user')
+    list_select_related = ('feed', 'state')
+    search_fields = ('title', 'author')
+    raw_id_fields = ('feed', 'user')
     readonly_fields = ('created_date', 'added_date', 'read_date')
 
+    def delete_queryset(self, request, queryset):
+        """The bulk delete action skips the per-item signal, so update the ID caches here"""
+        by_user = {}
+        for item_id, user_id in queryset.values_list('id', 'user_id'):
+            by_user.setdefault(user_id, []).append(item_id)
+        super().delete_queryset(request, queryset)
+        for user_id, ids in by_user.items():
+            ItemIdCache.objects.apply(user_id, unread_remove=ids, saved_remove=ids, total_delta=-len(ids))
+        bump_versions(by_user)
+
     def read_date(self, obj):
         return format_ts(obj.read_on_time)
-    read_date.admin_order_field = 'read_on_time'
+    read_date.admin_order_field = 'state__read_on_time'
 
     def created_date(self, obj):
         return format_ts(obj.created_on_time)
@@ -114,3 +145,35 @@ class LinkAdmin(admin.ModelAdmin):
     def created_date(self, obj):
         return format_ts(obj.created_on_time)
     created_date.admin_order_field = 'created_on_time'
+
+
+@admin.register(HotLinkBucket)
+class HotLinkBucketAdmin(admin.ModelAdmin):
+    list_display = ('link', 'user', 'weight', 'bucket_date')
+    list_filter = ('user',)
+    raw_id_fields = ('user', 'link')
+    readonly_fields = ('bucket_date',)
+
+    def bucket_date(self, obj):
+        return format_ts(obj.bucket_on_time)
+    bucket_date.admin_order_field = 'bucket_on_time'
+
+
+@admin.register(RefreshJob)
+class RefreshJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'requested_date', 'finished_date')
+    list_filter = ('status',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('requested_date', 'started_date', 'finished_date')
+
+    def requested_date(self, obj):
+        return format_ts(obj.requested_on_time)
+    requested_date.admin_order_field = 'requested_on_time'
+
+    def started_date(self, obj):
+        return format_ts(obj.started_on_time)
+    started_date.admin_order_field = 'started_on_time'
+
+    def finished_date(self, obj):
+        return format_ts(obj.finished_on_time)
+    finished_date.admin_order_field = 'finished_on_time'
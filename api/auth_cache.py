@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+
+API_KEY_CACHE_TTL = 60  # Seconds a resolved key is trusted, bounds staleness across processes
+API_KEY_CACHE_SIZE = 1024
+SESSION_WRITE_INTERVAL = 300  # Write last_session_on_time back at most this often per user
+
+
+class ApiKeyCache:
+    """Thread-safe LRU map of Fever API key -> user whose entries expire after a TTL"""
+
+    def __init__(self, ttl=API_KEY_CACHE_TTL, size=API_KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key):
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._entries[api_key]
+                return None
+            self._entries.move_to_end(api_key)
+            return user
+
+    def put(self, api_key, user):
+        with self._lock:
+            self._entries[api_key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user):
+        """Drop every key resolving to this user, and the user's current key"""
+        with self._lock:
+            for api_key in [k for k, (u, _) in self._entries.items() if u.pk == user.pk or k == user.fever_api_key]:
+                del self._entries[api_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+api_key_cache = ApiKeyCache()
+
+
+async def atouch_session(user, now=None):
+    """
+    Record a Fever session. The timestamp is written back at most once per
+    SESSION_WRITE_INTERVAL per user; returns whether a write happened.
+    """
+    from .models import FeverUser
+
+    now = now or int(time.time())
+    if now - user.last_session_on_time < SESSION_WRITE_INTERVAL:
+        return False
+    user.last_session_on_time = now
+    await FeverUser.objects.filter(pk=user.pk).aupdate(last_session_on_time=now)
+    return True
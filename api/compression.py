@@ -0,0 +1,108 @@
+import re
+import struct
+import time
+import zlib
+from collections import Counter
+
+# Item bodies are stored as: 1 codec byte, then for CODEC_DEFLATE_DICT a
+# 4-byte dictionary id, then a raw deflate stream
+CODEC_PLAIN = 0
+CODEC_DEFLATE = 1
+CODEC_DEFLATE_DICT = 2
+COMPRESSION_LEVEL = 6
+DICTIONARY_SIZE = 32 * 1024  # deflate's window, a larger dictionary could never be referenced
+ACTIVE_DICTIONARY_TTL = 300  # Seconds before re-checking for a newly trained dictionary
+
+# Tag openings up to the first attribute value, tag closings, and words
+FRAGMENT_RE = re.compile(r'</?[a-zA-Z][^<>"]*"?|"[^<>"]*>|[A-Za-z][a-z]{3,}')
+
+_dictionaries = {}
+_active = {'dictionary': None, 'checked': None}
+
+
+def clear_dictionary_cache():
+    _dictionaries.clear()
+    _active['checked'] = None
+
+
+def get_dictionary(dictionary_id):
+    """Dictionary bytes by id; dictionaries are immutable so they are cached for good"""
+    if dictionary_id not in _dictionaries:
+        from .models import CompressionDictionary
+        _dictionaries[dictionary_id] = bytes(CompressionDictionary.objects.get(id=dictionary_id).data)
+    return _dictionaries[dictionary_id]
+
+
+def active_dictionary():
+    """The newest trained dictionary as (id, data), or None if none has been trained"""
+    now = time.monotonic()
+    if _active['checked'] is None or now - _active['checked'] > ACTIVE_DICTIONARY_TTL:
+        from .models import CompressionDictionary
+        latest = CompressionDictionary.objects.order_by('-id').values_list('id', 'data').first()
+        if latest:
+            _dictionaries[latest[0]] = bytes(latest[1])
+            _active['dictionary'] = (latest[0], _dictionaries[latest[0]])
+        else:
+            _active['dictionary'] = None
+        _active['checked'] = now
+    return _active['dictionary']
+
+
+def encode_body(text, dictionary=None):
+    """Compress HTML, with `dictionary` as (id, data) if given. Falls back to plain when that is smaller."""
+    if text is None:
+        return None
+    raw = text.encode('utf-8')
+    if dictionary:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15, zdict=dictionary[1])
+        header = struct.pack('>BI', CODEC_DEFLATE_DICT, dictionary[0])
+    else:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -15)
+        header = bytes([CODEC_DEFLATE])
+    compressed = header + compressor.compress(raw) + compressor.flush()
+    if len(compressed) > len(raw):
+        return bytes([CODEC_PLAIN]) + raw
+    return compressed
+
+
+def compress_body(text):
+    """Compress HTML with the active dictionary"""
+    return encode_body(text, active_dictionary())
+
+
+def decompress_body(blob):
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    codec = blob[0]
+    if codec == CODEC_PLAIN:
+        return blob[1:].decode('utf-8')
+    if codec == CODEC_DEFLATE:
+        return zlib.decompress(blob[1:], -15).decode('utf-8')
+    if codec == CODEC_DEFLATE_DICT:
+        dictionary_id = struct.unpack_from('>I', blob, 1)[0]
+        decompressor = zlib.decompressobj(-15, zdict=get_dictionary(dictionary_id))
+        return (decompressor.decompress(blob[5:]) + decompressor.flush()).decode('utf-8')
+    raise ValueError(f'Unknown item body codec {codec}')
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """
+    Build a preset deflate dictionary from sample bodies: the fragments found
+    in the most documents, most common last since deflate encodes nearer
+    matches more cheaply.
+    """
+    frequency = Counter()
+    for text in samples:
+        frequency.update(set(FRAGMENT_RE.findall(text)))
+    chosen = []
+    used = 0
+    for fragment, count in frequency.most_common():
+        if count < 2:
+            break
+        encoded = fragment.encode('utf-8')
+        if used + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        used += len(encoded)
+    return b''.join(reversed(chosen))
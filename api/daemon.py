@@ -0,0 +1,191 @@
+import heapq
+import logging
+import threading
+import time
+
+from django.db import DatabaseError, connection
+
+from .favicons import refresh_favicons
+from .models import Source
+from .utils import (
+    DEFAULT_FETCH_WORKERS, DEFAULT_PER_HOST_LIMIT, RefreshStats, default_worker_id, process_refresh_jobs,
+    refresh_feeds_concurrently,
+)
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL = 60  # Reload the schedule to see new sources and other workers' refreshes
+IDLE_INTERVAL = 5  # Longest sleep, also how often API refresh jobs are picked up
+FAVICON_INTERVAL = 60 * 60
+STATUS_LOG_INTERVAL = 60
+ERROR_BACKOFF = 30  # Pause after a failed iteration
+
+
+class RefreshQueue:
+    """
+    Sources by due time (next_refresh_on_time). Rescheduling pushes a new
+    entry; superseded entries are skipped when they reach the top.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+
+    def load(self, rows):
+        """Replace the queue with (source_id, due) rows"""
+        self._due = dict(rows)
+        self._heap = [(due, source_id) for source_id, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def push(self, source_id, due):
+        self._due[source_id] = due
+        heapq.heappush(self._heap, (due, source_id))
+
+    def _top(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def pop_due(self, now, limit):
+        """Remove and return up to `limit` source IDs due by `now`, most overdue first"""
+        ids = []
+        while len(ids) < limit:
+            top = self._top()
+            if top is None or top[0] > now:
+                break
+            heapq.heappop(self._heap)
+            del self._due[top[1]]
+            ids.append(top[1])
+        return ids
+
+    def next_due(self):
+        top = self._top()
+        return top[0] if top else None
+
+    def depth(self, now):
+        """Sources due and waiting"""
+        return sum(1 for due in self._due.values() if due <= now)
+
+    def lag(self, now):
+        """Seconds the most overdue waiting source is behind schedule"""
+        top = self._top()
+        return max(now - top[0], 0) if top else 0
+
+    def __len__(self):
+        return len(self._due)
+
+
+class RefreshDaemon:
+    """
+    Long-running refresher: keeps its database connection and fetch settings
+    across iterations and pulls due sources continuously, in small leased
+    batches, instead of a full pass per process start.
+    """
+
+    def __init__(self, worker=None, workers=DEFAULT_FETCH_WORKERS, per_host=DEFAULT_PER_HOST_LIMIT, batch_size=None,
+                 lease=None, sync_interval=SYNC_INTERVAL, favicons=True, callback=None):
+        self.worker = worker or default_worker_id()
+        self.workers = workers
+        self.per_host = per_host
+        self.batch_size = batch_size or max(1, workers) * 2
+        self.lease = lease
+        self.sync_interval = sync_interval
+        self.favicons = favicons
+        self.callback = callback
+        self.queue = RefreshQueue()
+        self.stats = RefreshStats()
+        self.stop_event = threading.Event()
+        self.started = time.time()
+        self.last_sync = None
+        self.last_favicons = None
+        self.status = {}
+
+    def stop(self):
+        """Finish the fetches in flight, start no new ones and leave run()"""
+        self.stop_event.set()
+
+    def sync(self):
+        self.queue.load(Source.objects.values_list('id', 'next_refresh_on_time'))
+        self.last_sync = time.monotonic()
+
+    def run_once(self):
+        """Refresh one batch of due sources, returns whether there was anything to do"""
+        if self.last_sync is None or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+        process_refresh_jobs(self.workers, self.per_host, stop=self.stop_event)
+
+        now = int(time.time())
+        ids = self.queue.pop_due(now, self.batch_size)
+        if not ids:
+            return False
+        batch = Source.objects.claim(self.worker, Source.objects.filter(id__in=ids), len(ids), self.lease)
+        try:
+            stats = refresh_feeds_concurrently(batch, self.workers, self.per_host, self.callback, stop=self.stop_event)
+        finally:
+            Source.objects.release(self.worker, batch)
+        self.stats.merge(stats)
+
+        # Back into the queue at their new times; sources another worker holds are revisited when its lease ends
+        rows = Source.objects.filter(id__in=ids).values_list('id', 'next_refresh_on_time', 'claimed_by', 'lease_expires')
+        for source_id, due, claimed_by, lease_expires in rows:
+            if claimed_by and claimed_by != self.worker and lease_expires > now:
+                due = max(due, lease_expires)
+            self.queue.push(source_id, due)
+        return True
+
+    def refresh_favicons(self):
+        if not self.favicons or self.stop_event.is_set():
+            return
+        if self.last_favicons is not None and time.monotonic() - self.last_favicons < FAVICON_INTERVAL:
+            return
+        self.last_favicons = time.monotonic()
+        fetched = refresh_favicons(workers=self.workers, stop=self.stop_event)
+        if fetched:
+            logger.info(f"Fetched favicons for {fetched} sites")
+
+    def update_status(self):
+        """Snapshot read by the status endpoint, which runs on another thread"""
+        now = int(time.time())
+        self.status = {
+            'worker': self.worker,
+            'queue_size': len(self.queue),
+            'queue_depth': self.queue.depth(now),
+            'lag_seconds': self.queue.lag(now),
+            'refreshed': self.stats.feeds,
+            'errors': self.stats.errors,
+            'inserted': self.stats.inserted,
+            'not_modified': self.stats.not_modified,
+            'uptime_seconds': now - int(self.started),
+        }
+        return self.status
+
+    def idle_timeout(self):
+        next_due = self.queue.next_due()
+        if next_due is None:
+            return IDLE_INTERVAL
+        return min(max(next_due - time.time(), 0.1), IDLE_INTERVAL)
+
+    def run(self):
+        last_status_log = 0
+        while not self.stop_event.is_set():
+            try:
+                worked = self.run_once()
+                self.refresh_favicons()
+                timeout = 0 if worked else self.idle_timeout()
+            except DatabaseError as e:
+                # Dropped or restarted database; Django reconnects on the next query
+                logger.error(f"Refresh daemon database error: {e}")
+                connection.close()
+                timeout = ERROR_BACKOFF
+            except Exception:
+                logger.exception("Refresh daemon iteration failed")
+                timeout = ERROR_BACKOFF
+            status = self.update_status()
+            if time.monotonic() - last_status_log >= STATUS_LOG_INTERVAL:
+                last_status_log = time.monotonic()
+                logger.info(
+                    f"Refresh queue: {status['queue_depth']} due of {status['queue_size']}, "
+                    f"lag {status['lag_seconds']}s, {status['refreshed']} refreshed, {status['errors']} errors"
+                )
+            if timeout:
+                self.stop_event.wait(timeout)
@@ -0,0 +1,187 @@
+import base64
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+import requests
+from django.db.models import Q
+
+from .models import Favicon, Feed
+from .response_cache import bump_versions
+from .fetcher import get_session
+from .parsing import calculate_checksum
+from .utils import out_of_time
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, without it icons are stored as served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+FAVICON_TTL = 7 * 24 * 60 * 60  # Re-validate icons weekly
+FAVICON_SIZE = 32  # Pixels, icons are downscaled to this when Pillow is available
+FAVICON_MAX_BYTES = 16 * 1024  # Largest icon stored (before base64)
+DOWNLOAD_MAX_BYTES = 512 * 1024  # Largest page or icon we are willing to download
+FETCH_TIMEOUT = (5, 10)  # Connect, read seconds
+DEFAULT_FAVICON_WORKERS = 8
+
+
+class IconLinkParser(HTMLParser):
+    """Collects <link rel="icon"> style hrefs from a page head"""
+
+    RELS = {'icon', 'shortcut icon', 'apple-touch-icon', 'apple-touch-icon-precomposed'}
+
+    def __init__(self):
+        super().__init__()
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'link':
+            return
+        attrs = dict(attrs)
+        if (attrs.get('rel') or '').lower().strip() in self.RELS and attrs.get('href'):
+            self.hrefs.append(attrs['href'])
+
+
+def _download(url):
+    """GET a URL on the shared fetch session, returns (content_type, body) or None; oversized bodies are rejected"""
+    try:
+        with get_session().get(url, timeout=FETCH_TIMEOUT, stream=True) as response:
+            if response.status_code != 200:
+                return None
+            body = bytearray()
+            for chunk in response.iter_content(16 * 1024):
+                body.extend(chunk)
+                if len(body) > DOWNLOAD_MAX_BYTES:
+                    return None
+            return response.headers.get('Content-Type', '').split(';')[0].strip().lower(), bytes(body)
+    except requests.RequestException as e:
+        logger.info(f"  Favicon fetch failed for {url}: {e}")
+        return None
+
+
+def discover_icon_urls(site_url, domain):
+    """Candidate icon URLs: those declared by the site's home page, then /favicon.ico"""
+    base = site_url or f'https://{domain}/'
+    candidates = []
+    page = _download(base)
+    if page and 'html' in page[0]:
+        parser = IconLinkParser()
+        try:
+            parser.feed(page[1].decode('utf-8', errors='replace'))
+        except Exception:
+            pass
+        candidates.extend(urljoin(base, href) for href in parser.hrefs)
+    parsed = urlparse(base)
+    candidates.append(f'{parsed.scheme or "https"}://{parsed.netloc or domain}/favicon.ico')
+    return list(dict.fromkeys(candidates))
+
+
+def shrink_icon(content_type, data):
+    """Downscale and recompress an icon, returns (mime, bytes) or None if unusable"""
+    if Image is not None:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.thumbnail((FAVICON_SIZE, FAVICON_SIZE))
+            output = io.BytesIO()
+            image.convert('RGBA').save(output, format='PNG', optimize=True)
+            content_type, data = 'image/png', output.getvalue()
+        except Exception:
+            return None
+    if not content_type.startswith('image/') or len(data) > FAVICON_MAX_BYTES:
+        return None
+    return content_type, data
+
+
+def fetch_favicon(site_url, domain, stopped=None):
+    """
+    Find and download the icon for a site. Network only, safe to call from
+    worker threads. Returns (icon_url, data_uri_payload) or (None, '').
+    Gives up between downloads once `stopped()` is true.
+    """
+    for url in discover_icon_urls(site_url, domain):
+        if stopped and stopped():
+            break
+        downloaded = _download(url)
+        if not downloaded:
+            continue
+        content_type, data = downloaded
+        if content_type in ('', 'application/octet-stream') and url.endswith('.ico'):
+            content_type = 'image/x-icon'
+        icon = shrink_icon(content_type, data)
+        if icon:
+            # Fever's favicon format: "<mime>;base64,<data>"
+            return url, f'{icon[0]};base64,{base64.b64encode(icon[1]).decode()}'
+    return None, ''
+
+
+def feed_domain(feed):
+    return (feed.domain or urlparse(feed.site_url or feed.url).netloc).lower()
+
+
+def refresh_favicons(feeds=None, workers=DEFAULT_FAVICON_WORKERS, deadline=None, stop=None):
+    """
+    Attach icons to feeds that have none or whose icon is due for
+    re-validation. One Favicon row is shared per domain across all feeds and
+    users. Sites without a usable icon are stored with an empty cache so they
+    are only retried after FAVICON_TTL. Sites not reached before `deadline`
+    (a time.monotonic() value) or once `stop` (a threading.Event) is set are
+    left for the next pass. Returns the number of icons fetched.
+    """
+    def stopped():
+        return out_of_time(deadline, stop)
+
+    now = int(time.time())
+    cutoff = now - FAVICON_TTL
+    if feeds is None:
+        feeds = Feed.objects.filter(Q(favicon__isnull=True) | Q(favicon__last_cached_on_time__lt=cutoff))
+
+    by_domain = {}
+    for feed in feeds:
+        domain = feed_domain(feed)
+        if domain:
+            by_domain.setdefault(domain, []).append(feed)
+    if not by_domain:
+        return 0
+
+    checksums = {domain: calculate_checksum(domain) for domain in by_domain}
+    known = {f.url_checksum: f for f in Favicon.objects.filter(url_checksum__in=checksums.values())}
+
+    stale = [d for d in by_domain if checksums[d] not in known or known[checksums[d]].last_cached_on_time < cutoff]
+
+    def fetch(domain):
+        if stopped():
+            return None
+        icon = fetch_favicon(by_domain[domain][0].site_url, domain, stopped)
+        # An interrupted search is not evidence that the site has no icon
+        return None if stopped() and not icon[1] else icon
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = dict(zip(stale, executor.map(fetch, stale)))
+    fetched = {domain: icon for domain, icon in results.items() if icon is not None}
+
+    for domain, feeds_for_domain in by_domain.items():
+        checksum = checksums[domain]
+        if domain in fetched:
+            url, cache = fetched[domain]
+            favicon = known.get(checksum)
+            if favicon is None:
+                favicon = Favicon(url_checksum=checksum)
+            # Keep a previously good icon if the site is temporarily unreachable
+            if cache or not favicon.cache:
+                favicon.url = (url or f'https://{domain}/favicon.ico')[:255]
+                favicon.cache = cache
+            favicon.last_cached_on_time = now
+            favicon.save()
+            known[checksum] = favicon
+        favicon = known.get(checksum)
+        if favicon is not None and favicon.cache:
+            changed = Feed.objects.filter(id__in=[f.id for f in feeds_for_domain]).exclude(favicon=favicon)
+            if changed.update(favicon=favicon):
+                bump_versions(f.user_id for f in feeds_for_domain)
+
+    return len(fetched)
@@ -0,0 +1,93 @@
+"""
+The fetch stage of a refresh. Every feed download goes through one shared
+requests Session, so connections to a feed host stay open and are reused
+across feeds and batches. Each download has timeouts and a size cap.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .parsing import FetchResult
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+
+FETCH_TIMEOUT = (5, 20)  # Connect, read seconds
+FETCH_MAX_SECONDS = 30  # Whole download, so a server trickling bytes cannot hold a fetch thread
+FEED_MAX_BYTES = 8 * 1024 * 1024  # Largest feed document accepted, after decompression
+POOL_HOSTS = 100  # Hosts with kept-alive connections
+POOL_MAXSIZE = 8  # Connections kept per host, above any sensible per-host fetch limit
+PERMANENT_REDIRECTS = (301, 308)
+
+_session = {'session': None}
+_session_lock = threading.Lock()
+_limits = {'seconds': FETCH_MAX_SECONDS}
+
+
+class FeedFetchError(Exception):
+    """The feed could not be downloaded or the server returned an error"""
+
+
+def get_session():
+    """The shared Session; urllib3's connection pools are safe to use from the fetch threads"""
+    with _session_lock:
+        if _session['session'] is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            # requests already asks for gzip/deflate and decodes the body
+            session.headers['User-Agent'] = USER_AGENT
+            _session['session'] = session
+        return _session['session']
+
+
+def limit_fetch_time(seconds):
+    """Cap every download at `seconds` (e.g. to end inside a deadline), returns the previous cap"""
+    previous, _limits['seconds'] = _limits['seconds'], seconds
+    return previous
+
+
+def fetch_feed(source):
+    """
+    Download a feed without touching the database, returns a FetchResult.
+    Sends the stored validators so unchanged feeds answer 304, and goes
+    straight to where the feed permanently moved if it did.
+    Safe to call from worker threads.
+    """
+    headers = {}
+    if source.etag:
+        headers['If-None-Match'] = source.etag
+    if source.last_modified:
+        headers['If-Modified-Since'] = source.last_modified
+
+    started = time.monotonic()
+    limit = _limits['seconds']
+    timeout = (min(FETCH_TIMEOUT[0], limit), min(FETCH_TIMEOUT[1], limit))
+    try:
+        with get_session().get(source.fetch_url or source.url, headers=headers, timeout=timeout,
+                               stream=True) as response:
+            result = FetchResult(
+                response.status_code, b'', {k.lower(): v for k, v in response.headers.items()}, response.url,
+            )
+            if response.history and all(r.status_code in PERMANENT_REDIRECTS for r in response.history):
+                result.redirect_url = response.url
+
+            # 304 and error statuses are answers too, process_source decides what they mean
+            if 200 <= response.status_code < 300:
+                # Content-Length is the encoded size, it can only understate the decoded one
+                if int(response.headers.get('Content-Length') or 0) > FEED_MAX_BYTES:
+                    raise FeedFetchError(f"Feed larger than {FEED_MAX_BYTES} bytes")
+                body = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    body.extend(chunk)
+                    if len(body) > FEED_MAX_BYTES:
+                        raise FeedFetchError(f"Feed larger than {FEED_MAX_BYTES} bytes")
+                    if time.monotonic() - started > limit:
+                        raise FeedFetchError(f"Download took longer than {limit}s")
+                result.content = bytes(body)
+    except requests.RequestException as e:
+        raise FeedFetchError(str(e)) from e
+    result.elapsed = time.monotonic() - started
+    return result
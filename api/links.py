@@ -0,0 +1,188 @@
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, urldefrag
+
+from django.db.models import BigIntegerField, Count, ExpressionWrapper, F, Max, Min, Sum
+
+from .models import HotLinkBucket, Link
+from .parsing import calculate_checksum
+
+BUCKET_SECONDS = 24 * 60 * 60  # Rollup granularity, one bucket per day
+HOT_LINK_RANGE_DAYS = 7  # Fever's default `range`
+HOT_LINK_MAX_DAYS = 365  # Longest `range` and `offset` accepted
+HOT_LINK_MAX_PAGE = 1000
+LINKS_PER_PAGE = 50
+
+
+class AnchorParser(HTMLParser):
+    """Collects (href, text) for every <a href> in an item body"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.anchors = []
+        self._href = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._href = dict(attrs).get('href')
+            self._text = []
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._href is not None:
+            self.anchors.append((self._href, ' '.join(''.join(self._text).split())))
+            self._href = None
+
+
+def _host(url):
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def extract_links(feed, item):
+    """Build (unsaved) Link rows for the outgoing links in one item's HTML"""
+    if not item.description:
+        return []
+    parser = AnchorParser()
+    try:
+        parser.feed(item.description)
+        parser.close()
+    except Exception:
+        return []
+
+    feed_host = _host(feed.site_url or feed.url)
+    item_url = urldefrag(item.link or '')[0]
+    links = []
+    seen = set()
+    for href, text in parser.anchors:
+        url = urldefrag(urljoin(item.link or '', href.strip()))[0]
+        if urlparse(url).scheme not in ('http', 'https') or url in seen:
+            continue
+        seen.add(url)
+        url_checksum = calculate_checksum(url)
+        links.append(Link(
+            feed=feed,
+            item_id=item.id,
+            is_item=url == item_url,
+            is_local=_host(url) == feed_host,
+            is_first=not links,
+            title=(text or url)[:255],
+            url=url[:255],
+            url_checksum=url_checksum,
+            title_url_checksum=calculate_checksum(f'{text}{url}'),
+            created_on_time=item.created_on_time,
+        ))
+    return links
+
+
+def bucket_start(timestamp):
+    return timestamp // BUCKET_SECONDS * BUCKET_SECONDS
+
+
+def index_item_links(feed, items):
+    """
+    Extract links from freshly ingested items (which must have their ids set),
+    store them in one bulk insert and recount the rollup buckets they touch.
+    """
+    links = [link for item in items for link in extract_links(feed, item)]
+    if not links:
+        return 0
+    Link.objects.bulk_create(links, batch_size=500)
+    url_checksums = sorted({link.url_checksum for link in links})
+    since = min(link.created_on_time for link in links)
+    until = max(link.created_on_time for link in links)
+    for start in range(0, len(url_checksums), 500):
+        update_link_buckets(feed.user_id, url_checksums[start:start + 500], since, until)
+    return len(links)
+
+
+def update_link_buckets(user_id, url_checksums, since, until):
+    """
+    Recount the day buckets for the given URLs between two timestamps. Only
+    links with these checksums are read, via the url_checksum index.
+    """
+    day = ExpressionWrapper(F('created_on_time') / BUCKET_SECONDS * BUCKET_SECONDS, output_field=BigIntegerField())
+    counted = (
+        Link.objects.filter(
+            feed__user_id=user_id,
+            url_checksum__in=list(url_checksums),
+            created_on_time__gte=bucket_start(since),
+            created_on_time__lt=bucket_start(until) + BUCKET_SECONDS,
+            is_blacklisted=False,
+            is_local=False,
+        )
+        .annotate(day=day)
+        .values('url_checksum', 'day')
+        .annotate(weight=Count('item_id', distinct=True), first_link_id=Min('id'))
+    )
+    HotLinkBucket.objects.bulk_create(
+        [
+            HotLinkBucket(
+                user_id=user_id,
+                url_checksum=row['url_checksum'],
+                bucket_on_time=row['day'],
+                link_id=row['first_link_id'],
+                weight=row['weight'],
+            )
+            for row in counted
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'url_checksum', 'bucket_on_time'],
+        update_fields=['link', 'weight'],
+    )
+
+
+def get_hot_links(user, offset=0, days=HOT_LINK_RANGE_DAYS, page=1, now=None):
+    """
+    Fever `links`: the hottest URLs over `days` days ending `offset` days ago,
+    LINKS_PER_PAGE per page. Merges only the day buckets inside the range.
+    """
+    end = bucket_start(now or int(time.time())) + BUCKET_SECONDS - offset * BUCKET_SECONDS
+    start = end - max(days, 1) * BUCKET_SECONDS
+    first = (max(page, 1) - 1) * LINKS_PER_PAGE
+    ranked = list(
+        HotLinkBucket.objects.filter(user=user, bucket_on_time__gte=start, bucket_on_time__lt=end)
+        .values('url_checksum')
+        .annotate(weight=Sum('weight'), link_id=Min('link'), last_bucket=Max('bucket_on_time'))
+        .order_by('-weight', '-last_bucket', 'url_checksum')[first:first + LINKS_PER_PAGE]
+    )
+    if not ranked:
+        return []
+
+    links = Link.objects.select_related('item__state').defer('item__body').in_bulk([row['link_id'] for row in ranked])
+    item_ids = {}
+    linking = Link.objects.filter(
+        feed__user=user,
+        url_checksum__in=[row['url_checksum'] for row in ranked],
+        created_on_time__gte=start,
+        created_on_time__lt=end,
+        is_blacklisted=False,
+        is_local=False,
+    ).order_by('item_id').values_list('url_checksum', 'item_id')
+    for url_checksum, item_id in linking:
+        ids = item_ids.setdefault(url_checksum, [])
+        if not ids or ids[-1] != item_id:
+            ids.append(item_id)
+
+    results = []
+    for row in ranked:
+        link = links[row['link_id']]
+        results.append({
+            'id': link.id,
+            'feed_id': link.feed_id,
+            'item_id': link.item_id,
+            'temperature': row['weight'],
+            'is_item': 1 if link.is_item else 0,
+            'is_local': 1 if link.is_local else 0,
+            'is_saved': 1 if link.item.is_saved else 0,
+            'title': link.title or '',
+            'url': link.url or '',
+            'item_ids': ','.join(map(str, item_ids.get(row['url_checksum'], []))),
+            'weight': row['weight'],
+            'created_on_time': link.created_on_time,
+        })
+    return results
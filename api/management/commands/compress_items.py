@@ -0,0 +1,70 @@
+import time
+
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from django.core.management.base import BaseCommand
+from api.compression import active_dictionary, clear_dictionary_cache, decompress_body, encode_body, train_dictionary
+from api.models import CompressionDictionary, Item
+
+DEFAULT_SAMPLE_SIZE = 2000
+DEFAULT_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Report item body compression, train a shared dictionary and recompress bodies with it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--train', action='store_true',
+                            help='Train a new dictionary from the most recent item bodies and make it active')
+        parser.add_argument('--sample-size', type=int, default=DEFAULT_SAMPLE_SIZE,
+                            help='Number of recent bodies to train on')
+        parser.add_argument('--recompress', action='store_true',
+                            help='Re-encode every stored body with the active dictionary')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Items re-encoded per query')
+
+    def handle(self, *args, **options):
+        if options['train']:
+            self.train(options['sample_size'])
+        if options['recompress']:
+            self.recompress(options['batch_size'])
+        self.report()
+
+    def train(self, sample_size):
+        bodies = Item.objects.exclude(body=None).order_by('-id').values_list('body', flat=True)[:sample_size]
+        samples = [decompress_body(body) for body in bodies]
+        data = train_dictionary(samples)
+        if not data:
+            self.stdout.write(self.style.WARNING('Not enough item bodies to train a dictionary.'))
+            return
+        dictionary = CompressionDictionary.objects.create(
+            data=data, sample_count=len(samples), created_on_time=int(time.time())
+        )
+        clear_dictionary_cache()
+        self.stdout.write(f'Trained dictionary {dictionary.id} ({len(data)} bytes) from {len(samples)} items.')
+
+    def recompress(self, batch_size):
+        dictionary = active_dictionary()
+        last_id = 0
+        updated = 0
+        while True:
+            batch = list(Item.objects.filter(id__gt=last_id).exclude(body=None).order_by('id').only('id', 'body')[:batch_size])
+            if not batch:
+                break
+            for item in batch:
+                item.body = encode_body(decompress_body(item.body), dictionary)
+            Item.objects.bulk_update(batch, ['body'])
+            updated += len(batch)
+            last_id = batch[-1].id
+        self.stdout.write(f'Recompressed {updated} items.')
+
+    def report(self):
+        totals = Item.objects.aggregate(items=Count('id'), raw=Sum('body_size'), stored=Sum(Length('body')))
+        raw = totals['raw'] or 0
+        stored = totals['stored'] or 0
+        ratio = raw / stored if stored else 0
+        dictionary = active_dictionary()
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['items']} items: {raw} bytes of HTML stored in {stored} bytes "
+            f"(ratio {ratio:.2f}x, dictionary {dictionary[0] if dictionary else 'none'})"
+        ))
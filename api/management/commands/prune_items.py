@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.models import Feed, FeverUser
+from api.retention import (
+    feed_policy, prunable_items, prune_feed, FileArchiver, TableArchiver,
+    DEFAULT_BATCH_SIZE, DEFAULT_MIN_ITEMS, DEFAULT_RETENTION_DAYS,
+)
+
+
+class Command(BaseCommand):
+    help = 'Delete old read items according to per-feed and per-user retention policies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=DEFAULT_RETENTION_DAYS,
+                            help='Drop read items older than this many days (0 keeps them), unless the feed or user sets its own')
+        parser.add_argument('--min-items', type=int, default=DEFAULT_MIN_ITEMS,
+                            help='Always keep at least this many newest items per feed, unless the feed or user sets its own')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Items deleted per transaction')
+        parser.add_argument('--archive', action='store_true',
+                            help='Move pruned items into the compressed archive table instead of dropping them')
+        parser.add_argument('--archive-file', type=str,
+                            help='Append pruned items to this gzipped JSON-lines file instead of dropping them')
+        parser.add_argument('--feed-id', type=int, help='Only prune this feed')
+        parser.add_argument('--user', type=str, help='Only prune feeds of this user (email)')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be pruned')
+
+    def handle(self, *args, **options):
+        if options['archive'] and options['archive_file']:
+            raise CommandError('Use either --archive or --archive-file, not both')
+
+        feeds = Feed.objects.select_related('user').order_by('id')
+        if options['feed_id']:
+            feeds = feeds.filter(id=options['feed_id'])
+        if options['user']:
+            try:
+                feeds = feeds.filter(user=FeverUser.objects.get(email=options['user']))
+            except FeverUser.DoesNotExist:
+                raise CommandError(f"User {options['user']} not found")
+
+        archive = None
+        if options['archive']:
+            archive = TableArchiver()
+        elif options['archive_file']:
+            archive = FileArchiver(options['archive_file'])
+
+        total = 0
+        try:
+            for feed in feeds.iterator():
+                days, min_items = feed_policy(feed, options['days'], options['min_items'])
+                if options['dry_run']:
+                    count = prunable_items(feed, days, min_items).count()
+                else:
+                    count = prune_feed(feed, days, min_items, options['batch_size'], archive)
+                if count:
+                    self.stdout.write(f'{feed.title or feed.url}: {count} items (older than {days} days, keeping {min_items})')
+                total += count
+        finally:
+            if archive is not None:
+                archive.close()
+
+        verb = 'Would prune' if options['dry_run'] else 'Pruned'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} items.'))
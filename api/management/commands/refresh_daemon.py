@@ -0,0 +1,88 @@
+import json
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from api.daemon import RefreshDaemon, SYNC_INTERVAL
+from api.models import Source
+from api.utils import default_worker_id, DEFAULT_FETCH_WORKERS, DEFAULT_PER_HOST_LIMIT
+
+
+def serve_status(daemon, port):
+    """Serve the daemon's queue depth, lag and counters as JSON on every path"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(daemon.status).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = 'Refresh feeds continuously as they become due, until stopped with SIGTERM or SIGINT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=DEFAULT_FETCH_WORKERS,
+                            help='Number of concurrent feed fetches')
+        parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST_LIMIT,
+                            help='Maximum concurrent fetches against a single host')
+        parser.add_argument('--batch-size', type=int, default=0,
+                            help='Due feeds claimed per iteration (default twice --workers)')
+        parser.add_argument('--worker-id', default=default_worker_id(),
+                            help='Name this daemon holds its feed leases under (default host:pid)')
+        parser.add_argument('--lease', type=int, default=Source.objects.LEASE_SECONDS, metavar='SECONDS',
+                            help='How long a claimed feed stays reserved if this daemon dies')
+        parser.add_argument('--sync-interval', type=int, default=SYNC_INTERVAL, metavar='SECONDS',
+                            help='How often the schedule is reloaded from the database')
+        parser.add_argument('--status-port', type=int, default=0,
+                            help='Serve queue depth and lag as JSON on this port')
+        parser.add_argument('--skip-favicons', action='store_true',
+                            help='Do not fetch missing or stale favicons')
+
+    def handle(self, *args, **options):
+        def report(source, result, error):
+            if error is None:
+                self.stdout.write(f'Refreshed {source.title or source.url}: {result.inserted} new items.')
+            else:
+                self.stdout.write(self.style.ERROR(f'Error refreshing {source.title or source.url}: {error}'))
+
+        daemon = RefreshDaemon(
+            worker=options['worker_id'],
+            workers=options['workers'],
+            per_host=options['per_host'],
+            batch_size=options['batch_size'] or None,
+            lease=options['lease'],
+            sync_interval=options['sync_interval'],
+            favicons=not options['skip_favicons'],
+            callback=report if options['verbosity'] > 1 else None,
+        )
+
+        def shutdown(signum, frame):
+            self.stdout.write(f'Received {signal.Signals(signum).name}, finishing fetches in flight...')
+            daemon.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        status_server = None
+        if options['status_port']:
+            status_server = serve_status(daemon, options['status_port'])
+            self.stdout.write(f'Status on http://0.0.0.0:{options["status_port"]}/')
+
+        self.stdout.write(self.style.SUCCESS(f'Refresh daemon {daemon.worker} started.'))
+        try:
+            daemon.run()
+        finally:
+            if status_server:
+                status_server.shutdown()
+        self.stdout.write(f'Refresh daemon stopped after {daemon.stats.feeds} refreshes.')
@@ -1,6 +1,16 @@
+import time
 from django.core.management.base import BaseCommand
-from api.models import Feed, FeverUser
-from api.utils import refresh_feed
+from api.favicons import refresh_favicons
+from api.fetcher import FETCH_MAX_SECONDS, limit_fetch_time
+from api.models import FeverUser, Source
+from api.utils import refresh_claimed_sources, process_refresh_jobs, default_worker_id, DEFAULT_FETCH_WORKERS, DEFAULT_PER_HOST_LIMIT
+
+# Seconds between job queue checks while listening
+JOB_POLL_INTERVAL = 5
+
+# With --deadline, no fetch starts in the last this many seconds of the budget,
+# and a fetch may take at most this long, so the run ends inside the budget
+DEFAULT_DEADLINE_RESERVE = 30
 
 
 class Command(BaseCommand):
@@ -9,35 +19,146 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--feed-id', type=int, help='Refresh specific feed ID')
         parser.add_argument('--user', type=str, help='User email to refresh feeds for')
+        parser.add_argument('--all', action='store_true',
+                            help='Refresh every selected feed, not only the ones that are due')
+        parser.add_argument('--workers', type=int, default=DEFAULT_FETCH_WORKERS,
+                            help='Number of concurrent feed fetches')
+        parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST_LIMIT,
+                            help='Maximum concurrent fetches against a single host')
+        parser.add_argument('--skip-favicons', action='store_true',
+                            help='Do not fetch missing or stale favicons after the run')
+        parser.add_argument('--jobs-only', action='store_true',
+                            help='Only process refreshes queued through the API')
+        parser.add_argument('--listen', type=int, default=0, metavar='SECONDS',
+                            help='Keep processing queued refreshes for this many seconds after the run')
+        parser.add_argument('--deadline', type=int, default=0, metavar='SECONDS',
+                            help='Time budget for the run: the most overdue feeds go first and no fetch '
+                                 'starts once the budget is nearly spent')
+        parser.add_argument('--reserve', type=int, default=DEFAULT_DEADLINE_RESERVE, metavar='SECONDS',
+                            help='With --deadline, stop starting fetches this long before the budget ends')
+        parser.add_argument('--worker-id', default=default_worker_id(),
+                            help='Name this worker holds its feed leases under (default host:pid)')
+        parser.add_argument('--lease', type=int, default=Source.objects.LEASE_SECONDS, metavar='SECONDS',
+                            help='How long a claimed feed stays reserved if this worker dies')
 
     def handle(self, *args, **options):
+        started = time.monotonic()
+        self.deadline = None
+        previous_limit = None
+        if options['deadline']:
+            self.deadline = started + max(options['deadline'] - options['reserve'], 0)
+            # Bounds fetches already running when the deadline passes
+            if options['reserve'] > 0:
+                previous_limit = limit_fetch_time(min(options['reserve'], FETCH_MAX_SECONDS))
+        try:
+            self.run(options, started)
+        finally:
+            if previous_limit is not None:
+                limit_fetch_time(previous_limit)
+
+    def run(self, options, started):
+        self.run_jobs(options)
+        if not options['jobs_only']:
+            self.refresh(options)
+            if not options['skip_favicons'] and not self.past_deadline():
+                self.refresh_favicons(options)
+
+        while time.monotonic() - started < options['listen'] and not self.past_deadline():
+            time.sleep(JOB_POLL_INTERVAL)
+            self.run_jobs(options)
+
+    def past_deadline(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def run_jobs(self, options):
+        try:
+            processed = process_refresh_jobs(options['workers'], options['per_host'], self.deadline)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'Database not ready or error accessing refresh jobs: {e}'))
+            return
+        if processed:
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} queued refresh requests.'))
+
+    def refresh_favicons(self, options):
+        try:
+            fetched = refresh_favicons(workers=options['workers'], deadline=self.deadline)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error refreshing favicons: {e}'))
+            return
+        if fetched:
+            self.stdout.write(f'Fetched favicons for {fetched} sites.')
+
+    def refresh(self, options):
         feed_id = options.get('feed_id')
         user_email = options.get('user')
 
+        # Each subscribed URL is fetched once, however many users follow it
         if user_email:
             try:
                 user = FeverUser.objects.get(email=user_email)
-                feeds = Feed.objects.filter(user=user)
+                sources = Source.objects.filter(feeds__user=user).distinct()
             except FeverUser.DoesNotExist:
                 self.stdout.write(self.style.ERROR(f'User {user_email} not found'))
                 return
         elif feed_id:
-            feeds = Feed.objects.filter(id=feed_id)
+            sources = Source.objects.filter(feeds__id=feed_id)
         else:
-            feeds = Feed.objects.all()
+            sources = Source.objects.all()
+
+        # An explicitly requested feed is always refreshed, otherwise follow the schedule.
+        # Sources are claimed most overdue first, so a run cut short by its deadline never starves the tail
+        now = int(time.time())
+        if not feed_id and not options['all']:
+            sources = sources.filter(next_refresh_on_time__lte=now)
 
         try:
-            if not feeds.exists():
+            total = sources.count()
+            if not total:
                 self.stdout.write(self.style.WARNING('No feeds found to refresh.'))
                 return
         except Exception as e:
             self.stdout.write(self.style.WARNING(f'Database not ready or error accessing feeds: {e}'))
             return
 
-        for feed in feeds:
-            self.stdout.write(f'Refreshing feed: {feed.title or feed.url}')
-            try:
-                new_items = refresh_feed(feed)
-                self.stdout.write(self.style.SUCCESS(f'Successfully refreshed {feed.title}. Added {new_items} new items.'))
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error refreshing {feed.title}: {str(e)}'))
+        def report(source, result, error):
+            if error is None:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Successfully refreshed {source.title or source.url}. Added {result.inserted} new items, '
+                    f'skipped {result.skipped} existing.'
+                ))
+            else:
+                self.stdout.write(self.style.ERROR(f'Error refreshing {source.title or source.url}: {str(error)}'))
+
+        # Leased in batches, so any number of workers can run this at once
+        stats = refresh_claimed_sources(
+            sources,
+            worker=options['worker_id'],
+            workers=options['workers'],
+            per_host=options['per_host'],
+            callback=report,
+            deadline=self.deadline,
+            lease=options['lease'],
+        )
+
+        self.stdout.write(
+            f'Refreshed {stats.feeds} feeds in {stats.elapsed:.1f}s '
+            f'({stats.feeds_per_second:.2f} feeds/s, p95 fetch {stats.p95_fetch_time:.2f}s). '
+            f'{stats.inserted} items inserted, {stats.skipped} skipped, '
+            f'{stats.not_modified} not modified, {stats.errors} errors.'
+        )
+        if self.deadline is not None:
+            self.report_deadline(options, sources, total, stats, now)
+
+    def report_deadline(self, options, sources, total, stats, now):
+        """How far the run got through the selected feeds within its budget"""
+        message = f'Deadline run: {stats.feeds} of {total} feeds within the {options["deadline"]}s budget'
+        # Counted from the database, other workers may have refreshed some of the rest
+        left = sources.filter(last_refreshed_on_time__lt=now).exclude(lease_expires__gte=int(time.time()))
+        oldest = left.order_by('next_refresh_on_time').first()
+        if oldest is None:
+            self.stdout.write(self.style.SUCCESS(f'{message}.'))
+            return
+        overdue = max(now - oldest.next_refresh_on_time, 0)
+        self.stdout.write(self.style.WARNING(
+            f'{message}; {left.count()} left for the next run, the most overdue by {overdue // 60} minutes.'
+        ))
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:06
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_items(apps, schema_editor):
+    """Keep the oldest row for every (feed, uid) pair so the constraint can be created"""
+    Item = apps.get_model('api', 'Item')
+    duplicates = (
+        Item.objects.exclude(uid=None)
+        .values('feed_id', 'uid')
+        .annotate(keep_id=Min('id'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for dup in duplicates.iterator():
+        Item.objects.filter(feed_id=dup['feed_id'], uid=dup['uid']).exclude(id=dup['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_feed_etag_last_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_items, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='item',
+            name='fever_items_feed_id_51e08c_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='item',
+            constraint=models.UniqueConstraint(fields=('feed', 'uid'), name='fever_items_feed_uid_uniq'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_item_feed_uid_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='error_count',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='next_refresh_on_time',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='refresh_interval',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='feed',
+            index=models.Index(fields=['next_refresh_on_time'], name='fever_feeds_next_re_fdfb9f_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_feed_refresh_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('requested_on_time', models.BigIntegerField()),
+                ('started_on_time', models.BigIntegerField(default=0)),
+                ('finished_on_time', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refresh_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'fever_refresh_jobs',
+                'indexes': [models.Index(fields=['status', 'requested_on_time'], name='fever_refre_status_5e4125_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('user',), name='fever_refresh_jobs_one_active_per_user')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_refreshjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemIdCache',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='item_id_cache', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread_ids', models.BinaryField()),
+                ('saved_ids', models.BinaryField()),
+            ],
+            options={
+                'db_table': 'fever_item_id_cache',
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_item_user(apps, schema_editor):
+    """Copy feed.user onto items, one bounded batch at a time"""
+    Feed = apps.get_model('api', 'Feed')
+    Item = apps.get_model('api', 'Item')
+    for feed_id, user_id in Feed.objects.values_list('id', 'user_id').iterator():
+        pending = Item.objects.filter(feed_id=feed_id, user__isnull=True).order_by('id')
+        while True:
+            ids = list(pending.values_list('id', flat=True)[:BACKFILL_BATCH_SIZE])
+            if not ids:
+                break
+            Item.objects.filter(id__in=ids).update(user_id=user_id)
+
+
+class Migration(migrations.Migration):
+
+    # Let each backfill batch commit on its own instead of holding one long transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0011_itemidcache'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='item',
+            name='fever_items_read_on_7fb771_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='item',
+            name='fever_items_is_save_777046_idx',
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_item_user, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['user', 'read_on_time', 'id'], name='fever_items_user_read_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['user', '-id'], name='fever_items_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(condition=models.Q(('is_saved', True)), fields=['user', 'id'], name='fever_items_user_saved_idx'),
+        ),
+    ]
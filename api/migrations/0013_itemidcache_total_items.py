@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:12
+
+from django.db import migrations, models
+
+
+def drop_caches(apps, schema_editor):
+    """Existing rows have no count yet; they are rebuilt on next use"""
+    apps.get_model('api', 'ItemIdCache').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_item_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemidcache',
+            name='total_items',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(drop_caches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_itemidcache_total_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_checksum', models.BigIntegerField()),
+                ('weight', models.IntegerField(default=0)),
+                ('oldest_linked_on_time', models.BigIntegerField(default=0)),
+                ('last_linked_on_time', models.BigIntegerField(default=0)),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.link')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hot_links', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'fever_hot_links',
+                'indexes': [models.Index(fields=['user', '-weight'], name='fever_hot_l_user_id_45bed8_idx'), models.Index(fields=['oldest_linked_on_time'], name='fever_hot_l_oldest__83f7ad_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'url_checksum'), name='fever_hot_links_user_url_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import BigIntegerField, Count, ExpressionWrapper, F, Min
+
+DAY = 24 * 60 * 60
+
+
+def backfill_buckets(apps, schema_editor):
+    """Roll existing links up into day buckets"""
+    Link = apps.get_model('api', 'Link')
+    HotLinkBucket = apps.get_model('api', 'HotLinkBucket')
+    day = ExpressionWrapper(F('created_on_time') / DAY * DAY, output_field=BigIntegerField())
+    counted = (
+        Link.objects.filter(is_blacklisted=False, is_local=False)
+        .annotate(day=day)
+        .values('feed__user_id', 'url_checksum', 'day')
+        .annotate(weight=Count('item_id', distinct=True), first_link_id=Min('id'))
+        .order_by()
+    )
+    HotLinkBucket.objects.bulk_create(
+        (
+            HotLinkBucket(user_id=row['feed__user_id'], url_checksum=row['url_checksum'],
+                          bucket_on_time=row['day'], link_id=row['first_link_id'], weight=row['weight'])
+            for row in counted.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_hotlink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotLinkBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_checksum', models.BigIntegerField()),
+                ('bucket_on_time', models.BigIntegerField()),
+                ('weight', models.IntegerField(default=0)),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.link')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hot_link_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'fever_hot_link_buckets',
+            },
+        ),
+        migrations.DeleteModel(
+            name='HotLink',
+        ),
+        migrations.AddIndex(
+            model_name='hotlinkbucket',
+            index=models.Index(fields=['user', 'bucket_on_time'], name='fever_hot_l_user_id_8380ff_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hotlinkbucket',
+            constraint=models.UniqueConstraint(fields=('user', 'url_checksum', 'bucket_on_time'), name='fever_hot_link_buckets_uniq'),
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_hotlinkbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('user_id', models.BigIntegerField(db_index=True)),
+                ('feed_id', models.BigIntegerField()),
+                ('data', models.BinaryField()),
+                ('archived_on_time', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'fever_items_archive',
+            },
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='retention_days',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='retention_min_items',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feveruser',
+            name='retention_days',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feveruser',
+            name='retention_min_items',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
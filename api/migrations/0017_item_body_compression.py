@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:22
+
+from django.db import migrations, models
+
+from api.compression import decompress_body, encode_body
+
+COMPRESS_BATCH_SIZE = 1000
+
+
+def compress_descriptions(apps, schema_editor):
+    """Move description into the compressed body column, one bounded batch at a time"""
+    Item = apps.get_model('api', 'Item')
+    last_id = 0
+    while True:
+        batch = list(
+            Item.objects.filter(id__gt=last_id).order_by('id').only('id', 'description')[:COMPRESS_BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for item in batch:
+            item.body = encode_body(item.description)
+            item.body_size = len(item.description.encode('utf-8')) if item.description else 0
+        Item.objects.bulk_update(batch, ['body', 'body_size'])
+        last_id = batch[-1].id
+
+
+def decompress_bodies(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    last_id = 0
+    while True:
+        batch = list(Item.objects.filter(id__gt=last_id).order_by('id').only('id', 'body')[:COMPRESS_BATCH_SIZE])
+        if not batch:
+            break
+        for item in batch:
+            item.description = decompress_body(item.body)
+        Item.objects.bulk_update(batch, ['description'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    # Let each batch commit on its own instead of holding one long transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0016_item_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('sample_count', models.IntegerField(default=0)),
+                ('created_on_time', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'fever_compression_dictionaries',
+            },
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='body',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='body_size',
+            field=models.IntegerField(default=0),
+        ),
+        # No dictionary exists yet; run `compress_items --train --recompress` afterwards
+        migrations.RunPython(compress_descriptions, decompress_bodies),
+        migrations.RemoveField(
+            model_name='item',
+            name='description',
+        ),
+    ]
@@ -0,0 +1,130 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:27
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _url_checksum(url):
+    return int(hashlib.md5(url.encode()).hexdigest()[:15], 16)
+
+
+def create_sources(apps, schema_editor):
+    """
+    One Source per distinct feed URL, carrying over the fetch state. Sources
+    are keyed by the checksum of the URL itself, not the feed's url_checksum,
+    which callers may have set differently.
+    """
+    Feed = apps.get_model('api', 'Feed')
+    Source = apps.get_model('api', 'Source')
+    for feed in Feed.objects.filter(source__isnull=True).order_by('id').iterator():
+        source, _ = Source.objects.get_or_create(url_checksum=_url_checksum(feed.url), defaults={
+            'url': feed.url,
+            'title': feed.title,
+            'site_url': feed.site_url,
+            'domain': feed.domain,
+            'last_refreshed_on_time': feed.last_refreshed_on_time,
+            'last_updated_on_time': feed.last_updated_on_time,
+            'last_added_on_time': feed.last_added_on_time,
+            'etag': feed.etag,
+            'last_modified': feed.last_modified,
+            'next_refresh_on_time': feed.next_refresh_on_time,
+            'refresh_interval': feed.refresh_interval,
+            'error_count': feed.error_count,
+        })
+        Feed.objects.filter(id=feed.id).update(source=source)
+
+
+def restore_fetch_state(apps, schema_editor):
+    Feed = apps.get_model('api', 'Feed')
+    for feed in Feed.objects.select_related('source').iterator():
+        source = feed.source
+        Feed.objects.filter(id=feed.id).update(
+            etag=source.etag,
+            last_modified=source.last_modified,
+            next_refresh_on_time=source.next_refresh_on_time,
+            refresh_interval=source.refresh_interval,
+            error_count=source.error_count,
+        )
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_item_body_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Source',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=255)),
+                ('url_checksum', models.BigIntegerField(blank=True, unique=True)),
+                ('title', models.CharField(blank=True, max_length=255, null=True)),
+                ('site_url', models.CharField(blank=True, max_length=255, null=True)),
+                ('domain', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_refreshed_on_time', models.BigIntegerField(default=0)),
+                ('last_updated_on_time', models.BigIntegerField(default=0)),
+                ('last_added_on_time', models.BigIntegerField(default=0)),
+                ('etag', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=255, null=True)),
+                ('next_refresh_on_time', models.BigIntegerField(default=0)),
+                ('refresh_interval', models.IntegerField(default=0)),
+                ('error_count', models.SmallIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'fever_sources',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='source',
+            index=models.Index(fields=['next_refresh_on_time'], name='fever_sourc_next_re_a444c4_idx'),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='source',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='feeds', to='api.source'),
+        ),
+        migrations.RunPython(create_sources, restore_fetch_state),
+        migrations.RemoveIndex(
+            model_name='feed',
+            name='fever_feeds_next_re_fdfb9f_idx',
+        ),
+        migrations.RemoveField(
+            model_name='feed',
+            name='error_count',
+        ),
+        migrations.RemoveField(
+            model_name='feed',
+            name='etag',
+        ),
+        migrations.RemoveField(
+            model_name='feed',
+            name='last_modified',
+        ),
+        migrations.RemoveField(
+            model_name='feed',
+            name='next_refresh_on_time',
+        ),
+        migrations.RemoveField(
+            model_name='feed',
+            name='refresh_interval',
+        ),
+        migrations.AlterField(
+            model_name='feed',
+            name='url_checksum',
+            field=models.BigIntegerField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='feed',
+            name='source',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='feeds', to='api.source'),
+        ),
+        migrations.AddConstraint(
+            model_name='feed',
+            constraint=models.UniqueConstraint(fields=('user', 'url_checksum'), name='fever_feeds_user_url_uniq'),
+        ),
+    ]
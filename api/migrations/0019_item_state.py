@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+COPY_BATCH_SIZE = 5000
+
+
+def copy_item_state(apps, schema_editor):
+    """Move read/saved flags into the narrow table, one bounded batch at a time"""
+    Item = apps.get_model('api', 'Item')
+    ItemState = apps.get_model('api', 'ItemState')
+    last_id = 0
+    while True:
+        rows = list(
+            Item.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'user_id', 'feed_id', 'created_on_time', 'read_on_time', 'is_saved')[:COPY_BATCH_SIZE]
+        )
+        if not rows:
+            break
+        ItemState.objects.bulk_create([
+            ItemState(item_id=item_id, user_id=user_id, feed_id=feed_id, created_on_time=created_on_time,
+                      read_on_time=read_on_time, is_saved=is_saved)
+            for item_id, user_id, feed_id, created_on_time, read_on_time, is_saved in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def restore_item_state(apps, schema_editor):
+    Item = apps.get_model('api', 'Item')
+    ItemState = apps.get_model('api', 'ItemState')
+    for item_id, read_on_time in ItemState.objects.filter(read_on_time__gt=0).values_list('item_id', 'read_on_time').iterator():
+        Item.objects.filter(id=item_id).update(read_on_time=read_on_time)
+    Item.objects.filter(id__in=ItemState.objects.filter(is_saved=True).values('item_id')).update(is_saved=True)
+
+
+class Migration(migrations.Migration):
+
+    # Let each copy batch commit on its own instead of holding one long transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0018_shared_sources'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemState',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='api.item')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='item_states', to=settings.AUTH_USER_MODEL)),
+                ('feed', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='item_states', to='api.feed')),
+                ('created_on_time', models.BigIntegerField()),
+                ('read_on_time', models.BigIntegerField(default=0)),
+                ('is_saved', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'fever_item_states',
+            },
+        ),
+        migrations.RunPython(copy_item_state, restore_item_state),
+        # Indexes are built once the rows are in
+        migrations.AddIndex(
+            model_name='itemstate',
+            index=models.Index(fields=['user', 'read_on_time', 'item'], name='fever_states_user_read_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemstate',
+            index=models.Index(fields=['feed', 'read_on_time', 'created_on_time'], name='fever_states_feed_read_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemstate',
+            index=models.Index(condition=models.Q(('is_saved', True)), fields=['user', 'item'], name='fever_states_user_saved_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='item',
+            name='fever_items_user_read_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='item',
+            name='fever_items_user_saved_idx',
+        ),
+        migrations.RemoveField(
+            model_name='item',
+            name='is_saved',
+        ),
+        migrations.RemoveField(
+            model_name='item',
+            name='read_on_time',
+        ),
+    ]
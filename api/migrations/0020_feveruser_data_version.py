@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:38
+
+import api.response_cache
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_item_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feveruser',
+            name='data_version',
+            field=models.BigIntegerField(default=api.response_cache.initial_version),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_feveruser_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='claimed_by',
+            field=models.CharField(blank=True, default='', max_length=128),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='lease_expires',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_source_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='fetch_url',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='last_fetch_bytes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='last_fetch_ms',
+            field=models.IntegerField(default=0),
+        ),
+    ]
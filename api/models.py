@@ -1,7 +1,15 @@
-from django.db import models
+from django.db import connections, models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from array import array
+import bisect
 import hashlib
+import itertools
 import time
+import zlib
+
+from .auth_cache import api_key_cache
+from .compression import compress_body, decompress_body
+from .response_cache import bump_versions, initial_version
 
 
 class FeverUserManager(BaseUserManager):
@@ -42,6 +50,10 @@ class FeverUser(AbstractBaseUser, PermissionsMixin):
     version = models.IntegerField(default=143)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Retention policy defaults for this user's feeds, see prune_items (null = command default)
+    retention_days = models.IntegerField(null=True, blank=True)
+    retention_min_items = models.IntegerField(null=True, blank=True)
+    data_version = models.BigIntegerField(default=initial_version)  # Bumped whenever API responses change, see response_cache
 
     objects = FeverUserManager()
 
@@ -56,6 +68,8 @@ class FeverUser(AbstractBaseUser, PermissionsMixin):
         The actual Django password is stored securely using Django's password hashing.
         """
         super().set_password(raw_password)
+        # The old key must stop authenticating right away
+        api_key_cache.invalidate_user(self)
         if raw_password:
             # MD5 required for Fever API compatibility - not for password storage
             self.fever_api_key = hashlib.md5(f"{self.email}:{raw_password}".encode()).hexdigest()
@@ -108,14 +122,99 @@ class Group(models.Model):
         ]
 
 
+def _url_checksum(url):
+    # Calculate checksum compatible with BigIntegerField (signed 64-bit)
+    # We take first 15 hex chars (60 bits) to be safe
+    return int(hashlib.md5(url.encode()).hexdigest()[:15], 16)
+
+
+class SourceManager(models.Manager):
+    # Longer than any fetch can take (see refresh_feeds --reserve), so a live
+    # worker never loses a source it is still refreshing
+    LEASE_SECONDS = 10 * 60
+
+    def claimable(self, worker, now=None):
+        """Sources nobody holds a live lease on, or that this worker holds already"""
+        now = now or int(time.time())
+        return self.filter(models.Q(lease_expires__lt=now) | models.Q(claimed_by=worker))
+
+    def claim(self, worker, sources, limit, lease=None):
+        """
+        Lease up to `limit` of `sources` (a queryset) to `worker`, most overdue
+        first, and return them. Any number of workers can claim from the same
+        set at once without two of them getting the same source.
+        """
+        now = int(time.time())
+        expires = now + (lease or self.LEASE_SECONDS)
+        candidates = self.claimable(worker, now).filter(id__in=sources.values('id')).order_by(
+            'next_refresh_on_time', 'last_refreshed_on_time', 'id'
+        )
+        if connections[self.db].features.has_select_for_update_skip_locked:
+            # Rows another worker is claiming right now are skipped instead of waited on
+            with transaction.atomic():
+                ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+                self.filter(id__in=ids).update(claimed_by=worker, lease_expires=expires)
+        else:
+            # SQLite serializes writes, so re-checking the lease in the UPDATE is an atomic
+            # compare-and-set; rows taken since the SELECT are simply not ours
+            ids = list(candidates.values_list('id', flat=True)[:limit])
+            self.claimable(worker, now).filter(id__in=ids).update(claimed_by=worker, lease_expires=expires)
+            ids = list(self.filter(id__in=ids, claimed_by=worker, lease_expires=expires).values_list('id', flat=True))
+        return list(self.filter(id__in=ids).order_by('next_refresh_on_time', 'last_refreshed_on_time', 'id'))
+
+    def release(self, worker, sources):
+        return self.filter(id__in=[source.id for source in sources], claimed_by=worker).update(
+            claimed_by='', lease_expires=0
+        )
+
+
+class Source(models.Model):
+    """A feed URL as fetched, shared by every subscribed user's Feed"""
+    url = models.CharField(max_length=255)
+    url_checksum = models.BigIntegerField(unique=True, blank=True)
+    title = models.CharField(max_length=255, null=True, blank=True)
+    site_url = models.CharField(max_length=255, null=True, blank=True)
+    domain = models.CharField(max_length=255, null=True, blank=True)
+    last_refreshed_on_time = models.BigIntegerField(default=0)
+    last_updated_on_time = models.BigIntegerField(default=0)
+    last_added_on_time = models.BigIntegerField(default=0)
+    etag = models.CharField(max_length=255, null=True, blank=True)  # HTTP validators for conditional GET
+    last_modified = models.CharField(max_length=255, null=True, blank=True)
+    next_refresh_on_time = models.BigIntegerField(default=0)  # Adaptive schedule, see utils.schedule_next_refresh
+    refresh_interval = models.IntegerField(default=0)  # Seconds
+    error_count = models.SmallIntegerField(default=0)  # Consecutive failed refreshes
+    claimed_by = models.CharField(max_length=128, blank=True, default='')  # Worker refreshing it, see SourceManager.claim
+    lease_expires = models.BigIntegerField(default=0)
+    fetch_url = models.TextField(blank=True, default='')  # Where url permanently redirects to, of any length
+    last_fetch_ms = models.IntegerField(default=0)  # Duration and size of the last successful download
+    last_fetch_bytes = models.IntegerField(default=0)
+
+    objects = SourceManager()
+
+    def save(self, *args, **kwargs):
+        if not self.url_checksum and self.url:
+            self.url_checksum = _url_checksum(self.url)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.title or self.url
+
+    class Meta:
+        db_table = 'fever_sources'
+        indexes = [
+            models.Index(fields=['next_refresh_on_time']),
+        ]
+
+
 class Feed(models.Model):
-    """RSS/Atom feeds"""
+    """A user's subscription to a Source; its id is the Fever feed id"""
     user = models.ForeignKey(FeverUser, on_delete=models.CASCADE, related_name='feeds')
+    source = models.ForeignKey(Source, on_delete=models.PROTECT, related_name='feeds')
     favicon = models.ForeignKey(Favicon, on_delete=models.SET_NULL, null=True, blank=True)
     title = models.CharField(max_length=255, null=True, blank=True)  # Canonical title from RSS
     user_title = models.CharField(max_length=255, null=True, blank=True)  # User-defined display title
     url = models.CharField(max_length=255)
-    url_checksum = models.BigIntegerField(unique=True, blank=True)
+    url_checksum = models.BigIntegerField(blank=True)
     site_url = models.CharField(max_length=255, null=True, blank=True)
     domain = models.CharField(max_length=255, null=True, blank=True)
     requires_auth = models.BooleanField(default=False)
@@ -129,17 +228,37 @@ class Feed(models.Model):
     last_refreshed_on_time = models.BigIntegerField(default=0)
     last_updated_on_time = models.BigIntegerField(default=0)
     last_added_on_time = models.BigIntegerField(default=0)
+    retention_days = models.IntegerField(null=True, blank=True)  # Overrides the user's policy
+    retention_min_items = models.IntegerField(null=True, blank=True)
     groups = models.ManyToManyField(Group, through='FeedGroup', related_name='feeds')
 
     def save(self, *args, **kwargs):
+        previous_source_id = None
+        if self.source_id is not None and self.url and self.source.url != self.url:
+            # The URL was edited (admin): follow the new address, and let the old Source go below
+            previous_source_id, self.source = self.source_id, None
+            self.url_checksum = _url_checksum(self.url)
         if not self.url_checksum and self.url:
-            # Calculate checksum compatible with BigIntegerField (signed 64-bit)
-            # We take first 15 hex chars (60 bits) to be safe
-            self.url_checksum = int(hashlib.md5(self.url.encode()).hexdigest()[:15], 16)
+            self.url_checksum = _url_checksum(self.url)
+        if self.source_id is None and self.url:
+            # Subscribing to a URL someone else already follows shares its Source. Sources are keyed
+            # by their own checksum of the URL, whatever url_checksum the caller gave the Feed.
+            self.source, _ = Source.objects.get_or_create(url_checksum=_url_checksum(self.url), defaults={
+                'url': self.url,
+                'title': self.title,
+                'site_url': self.site_url,
+                'domain': self.domain,
+                'last_added_on_time': self.last_added_on_time or int(time.time()),
+            })
         super().save(*args, **kwargs)
+        if previous_source_id is not None:
+            Source.objects.filter(id=previous_source_id, feeds__isnull=True).delete()
 
     class Meta:
         db_table = 'fever_feeds'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'url_checksum'], name='fever_feeds_user_url_uniq'),
+        ]
         indexes = [
             models.Index(fields=['favicon']),
             models.Index(fields=['title']),
@@ -165,79 +284,298 @@ class FeedGroup(models.Model):
 
 
 class ItemManager(models.Manager):
+    def get_queryset(self):
+        # Bodies are only read when serializing `html`; access loads them on demand
+        return super().get_queryset().defer('body')
+
+    def _mark(self, user, qs, cache_change, **values):
+        """
+        Apply a read/saved change to the items in qs that actually change and
+        update the user's cached ID sets with the same IDs.
+        """
+        with transaction.atomic():
+            ids = list(qs.values_list('pk', flat=True))
+            if not ids:
+                return 0
+            qs.update(**values)
+            ItemIdCache.objects.apply(user, **{cache_change: ids})
+            bump_versions([getattr(user, 'pk', user)])
+        return len(ids)
+
     def mark_as_read(self, user, item_ids):
         """Mark specific items as read"""
         if not item_ids:
             return 0
-        return self.filter(id__in=item_ids, feed__user=user).update(read_on_time=int(time.time()))
+        qs = ItemState.objects.filter(item_id__in=item_ids, user=user, read_on_time=0)
+        return self._mark(user, qs, 'unread_remove', read_on_time=int(time.time()))
 
     def mark_as_unread(self, user, item_ids):
         """Mark specific items as unread"""
         if not item_ids:
             return 0
-        return self.filter(id__in=item_ids, feed__user=user).update(read_on_time=0)
+        qs = ItemState.objects.filter(item_id__in=item_ids, user=user, read_on_time__gt=0)
+        return self._mark(user, qs, 'unread_add', read_on_time=0)
 
     def mark_as_saved(self, user, item_ids):
         """Mark specific items as saved"""
         if not item_ids:
             return 0
-        return self.filter(id__in=item_ids, feed__user=user).update(is_saved=True)
+        qs = ItemState.objects.filter(item_id__in=item_ids, user=user, is_saved=False)
+        return self._mark(user, qs, 'saved_add', is_saved=True)
 
     def mark_as_unsaved(self, user, item_ids):
         """Mark specific items as unsaved"""
         if not item_ids:
             return 0
-        return self.filter(id__in=item_ids, feed__user=user).update(is_saved=False)
+        qs = ItemState.objects.filter(item_id__in=item_ids, user=user, is_saved=True)
+        return self._mark(user, qs, 'saved_remove', is_saved=False)
 
-    def mark_feed_as_read(self, user, feed_id, before_time=None):
-        """Mark all items in a feed as read"""
-        qs = self.filter(feed_id=feed_id, feed__user=user)
+    def _feed_items(self, user, feed_id, before_time):
+        qs = ItemState.objects.filter(feed_id=feed_id, user=user)
         if before_time:
             qs = qs.filter(created_on_time__lte=int(before_time))
-        return qs.update(read_on_time=int(time.time()))
+        return qs
 
-    def mark_group_as_read(self, user, group_id, before_time=None):
-        """Mark all items in a group as read"""
-        # We need to import FeedGroup here to avoid circular imports if it was at top level,
-        # but since they are in the same file, we can just use the model name string or class if defined.
-        # FeedGroup is defined above, so we can use it.
+    def _group_items(self, user, group_id, before_time):
+        # FeedGroup is defined above, so we can use it directly.
         feed_ids = FeedGroup.objects.filter(group_id=group_id, group__user=user).values_list('feed_id', flat=True)
-        qs = self.filter(feed_id__in=feed_ids)
+        qs = ItemState.objects.filter(user=user, feed_id__in=feed_ids)
         if before_time:
             qs = qs.filter(created_on_time__lte=int(before_time))
-        return qs.update(read_on_time=int(time.time()))
+        return qs
+
+    def mark_feed_as_read(self, user, feed_id, before_time=None):
+        """Mark all items in a feed as read"""
+        qs = self._feed_items(user, feed_id, before_time).filter(read_on_time=0)
+        return self._mark(user, qs, 'unread_remove', read_on_time=int(time.time()))
+
+    def mark_feed_as_unread(self, user, feed_id, before_time=None):
+        """Mark all items in a feed as unread"""
+        qs = self._feed_items(user, feed_id, before_time).filter(read_on_time__gt=0)
+        return self._mark(user, qs, 'unread_add', read_on_time=0)
+
+    def mark_group_as_read(self, user, group_id, before_time=None):
+        """Mark all items in a group as read"""
+        qs = self._group_items(user, group_id, before_time).filter(read_on_time=0)
+        return self._mark(user, qs, 'unread_remove', read_on_time=int(time.time()))
+
+    def mark_group_as_unread(self, user, group_id, before_time=None):
+        """Mark all items in a group as unread"""
+        qs = self._group_items(user, group_id, before_time).filter(read_on_time__gt=0)
+        return self._mark(user, qs, 'unread_add', read_on_time=0)
 
 
 class Item(models.Model):
     """Feed items (articles)"""
     feed = models.ForeignKey(Feed, on_delete=models.CASCADE, related_name='items')
+    # Denormalized from feed.user so API queries avoid the join; indexed below
+    user = models.ForeignKey(FeverUser, on_delete=models.CASCADE, related_name='items', null=True, db_index=False)
     uid = models.TextField(null=True, blank=True)
     title = models.CharField(max_length=512, null=True, blank=True)
     author = models.CharField(max_length=255, null=True, blank=True)
-    description = models.TextField(null=True, blank=True)
+    body = models.BinaryField(null=True, blank=True)  # Compressed HTML, see compression.py
+    body_size = models.IntegerField(default=0)  # Uncompressed bytes, for reporting
     link = models.TextField(null=True, blank=True)
     url_checksum = models.BigIntegerField()
-    read_on_time = models.BigIntegerField(default=0)
-    is_saved = models.BooleanField(default=False)
     created_on_time = models.BigIntegerField()
     added_on_time = models.BigIntegerField()
 
     objects = ItemManager()
 
+    def _item_state(self):
+        try:
+            return self.state
+        except ItemState.DoesNotExist:
+            # Not saved yet; the state row is written along with the item
+            self.state = ItemState(item=self)
+            return self.state
+
+    @property
+    def read_on_time(self):
+        return self._item_state().read_on_time
+
+    @read_on_time.setter
+    def read_on_time(self, value):
+        self._item_state().read_on_time = value
+
+    @property
+    def is_saved(self):
+        return self._item_state().is_saved
+
+    @is_saved.setter
+    def is_saved(self, value):
+        self._item_state().is_saved = value
+
+    @property
+    def description(self):
+        """The item's HTML, decompressed from body"""
+        cached = self.__dict__.get('_description')
+        if cached is not None and cached[0] is self.body:
+            return cached[1]
+        return decompress_body(self.body)
+
+    @description.setter
+    def description(self, value):
+        self.set_description(value, compress_body(value))
+
+    def set_description(self, value, body):
+        """Set the HTML with its compressed form already at hand (shared between subscribers)"""
+        self.body = body
+        self.body_size = len(value.encode('utf-8')) if value else 0
+        # Keep the text around so ingestion can read it back without decompressing
+        self._description = (body, value)
+
+    def save(self, *args, **kwargs):
+        if self.user_id is None and self.feed_id is not None:
+            self.user_id = self.feed.user_id
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        # Write the state row for new items and any read/saved change made through the properties
+        if adding or Item.state.is_cached(self):
+            state = self._item_state()
+            state.user_id, state.feed_id, state.created_on_time = self.user_id, self.feed_id, self.created_on_time
+            state.save()
+
     class Meta:
         db_table = 'fever_items'
+        constraints = [
+            models.UniqueConstraint(fields=['feed', 'uid'], name='fever_items_feed_uid_uniq'),
+        ]
         indexes = [
             models.Index(fields=['feed']),
-            models.Index(fields=['feed', 'uid']),
             models.Index(fields=['title']),
             models.Index(fields=['url_checksum']),
-            models.Index(fields=['read_on_time']),
-            models.Index(fields=['is_saved']),
             models.Index(fields=['created_on_time']),
             models.Index(fields=['added_on_time']),
+            # Items paging (id desc); read state is indexed on ItemState
+            models.Index(fields=['user', '-id'], name='fever_items_user_id_idx'),
         ]
 
 
+class ItemState(models.Model):
+    """
+    Read/saved state of an item, kept out of the wide item row so marking
+    rewrites only these narrow rows and unread/saved ID lookups scan only
+    this table's indexes.
+    """
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='state')
+    user = models.ForeignKey(FeverUser, on_delete=models.CASCADE, related_name='item_states', db_index=False)
+    # Copied from the item for mark=feed|group and retention filters
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE, related_name='item_states', db_index=False)
+    created_on_time = models.BigIntegerField()
+    read_on_time = models.BigIntegerField(default=0)
+    is_saved = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'fever_item_states'
+        indexes = [
+            # Shaped after the Fever API queries:
+            # unread_item_ids / mark (read_on_time = 0), mark=feed|group, saved_item_ids
+            models.Index(fields=['user', 'read_on_time', 'item'], name='fever_states_user_read_idx'),
+            models.Index(fields=['feed', 'read_on_time', 'created_on_time'], name='fever_states_feed_read_idx'),
+            models.Index(fields=['user', 'item'], condition=models.Q(is_saved=True), name='fever_states_user_saved_idx'),
+        ]
+
+
+def pack_ids(ids):
+    """Encode a sorted list of IDs as zlib-compressed 64-bit deltas"""
+    deltas = array('Q', (b - a for a, b in zip(itertools.chain([0], ids), ids)))
+    return zlib.compress(deltas.tobytes(), 1)
+
+
+def unpack_ids(data):
+    """Decode the output of pack_ids back into a sorted list"""
+    if not data:
+        return []
+    deltas = array('Q')
+    deltas.frombytes(zlib.decompress(bytes(data)))
+    return list(itertools.accumulate(deltas))
+
+
+def _update_sorted(ids, add, remove):
+    """Return ids with add/remove applied, keeping it sorted"""
+    if len(add) + len(remove) > 64:
+        return sorted(set(ids).union(add).difference(remove))
+    ids = list(ids)
+    for i in remove:
+        pos = bisect.bisect_left(ids, i)
+        if pos < len(ids) and ids[pos] == i:
+            del ids[pos]
+    for i in add:
+        pos = bisect.bisect_left(ids, i)
+        if pos == len(ids) or ids[pos] != i:
+            ids.insert(pos, i)
+    return ids
+
+
+class ItemIdCacheManager(models.Manager):
+    def get_for_user(self, user):
+        """Return the user's cache row, building it from the items table if missing"""
+        try:
+            return self.get(user=user)
+        except ItemIdCache.DoesNotExist:
+            return self.rebuild(user)
+
+    def _lock_user(self, user):
+        """
+        Serialize rebuild and apply for a user: a change either commits before
+        a rebuild reads the items table or waits and is applied to its result.
+        """
+        list(FeverUser.objects.select_for_update().filter(pk=getattr(user, 'pk', user)).values_list('pk'))
+
+    def rebuild(self, user):
+        with transaction.atomic():
+            self._lock_user(user)
+            states = ItemState.objects.filter(user=user).order_by('item_id')
+            cache = ItemIdCache(
+                user_id=getattr(user, 'pk', user),
+                total_items=Item.objects.filter(user=user).count(),
+                unread_ids=pack_ids(list(states.filter(read_on_time=0).values_list('item_id', flat=True))),
+                saved_ids=pack_ids(list(states.filter(is_saved=True).values_list('item_id', flat=True))),
+            )
+            cache.save()
+        return cache
+
+    def apply(self, user, unread_add=(), unread_remove=(), saved_add=(), saved_remove=(), total_delta=0):
+        """
+        Update the cached sets and item count in place. Does nothing when the
+        user has no cache yet, since the next read rebuilds it from the items table.
+        """
+        with transaction.atomic():
+            self._lock_user(user)
+            cache = self.select_for_update().filter(user=user).first()
+            if cache is None:
+                return
+            cache.total_items = max(cache.total_items + total_delta, 0)
+            if unread_add or unread_remove:
+                cache.unread_ids = pack_ids(_update_sorted(unpack_ids(cache.unread_ids), unread_add, unread_remove))
+            if saved_add or saved_remove:
+                cache.saved_ids = pack_ids(_update_sorted(unpack_ids(cache.saved_ids), saved_add, saved_remove))
+            cache.save()
+
+    def invalidate(self, user_id):
+        self.filter(user_id=user_id).delete()
+
+
+class ItemIdCache(models.Model):
+    """Per-user unread/saved item IDs and item count, kept current by the mark, ingest and retention paths"""
+    user = models.OneToOneField(FeverUser, on_delete=models.CASCADE, primary_key=True, related_name='item_id_cache')
+    unread_ids = models.BinaryField()  # pack_ids() encoded
+    saved_ids = models.BinaryField()
+    total_items = models.BigIntegerField(default=0)  # Served as the Fever total_items count
+
+    objects = ItemIdCacheManager()
+
+    def get_unread_ids(self):
+        return unpack_ids(self.unread_ids)
+
+    def get_saved_ids(self):
+        return unpack_ids(self.saved_ids)
+
+    class Meta:
+        db_table = 'fever_item_id_cache'
+
+
 class Link(models.Model):
     """Links extracted from items for hot calculation"""
     feed = models.ForeignKey(Feed, on_delete=models.CASCADE, related_name='links')
@@ -267,3 +605,130 @@ class Link(models.Model):
             models.Index(fields=['is_local']),
             models.Index(fields=['is_first']),
         ]
+
+
+class RefreshJobManager(models.Manager):
+    # A running job older than this is assumed to belong to a dead worker
+    STALE_AFTER = 30 * 60
+
+    def active(self):
+        return self.filter(status__in=[RefreshJob.PENDING, RefreshJob.RUNNING])
+
+    def enqueue(self, user):
+        """
+        Queue a refresh of all the user's feeds.
+        Returns (job, created); a request made while another is pending or
+        running is merged into that job.
+        """
+        self.expire_stale()
+        job = self.active().filter(user=user).first()
+        if job:
+            return job, False
+        try:
+            with transaction.atomic():
+                return self.create(user=user, requested_on_time=int(time.time())), True
+        except IntegrityError:
+            # Lost the race against a concurrent request, which already queued one
+            return self.active().get(user=user), False
+
+    def claim_next(self):
+        """Move the oldest pending job to running, safe with several workers"""
+        for job in self.filter(status=RefreshJob.PENDING).order_by('requested_on_time')[:5]:
+            now = int(time.time())
+            if self.filter(pk=job.pk, status=RefreshJob.PENDING).update(status=RefreshJob.RUNNING, started_on_time=now):
+                job.status = RefreshJob.RUNNING
+                job.started_on_time = now
+                return job
+        return None
+
+    def expire_stale(self):
+        cutoff = int(time.time()) - self.STALE_AFTER
+        return self.filter(status=RefreshJob.RUNNING, started_on_time__lt=cutoff).update(
+            status=RefreshJob.FAILED, finished_on_time=int(time.time())
+        )
+
+
+class RefreshJob(models.Model):
+    """User-requested refresh, queued by the API and processed by the worker"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(FeverUser, on_delete=models.CASCADE, related_name='refresh_jobs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    requested_on_time = models.BigIntegerField()
+    started_on_time = models.BigIntegerField(default=0)
+    finished_on_time = models.BigIntegerField(default=0)
+
+    objects = RefreshJobManager()
+
+    def finish(self, failed=False):
+        self.status = self.FAILED if failed else self.DONE
+        self.finished_on_time = int(time.time())
+        self.save(update_fields=['status', 'finished_on_time'])
+
+    def requeue(self):
+        """Back to pending, for a job a worker had to leave unfinished"""
+        self.status = self.PENDING
+        self.started_on_time = 0
+        self.save(update_fields=['status', 'started_on_time'])
+
+    class Meta:
+        db_table = 'fever_refresh_jobs'
+        constraints = [
+            # At most one queued or running refresh per user, duplicates are merged
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='fever_refresh_jobs_one_active_per_user',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'requested_on_time']),
+        ]
+
+
+class HotLinkBucket(models.Model):
+    """
+    Hot-link rollup: how many of a user's items linked to a URL within one
+    day. Summing buckets gives the weight for any range of days, since each
+    item falls in exactly one bucket. Maintained by api.links at ingestion.
+    """
+    user = models.ForeignKey(FeverUser, on_delete=models.CASCADE, related_name='hot_link_buckets')
+    url_checksum = models.BigIntegerField()
+    bucket_on_time = models.BigIntegerField()  # Start of the (UTC) day
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, related_name='+')  # First link seen in the bucket
+    weight = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'fever_hot_link_buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'url_checksum', 'bucket_on_time'], name='fever_hot_link_buckets_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'bucket_on_time']),
+        ]
+
+
+class CompressionDictionary(models.Model):
+    """Preset deflate dictionary for item bodies, see compress_items --train"""
+    data = models.BinaryField()
+    sample_count = models.IntegerField(default=0)
+    created_on_time = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'fever_compression_dictionaries'
+
+
+class ItemArchive(models.Model):
+    """Pruned item kept as zlib-compressed JSON, see prune_items --archive"""
+    id = models.BigIntegerField(primary_key=True)  # Original item id
+    user_id = models.BigIntegerField(db_index=True)
+    feed_id = models.BigIntegerField()
+    data = models.BinaryField()
+    archived_on_time = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'fever_items_archive'
@@ -0,0 +1,154 @@
+"""
+The parse stage of a refresh: raw feed bytes in, a compact picklable
+ParsedFeed out. Nothing here touches the database or the Django models, so
+parse_feed can run in the worker processes of the parse pool.
+"""
+import calendar
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urljoin
+
+import feedparser
+
+from .compression import encode_body
+
+# Documents smaller than this are parsed on the fetch thread, the round trip to a pool process would cost more
+PARSE_POOL_MIN_BYTES = 64 * 1024
+
+_pool = {'executor': None}
+_pool_lock = threading.Lock()
+
+
+def calculate_checksum(text):
+    """Calculate checksum for URL/text"""
+    if not text:
+        return 0
+    # Use BigIntegerField compatible checksum (64-bit signed)
+    # We take first 15 hex chars (60 bits) to be safe within 63 bits (signed 64-bit)
+    return int(hashlib.md5(text.encode()).hexdigest()[:15], 16)
+
+
+@dataclass
+class FetchResult:
+    """A downloaded feed document, headers keyed in lower case"""
+    status: int
+    content: bytes = b''
+    headers: dict = field(default_factory=dict)
+    url: str = ''
+    redirect_url: str = ''  # Where the feed permanently moved, if it did
+    elapsed: float = 0.0  # Seconds
+
+
+@dataclass
+class ParsedFeed:
+    """What the database stage needs from one fetch"""
+    status: int
+    etag: str = ''
+    modified: str = ''
+    title: str = ''
+    site_url: str = ''
+    entries: list = field(default_factory=list)
+    entry_count: int = 0  # Entries in the document, duplicates included
+    redirect_url: str = ''
+    fetch_ms: int = 0
+    fetch_bytes: int = 0
+
+
+def normalize_entries(entries, current_time, dictionary=None):
+    """Normalize feed entries once per fetch, bodies compressed once for all subscribers"""
+    normalized = {}
+    for entry in entries:
+        item_uid = entry.get('id', entry.get('link', ''))
+        # We use the uid to check for existence, which is more reliable
+        if item_uid in normalized:
+            continue
+
+        item_link = entry.get('link', '')
+        description = entry.get('summary', '') or entry.get('description', '')
+        if hasattr(entry, 'content') and entry.content:
+            description = entry.content[0].value
+
+        published_time = entry.get('published_parsed') or entry.get('updated_parsed')
+        if published_time:
+            # feedparser returns UTC struct_time, so use timegm to get correct timestamp
+            created_on_time = int(calendar.timegm(published_time))
+        else:
+            created_on_time = current_time
+
+        normalized[item_uid] = {
+            'uid': item_uid,
+            'title': entry.get('title', ''),
+            'author': entry.get('author', ''),
+            'description': description,
+            'body': encode_body(description, dictionary),
+            'link': item_link,
+            'url_checksum': calculate_checksum(item_link),
+            'created_on_time': created_on_time,
+        }
+    return list(normalized.values())
+
+
+def parse_feed(fetched, current_time, dictionary=None):
+    """
+    Parse a FetchResult. `dictionary` is the active compression dictionary
+    as (id, data), passed in since the pool processes cannot look it up.
+    """
+    parsed = ParsedFeed(
+        status=fetched.status,
+        etag=fetched.headers.get('etag', ''),
+        modified=fetched.headers.get('last-modified', ''),
+        redirect_url=fetched.redirect_url,
+        fetch_ms=int(fetched.elapsed * 1000),
+        fetch_bytes=len(fetched.content),
+    )
+    # Unchanged or failed, there is no document to parse
+    if fetched.status == 304 or fetched.status >= 400:
+        return parsed
+
+    headers = dict(fetched.headers)
+    if fetched.url:
+        # Relative links in the document resolve against where it was fetched from
+        headers['content-location'] = urljoin(fetched.url, headers.get('content-location', ''))
+    document = feedparser.parse(fetched.content, response_headers=headers)
+
+    feed = getattr(document, 'feed', None)
+    parsed.title = getattr(feed, 'title', '') or ''
+    parsed.site_url = getattr(feed, 'link', '') or ''
+    parsed.entry_count = len(document.entries)
+    parsed.entries = normalize_entries(document.entries, current_time, dictionary)
+    return parsed
+
+
+def parse_workers():
+    from django.conf import settings
+    return getattr(settings, 'FEVER_PARSE_WORKERS', os.cpu_count() or 1)
+
+
+def get_parse_pool():
+    """The shared parse process pool, started on first use; None when FEVER_PARSE_WORKERS is 0"""
+    with _pool_lock:
+        if _pool['executor'] is None and parse_workers() > 0:
+            # Spawned rather than forked: the refresh process has fetch threads running
+            _pool['executor'] = ProcessPoolExecutor(
+                max_workers=parse_workers(), mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool['executor']
+
+
+def shutdown_parse_pool(executor=None):
+    """Stop the pool (only if it is still `executor`, when given); the next get_parse_pool() starts a new one"""
+    with _pool_lock:
+        if executor is not None and executor is not _pool['executor']:
+            return
+        executor, _pool['executor'] = _pool['executor'], None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def wants_pool(fetched):
+    """Large documents are worth shipping to a pool process"""
+    return len(fetched.content) >= PARSE_POOL_MIN_BYTES and parse_workers() > 0
@@ -0,0 +1,96 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+# How long a process trusts its cached copy of a user's data version. Bumps made
+# in this process are seen at once; with a local-memory cache, bumps from other
+# processes (the refresh worker) become visible after at most this many seconds.
+VERSION_CACHE_TTL = getattr(settings, 'FEVER_VERSION_CACHE_TTL', 30)
+RESPONSE_CACHE_TTL = 10 * 60
+RESPONSE_CACHE_MAX_BYTES = 1024 * 1024
+
+# Parameters that change state, or whose answer depends on the clock, are never cached
+UNCACHEABLE_PARAMS = ('mark', 'refresh', 'links')
+
+
+def _version_key(user_id):
+    return f'fever:version:{user_id}'
+
+
+def initial_version():
+    """Versions start from the clock so a reused user id never matches an earlier user's cached responses"""
+    return time.time_ns() // 1000
+
+
+def forget_version(user_id):
+    cache.delete(_version_key(user_id))
+
+
+def bump_versions(user_ids):
+    """Invalidate cached responses and ETags for these users after their Fever data changed"""
+    from .models import FeverUser
+
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    FeverUser.objects.filter(pk__in=user_ids).update(data_version=F('data_version') + 1)
+    keys = [_version_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # Again once committed, in case a request re-cached the old version in between
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+async def aget_version(user_id):
+    """The user's data version, from the cache when possible"""
+    from .models import FeverUser
+
+    version = await cache.aget(_version_key(user_id))
+    if version is None:
+        version = await FeverUser.objects.filter(pk=user_id).values_list('data_version', flat=True).afirst() or 0
+        await cache.aset(_version_key(user_id), version, VERSION_CACHE_TTL)
+    return version
+
+
+def is_cacheable(params):
+    return not any(name in params for name in UNCACHEABLE_PARAMS)
+
+
+def response_etag(user_id, version, params):
+    """Weak ETag for one user's answer to one parameter set at one data version"""
+    digest = hashlib.md5()
+    for name in sorted(params):
+        if name != 'api_key':
+            digest.update(f'{name}={",".join(params.getlist(name))}&'.encode())
+    return f'W/"{user_id}-{version}-{digest.hexdigest()[:16]}"'
+
+
+def etag_matches(request, etag):
+    header = request.headers.get('If-None-Match', '')
+    return header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')]
+
+
+def _response_key(etag):
+    return f'fever:response:{hashlib.md5(etag.encode()).hexdigest()}'
+
+
+async def aget_cached_response(etag):
+    return await cache.aget(_response_key(etag))
+
+
+async def cache_stream(etag, chunks):
+    """Pass a streamed response through, storing its body once it completed if it is small enough"""
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        yield chunk
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+            if size > RESPONSE_CACHE_MAX_BYTES:
+                parts = None
+    if parts is not None:
+        await cache.aset(_response_key(etag), ''.join(parts).encode(), RESPONSE_CACHE_TTL)
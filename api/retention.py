@@ -0,0 +1,138 @@
+import gzip
+import json
+import logging
+import time
+import zlib
+
+from django.db import transaction
+from django.db.models import F
+
+from .compression import decompress_body
+from .links import update_link_buckets
+from .models import Item, ItemArchive, ItemIdCache, Link
+from .response_cache import bump_versions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_MIN_ITEMS = 50
+DEFAULT_BATCH_SIZE = 500
+ARCHIVE_FIELDS = (
+    'id', 'feed_id', 'user_id', 'uid', 'title', 'author', 'body', 'link',
+    'url_checksum', 'created_on_time', 'added_on_time',
+)
+
+
+def _first_set(*values):
+    return next(v for v in values if v is not None)
+
+
+def feed_policy(feed, days=DEFAULT_RETENTION_DAYS, min_items=DEFAULT_MIN_ITEMS):
+    """Resolve (days, min_items) for a feed: its own setting, then its user's, then the defaults"""
+    return (
+        _first_set(feed.retention_days, feed.user.retention_days, days),
+        _first_set(feed.retention_min_items, feed.user.retention_min_items, min_items),
+    )
+
+
+def prunable_items(feed, days, min_items, now=None):
+    """
+    Items the policy allows dropping: read, not saved, older than `days`
+    and not among the feed's `min_items` newest. `days` <= 0 keeps everything.
+    """
+    if days <= 0:
+        return Item.objects.none()
+    cutoff = (now or int(time.time())) - days * 24 * 60 * 60
+    qs = Item.objects.filter(
+        feed=feed, state__read_on_time__gt=0, state__is_saved=False, created_on_time__lt=cutoff
+    )
+    if min_items > 0:
+        newest = list(Item.objects.filter(feed=feed).order_by('-id').values_list('id', flat=True)[min_items - 1:min_items])
+        if not newest:
+            return Item.objects.none()
+        qs = qs.filter(id__lt=newest[0])
+    return qs
+
+
+def _archive_rows(items):
+    rows = items.values(*ARCHIVE_FIELDS, read_on_time=F('state__read_on_time'), is_saved=F('state__is_saved'))
+    for row in rows.iterator():
+        row['description'] = decompress_body(row.pop('body'))
+        yield row
+
+
+class TableArchiver:
+    """Moves pruned items into ItemArchive as compressed JSON"""
+
+    def __call__(self, items):
+        now = int(time.time())
+        ItemArchive.objects.bulk_create(
+            [
+                ItemArchive(
+                    id=row['id'],
+                    user_id=row['user_id'],
+                    feed_id=row['feed_id'],
+                    data=zlib.compress(json.dumps(row).encode(), 6),
+                    archived_on_time=now,
+                )
+                for row in _archive_rows(items)
+            ],
+            ignore_conflicts=True,
+        )
+
+    def close(self):
+        pass
+
+
+class FileArchiver:
+    """Appends pruned items to a gzipped JSON-lines file"""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+
+    def __call__(self, items):
+        for row in _archive_rows(items):
+            self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _recount_link_buckets(user_id, touched):
+    """Deleting items removes their links; recount the buckets those links were counted in"""
+    by_checksum = {}
+    for url_checksum, created_on_time in touched:
+        low, high = by_checksum.get(url_checksum, (created_on_time, created_on_time))
+        by_checksum[url_checksum] = (min(low, created_on_time), max(high, created_on_time))
+    for url_checksum, (since, until) in by_checksum.items():
+        update_link_buckets(user_id, [url_checksum], since, until)
+
+
+def prune_feed(feed, days, min_items, batch_size=DEFAULT_BATCH_SIZE, archive=None, now=None):
+    """
+    Delete (optionally archiving) the feed's prunable items in batches of at
+    most `batch_size`, each batch in its own short transaction. Returns the
+    number of items removed.
+    """
+    candidates = prunable_items(feed, days, min_items, now).order_by('id')
+    removed = 0
+    while True:
+        ids = list(candidates.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        with transaction.atomic():
+            batch = Item.objects.filter(id__in=ids)
+            if archive is not None:
+                archive(batch)
+            touched = list(
+                Link.objects.filter(item_id__in=ids, is_local=False, is_blacklisted=False)
+                .values_list('url_checksum', 'created_on_time')
+            )
+            batch.delete()
+            # Only read, unsaved items are pruned, so the cached ID sets are unaffected
+            ItemIdCache.objects.apply(feed.user_id, total_delta=-len(ids))
+            _recount_link_buckets(feed.user_id, touched)
+            bump_versions([feed.user_id])
+        removed += len(ids)
+        logger.info(f"  Pruned {len(ids)} items from {feed.title or feed.url}")
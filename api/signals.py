@@ -0,0 +1,65 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .auth_cache import api_key_cache
+from .models import FeverUser, Feed, FeedGroup, Group, Item, ItemIdCache, Source
+from .response_cache import bump_versions, forget_version
+
+
+@receiver(post_save, sender=FeverUser)
+@receiver(post_delete, sender=FeverUser)
+def user_changed(sender, instance, **kwargs):
+    """Deactivated, edited or deleted users must not keep authenticating from the key cache"""
+    api_key_cache.invalidate_user(instance)
+    forget_version(instance.pk)
+
+
+@receiver(post_delete, sender=Feed)
+def feed_deleted(sender, instance, **kwargs):
+    """Cascaded item deletes bypass the cache, so drop it and let it rebuild"""
+    ItemIdCache.objects.invalidate(instance.user_id)
+    # Stop fetching a URL once its last subscriber is gone
+    Source.objects.filter(id=instance.source_id, feeds__isnull=True).delete()
+
+
+@receiver(post_save, sender=Item)
+def item_created(sender, instance, created, **kwargs):
+    """Items saved one at a time (admin, scripts) join the cached sets; bulk ingestion updates them itself"""
+    bump_versions([instance.user_id])
+    if not created:
+        return
+    ItemIdCache.objects.apply(
+        instance.user_id,
+        unread_add=[instance.id] if instance.read_on_time == 0 else [],
+        saved_add=[instance.id] if instance.is_saved else [],
+        total_delta=1,
+    )
+
+
+@receiver(post_delete, sender=Item)
+def item_deleted(sender, instance, origin=None, **kwargs):
+    """
+    Items deleted one at a time (admin, scripts) leave the cached sets.
+    Deletes cascaded from a feed or user invalidate the cache instead, and
+    queryset deletes (retention, admin bulk action) update it themselves.
+    """
+    if not isinstance(origin, Item):
+        return
+    ItemIdCache.objects.apply(
+        instance.user_id, unread_remove=[instance.id], saved_remove=[instance.id], total_delta=-1,
+    )
+    bump_versions([instance.user_id])
+
+
+@receiver(post_save, sender=Feed)
+@receiver(post_delete, sender=Feed)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def subscriptions_changed(sender, instance, **kwargs):
+    """Feed and group edits (admin, scripts) change groups/feeds responses"""
+    bump_versions([instance.user_id])
+
+
+@receiver(post_save, sender=FeedGroup)
+@receiver(post_delete, sender=FeedGroup)
+def feed_group_changed(sender, instance, **kwargs):
+    bump_versions(Group.objects.filter(id=instance.group_id).values_list('user_id', flat=True))
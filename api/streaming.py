@@ -0,0 +1,76 @@
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Flush encoded output to the client in pieces of roughly this many characters
+STREAM_CHUNK_SIZE = 32 * 1024
+ID_BATCH_SIZE = 4096
+
+
+class JsonArray:
+    """Response section serialized as a JSON array while it is being iterated"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class JsonIdList:
+    """Response section serialized as a comma-joined JSON string of IDs (Fever's *_item_ids format)"""
+
+    def __init__(self, ids):
+        self.ids = ids
+
+
+def _encode_value(value, encoder):
+    if isinstance(value, JsonArray):
+        yield '['
+        for i, row in enumerate(value):
+            yield (', ' if i else '') + encoder.encode(row)
+        yield ']'
+    elif isinstance(value, JsonIdList):
+        # Digits and commas never need escaping, so the string is written piecewise
+        ids = list(value.ids)
+        yield '"'
+        for start in range(0, len(ids), ID_BATCH_SIZE):
+            yield (',' if start else '') + ','.join(map(str, ids[start:start + ID_BATCH_SIZE]))
+        yield '"'
+    else:
+        yield encoder.encode(value)
+
+
+async def _aencode_sections(data, encoder):
+    yield '{'
+    for n, (key, value) in enumerate(data.items()):
+        yield (', ' if n else '') + encoder.encode(key) + ': '
+        if isinstance(value, JsonArray) and hasattr(value.rows, '__aiter__'):
+            # Rows read with the async ORM (QuerySet.aiterator)
+            yield '['
+            i = 0
+            async for row in value.rows:
+                yield (', ' if i else '') + encoder.encode(row)
+                i += 1
+            yield ']'
+        else:
+            for piece in _encode_value(value, encoder):
+                yield piece
+    yield '}'
+
+
+async def astream_json(data, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encode a response dict incrementally for ASGI responses; JsonArray rows
+    may be a plain or an async iterable. Output is byte-for-byte what
+    JsonResponse(data) would produce once the lazy sections are materialized.
+    """
+    buffer = []
+    size = 0
+    async for piece in _aencode_sections(data, DjangoJSONEncoder()):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
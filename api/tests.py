@@ -1,11 +1,39 @@
-from django.test import TestCase, Client
-from django.urls import reverse
-from api.models import FeverUser, Feed, Group, Item, FeedGroup
+from contextlib import contextmanager
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase, Client, skipUnlessDBFeature
+from api.models import FeverUser, Feed, Group, Item, ItemState, RefreshJob, Source
 import hashlib
 import time
 import json
 
 
+def response_body(response):
+    """Body of a Fever response, streamed (sync or async) or not"""
+    if not response.streaming:
+        return response.content
+    if response.is_async:
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(read)()
+    return b''.join(response.streaming_content)
+
+
+def response_json(response):
+    """Decode a Fever response, streamed or not"""
+    return json.loads(response_body(response))
+
+
+@contextmanager
+def serve_document(document, status=200, headers=None):
+    """Refreshes download a stand-in response that feedparser turns into `document`"""
+    from api.parsing import FetchResult
+
+    with patch('api.utils.fetch_feed', return_value=FetchResult(status, b'<rss/>', headers or {})) as fetch:
+        with patch('api.parsing.feedparser.parse', return_value=document):
+            yield fetch
+
+
 class FeverAPITestCase(TestCase):
     def setUp(self):
         """Set up test data"""
@@ -61,7 +89,7 @@ class FeverAPITestCase(TestCase):
     def test_api_version(self):
         """Test that API returns version 3"""
         response = self.client.post('/api/')
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['api_version'], 3)
         self.assertEqual(data['auth'], 0)
@@ -69,7 +97,7 @@ class FeverAPITestCase(TestCase):
     def test_authentication_failure(self):
         """Test authentication with invalid API key"""
         response = self.client.post('/api/', {'api_key': 'invalid_key'})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 0)
         self.assertNotIn('groups', data)
@@ -77,24 +105,37 @@ class FeverAPITestCase(TestCase):
     def test_authentication_success(self):
         """Test authentication with valid API key"""
         response = self.client.post('/api/', {'api_key': self.api_key})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
 
     def test_groups_endpoint(self):
         """Test groups endpoint"""
         response = self.client.get('/api/', {'api_key': self.api_key, 'groups': ''})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
         self.assertIn('groups', data)
         self.assertEqual(len(data['groups']), 1)
         self.assertEqual(data['groups'][0]['title'], 'Test Group')
 
+    async def test_async_client_reads_sections_together(self):
+        """Under ASGI every requested section is gathered into one streamed response"""
+        response = await self.async_client.get('/api/', {
+            'api_key': self.api_key, 'groups': '', 'feeds': '', 'items': '', 'unread_item_ids': '',
+        })
+        self.assertTrue(response.is_async)
+        data = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual([g['title'] for g in data['groups']], ['Test Group'])
+        self.assertEqual([f['title'] for f in data['feeds']], ['Test Feed'])
+        self.assertEqual(data['feeds_groups'], [{'group_id': self.group.id, 'feed_ids': str(self.feed.id)}])
+        self.assertEqual(len(data['items']), 5)
+        self.assertEqual(len(data['unread_item_ids'].split(',')), 5)
+
     def test_feeds_endpoint(self):
         """Test feeds endpoint"""
         response = self.client.get('/api/', {'api_key': self.api_key, 'feeds': ''})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
         self.assertIn('feeds', data)
@@ -106,7 +147,7 @@ class FeverAPITestCase(TestCase):
         self.feed.save()
 
         response = self.client.get('/api/', {'api_key': self.api_key, 'feeds': ''})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
         self.assertIn('feeds', data)
@@ -119,7 +160,7 @@ class FeverAPITestCase(TestCase):
         self.feed.save()
 
         response = self.client.get('/api/', {'api_key': self.api_key, 'feeds': ''})
-        data = json.loads(response.content)
+        data = response_json(response)
         feed_data = next(f for f in data['feeds'] if f['id'] == self.feed.id)
         self.assertEqual(feed_data['title'], "Test Feed")
         self.assertEqual(len(data['feeds']), 1)
@@ -129,7 +170,7 @@ class FeverAPITestCase(TestCase):
     def test_items_endpoint(self):
         """Test items endpoint"""
         response = self.client.get('/api/', {'api_key': self.api_key, 'items': ''})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
         self.assertIn('items', data)
@@ -139,7 +180,7 @@ class FeverAPITestCase(TestCase):
     def test_unread_item_ids(self):
         """Test unread_item_ids endpoint"""
         response = self.client.get('/api/', {'api_key': self.api_key, 'unread_item_ids': ''})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
         self.assertIn('unread_item_ids', data)
@@ -150,7 +191,7 @@ class FeverAPITestCase(TestCase):
     def test_saved_item_ids(self):
         """Test saved_item_ids endpoint"""
         response = self.client.get('/api/', {'api_key': self.api_key, 'saved_item_ids': ''})
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
         self.assertIn('saved_item_ids', data)
@@ -169,7 +210,7 @@ class FeverAPITestCase(TestCase):
             'as': 'read',
             'id': str(item.id)
         })
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
 
@@ -179,7 +220,7 @@ class FeverAPITestCase(TestCase):
 
     def test_mark_item_as_saved(self):
         """Test marking an item as saved"""
-        item = Item.objects.filter(is_saved=False).first()
+        item = Item.objects.filter(state__is_saved=False).first()
 
         response = self.client.post('/api/', {
             'api_key': self.api_key,
@@ -187,7 +228,7 @@ class FeverAPITestCase(TestCase):
             'as': 'saved',
             'id': str(item.id)
         })
-        data = json.loads(response.content)
+        data = response_json(response)
 
         self.assertEqual(data['auth'], 1)
 
@@ -241,6 +282,24 @@ class ItemManagerTestCase(TestCase):
         self.item1.refresh_from_db()
         self.assertFalse(self.item1.is_saved)
 
+    def test_marking_writes_only_the_state_table(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.assertEqual(ItemState.objects.filter(user=self.user).count(), 2)
+        with CaptureQueriesContext(connection) as queries:
+            Item.objects.mark_feed_as_read(self.user, self.feed.id, before_time=1500)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertTrue(updates)
+        # Besides the user's response cache version, only the narrow state table is written
+        item_updates = [sql for sql in updates if 'fever_users' not in sql]
+        self.assertTrue(item_updates)
+        self.assertTrue(all('fever_item_states' in sql and 'fever_items"' not in sql for sql in item_updates))
+        self.assertEqual(
+            list(ItemState.objects.filter(user=self.user, read_on_time=0).values_list('item_id', flat=True)),
+            [self.item2.id],
+        )
+
 
 class UtilsTestCase(TestCase):
     def setUp(self):
@@ -251,7 +310,7 @@ class UtilsTestCase(TestCase):
         """Test that published_parsed (UTC struct_time) is correctly converted to timestamp"""
         import time
         import calendar
-        from unittest.mock import patch, MagicMock
+        from unittest.mock import MagicMock
         from api.utils import refresh_feed
 
         # Create a mock entry with a known UTC time
@@ -273,12 +332,1340 @@ class UtilsTestCase(TestCase):
         del mock_entry.content
 
         mock_parsed = MagicMock()
+        mock_parsed.status = 200
+        mock_parsed.etag = None
+        mock_parsed.modified = None
         mock_parsed.feed.title = 'Updated Title'
         mock_parsed.feed.link = 'http://example.com'
         mock_parsed.entries = [mock_entry]
 
-        with patch('api.utils.feedparser.parse', return_value=mock_parsed):
+        with serve_document(mock_parsed):
             refresh_feed(self.feed)
 
         item = Item.objects.get(uid='item1')
         self.assertEqual(item.created_on_time, expected_timestamp)
+
+    def test_refresh_feed_conditional_get(self):
+        """Validators are stored, sent back, and a 304 skips entry processing"""
+        from feedparser import FeedParserDict
+        from api.utils import refresh_feed
+
+        first = FeedParserDict(
+            feed=FeedParserDict(title='Utils Feed'),
+            entries=[FeedParserDict(id='entry-1', link='http://example.com/1', title='One')],
+        )
+        headers = {'etag': '"abc"', 'last-modified': 'Sun, 01 Jan 2023 12:00:00 GMT'}
+        with serve_document(first, headers=headers):
+            self.assertEqual(refresh_feed(self.feed).inserted, 1)
+
+        self.feed.source.refresh_from_db()
+        self.assertEqual(self.feed.source.etag, '"abc"')
+        self.assertEqual(self.feed.source.last_modified, 'Sun, 01 Jan 2023 12:00:00 GMT')
+
+        with serve_document(None, status=304) as fetch:
+            self.assertTrue(refresh_feed(self.feed).not_modified)
+
+        self.assertEqual(fetch.call_args.args[0].etag, '"abc"')
+        self.assertEqual(Item.objects.filter(feed=self.feed).count(), 1)
+
+    def test_refresh_feed_bulk_ingestion(self):
+        """Existing and duplicate entries are skipped and new ones inserted in bulk"""
+        from feedparser import FeedParserDict
+        from api.compression import active_dictionary
+        from api.utils import refresh_feed
+
+        Item.objects.create(feed=self.feed, uid='old', url_checksum=0, created_on_time=1, added_on_time=1)
+        parsed = FeedParserDict(
+            feed=FeedParserDict(title='Utils Feed'),
+            entries=[
+                FeedParserDict(id='old', link='http://example.com/old'),
+                FeedParserDict(id='new-1', link='http://example.com/1'),
+                FeedParserDict(id='new-1', link='http://example.com/1'),
+                FeedParserDict(link='http://example.com/2'),
+            ],
+        )
+        # The active compression dictionary is looked up once per process, not per refresh
+        active_dictionary()
+        with serve_document(parsed):
+            with self.assertNumQueries(12):
+                result = refresh_feed(self.feed)
+
+        self.assertEqual(result.inserted, 2)
+        self.assertEqual(result.skipped, 2)
+        self.assertEqual(
+            set(Item.objects.filter(feed=self.feed).values_list('uid', flat=True)),
+            {'old', 'new-1', 'http://example.com/2'},
+        )
+        self.assertFalse(Item.objects.filter(feed=self.feed, user__isnull=True).exists())
+
+
+class RefreshScheduleTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='schedule@example.com', password='password')
+        self.feed = Feed.objects.create(user=self.user, title='Schedule Feed', url='http://example.com/schedule')
+
+    def test_active_feed_polled_twice_per_posting_gap(self):
+        from api.utils import schedule_next_refresh
+        now = int(time.time())
+        source = self.feed.source
+        source.last_updated_on_time = now - 4 * 3600
+        schedule_next_refresh(source, now, changed=True)
+        self.assertEqual(source.refresh_interval, 2 * 3600)
+        self.assertEqual(source.next_refresh_on_time, now + 2 * 3600)
+
+    def test_quiet_feed_backs_off(self):
+        from api.utils import schedule_next_refresh, MAX_REFRESH_INTERVAL, MIN_REFRESH_INTERVAL
+        now = int(time.time())
+        source = self.feed.source
+        schedule_next_refresh(source, now, changed=False)
+        self.assertEqual(source.refresh_interval, MIN_REFRESH_INTERVAL * 3 // 2)
+        for _ in range(20):
+            schedule_next_refresh(source, now, changed=False)
+        self.assertEqual(source.refresh_interval, MAX_REFRESH_INTERVAL)
+
+    def test_failing_feed_backs_off_exponentially(self):
+        from api.parsing import FetchResult
+        from api.utils import refresh_feed, FeedFetchError, MIN_REFRESH_INTERVAL
+
+        with patch('api.utils.fetch_feed', return_value=FetchResult(500)):
+            for _ in range(2):
+                with self.assertRaises(FeedFetchError):
+                    refresh_feed(self.feed)
+
+        self.feed.source.refresh_from_db()
+        self.assertEqual(self.feed.source.error_count, 2)
+        self.assertEqual(self.feed.source.refresh_interval, MIN_REFRESH_INTERVAL * 4)
+
+    def test_command_only_refreshes_due_feeds(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from api.parsing import FetchResult
+
+        later = Feed.objects.create(user=self.user, url='http://example.com/later')
+        Source.objects.filter(id=later.source_id).update(next_refresh_on_time=int(time.time()) + 3600)
+        parsed = FetchResult(304)
+        with patch('api.utils.fetch_feed', return_value=parsed) as fetch:
+            call_command('refresh_feeds', '--skip-favicons', stdout=StringIO())
+            self.assertEqual([call.args[0].id for call in fetch.call_args_list], [self.feed.source_id])
+
+            fetch.reset_mock()
+            call_command('refresh_feeds', '--all', '--skip-favicons', stdout=StringIO())
+            self.assertEqual(
+                sorted(call.args[0].id for call in fetch.call_args_list),
+                sorted([self.feed.source_id, later.source_id]),
+            )
+
+
+class ConcurrentRefreshTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='concurrent@example.com', password='password')
+        self.feeds = [
+            Feed.objects.create(user=self.user, url=f'http://{host}/feed-{i}')
+            for host in ('a.example.com', 'b.example.com')
+            for i in range(3)
+        ]
+
+    def test_refresh_respects_per_host_limit(self):
+        """Fetches overlap across hosts but never exceed the per-host limit"""
+        import threading
+        from urllib.parse import urlparse
+        from api.parsing import FetchResult
+        from api.utils import refresh_feeds_concurrently
+
+        lock = threading.Lock()
+        active = {}
+        peak = {}
+
+        def fake_fetch(feed):
+            host = urlparse(feed.url).netloc
+            with lock:
+                active[host] = active.get(host, 0) + 1
+                peak[host] = max(peak.get(host, 0), active[host])
+            time.sleep(0.02)
+            with lock:
+                active[host] -= 1
+            return FetchResult(200, b'<rss><channel><title>Feed</title></channel></rss>')
+
+        results = []
+        with patch('api.utils.fetch_feed', side_effect=fake_fetch):
+            stats = refresh_feeds_concurrently(
+                [feed.source for feed in self.feeds], workers=4, per_host=1,
+                callback=lambda feed, result, error: results.append(error),
+            )
+
+        self.assertEqual(stats.feeds, 6)
+        self.assertEqual(stats.errors, 0)
+        self.assertEqual(results, [None] * 6)
+        self.assertEqual(peak, {'a.example.com': 1, 'b.example.com': 1})
+        self.assertEqual(len(stats.fetch_times), 6)
+        self.assertGreater(stats.p95_fetch_time, 0)
+        for feed in self.feeds:
+            feed.refresh_from_db()
+            self.assertGreater(feed.last_refreshed_on_time, 0)
+
+    def test_fetch_errors_are_reported(self):
+        from api.utils import refresh_feeds_concurrently
+
+        with patch('api.utils.fetch_feed', side_effect=OSError('boom')):
+            stats = refresh_feeds_concurrently([feed.source for feed in self.feeds[:2]], workers=2)
+
+        self.assertEqual(stats.feeds, 2)
+        self.assertEqual(stats.errors, 2)
+
+    def test_fetches_start_in_priority_order_across_hosts(self):
+        from api.parsing import FetchResult
+        from api.utils import refresh_feeds_concurrently
+
+        # Interleave the two hosts' feeds, one fetch at a time
+        order = [self.feeds[i].source for i in (3, 0, 4, 1, 5, 2)]
+        parsed = FetchResult(304)
+        with patch('api.utils.fetch_feed', return_value=parsed) as fetch:
+            refresh_feeds_concurrently(order, workers=1)
+        self.assertEqual([call.args[0].id for call in fetch.call_args_list], [source.id for source in order])
+
+    def test_no_fetch_starts_after_the_deadline(self):
+        from api.utils import refresh_feeds_concurrently
+
+        sources = [feed.source for feed in self.feeds]
+        with patch('api.utils.fetch_feed') as fetch:
+            stats = refresh_feeds_concurrently(sources, workers=2, deadline=time.monotonic() - 1)
+        fetch.assert_not_called()
+        self.assertEqual(stats.feeds, 0)
+        self.assertEqual(stats.not_started, sources)
+
+    def test_deadline_command_refreshes_most_overdue_first(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from api.parsing import FetchResult
+
+        now = int(time.time())
+        for age, feed in zip((10, 300, 60, 5, 120, 30), self.feeds):
+            Source.objects.filter(id=feed.source_id).update(next_refresh_on_time=now - age * 60)
+        parsed = FetchResult(304)
+        out = StringIO()
+        with patch('api.utils.fetch_feed', return_value=parsed) as fetch:
+            call_command('refresh_feeds', '--skip-favicons', '--deadline', '60', '--workers', '1', stdout=out)
+
+        expected = [self.feeds[i].source_id for i in (1, 4, 2, 5, 0, 3)]
+        self.assertEqual([call.args[0].id for call in fetch.call_args_list], expected)
+        self.assertIn('Deadline run: 6 of 6 feeds within the 60s budget', out.getvalue())
+
+
+class FeedParsingTestCase(TestCase):
+    RSS = b'''<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Parsed Feed</title><link>https://parsed.example.com/</link>
+<item><guid isPermaLink="false">a</guid><title>First</title><link>/a</link><description>&lt;p&gt;One&lt;/p&gt;</description>
+<pubDate>Sun, 01 Jan 2023 12:00:00 GMT</pubDate></item>
+<item><guid isPermaLink="false">a</guid><title>First again</title><link>/a</link></item>
+<item><guid isPermaLink="false">b</guid><title>Second</title><link>/b</link><description>Two</description></item>
+</channel></rss>'''
+
+    def test_parse_feed_returns_a_picklable_summary(self):
+        import pickle
+        from api.compression import decompress_body
+        from api.parsing import FetchResult, parse_feed
+
+        fetched = FetchResult(200, self.RSS, {'etag': '"v1"'}, 'https://parsed.example.com/feed.xml')
+        parsed = pickle.loads(pickle.dumps(parse_feed(fetched, 1000)))
+        self.assertEqual((parsed.status, parsed.etag, parsed.title), (200, '"v1"', 'Parsed Feed'))
+        self.assertEqual(parsed.entry_count, 3)
+        self.assertEqual([entry['uid'] for entry in parsed.entries], ['a', 'b'])
+        self.assertEqual(parsed.entries[0]['link'], 'https://parsed.example.com/a')
+        self.assertEqual(parsed.entries[0]['created_on_time'], 1672574400)
+        self.assertEqual(parsed.entries[1]['created_on_time'], 1000)
+        self.assertEqual(decompress_body(parsed.entries[0]['body']), '<p>One</p>')
+
+    def test_large_documents_are_parsed_in_the_pool(self):
+        from django.test import override_settings
+        from api.parsing import FetchResult, get_parse_pool, shutdown_parse_pool
+        from api.utils import refresh_feeds_concurrently
+
+        user = FeverUser.objects.create_user(email='parsing@example.com', password='password')
+        feed = Feed.objects.create(user=user, url='https://parsed.example.com/feed.xml')
+        fetched = FetchResult(200, self.RSS, {}, feed.url)
+        self.addCleanup(shutdown_parse_pool)
+        with override_settings(FEVER_PARSE_WORKERS=1), patch('api.parsing.PARSE_POOL_MIN_BYTES', 0):
+            with patch('api.utils.fetch_feed', return_value=fetched):
+                stats = refresh_feeds_concurrently([feed.source], workers=1)
+            self.assertIsNotNone(get_parse_pool())
+
+        self.assertEqual((stats.feeds, stats.errors, stats.inserted, stats.skipped), (1, 0, 2, 1))
+        feed.refresh_from_db()
+        self.assertEqual(feed.title, 'Parsed Feed')
+
+    def test_pool_broken_before_submit_is_replaced(self):
+        from concurrent.futures.process import BrokenProcessPool
+        from django.test import override_settings
+        from api.parsing import FetchResult, get_parse_pool, shutdown_parse_pool
+        from api.utils import refresh_feeds_concurrently
+
+        user = FeverUser.objects.create_user(email='broken@example.com', password='password')
+        feeds = [Feed.objects.create(user=user, url=f'https://broken{i}.example.com/feed.xml') for i in range(2)]
+        self.addCleanup(shutdown_parse_pool)
+        with override_settings(FEVER_PARSE_WORKERS=1), patch('api.parsing.PARSE_POOL_MIN_BYTES', 0):
+            broken = get_parse_pool()
+            fetch = patch('api.utils.fetch_feed', side_effect=lambda source: FetchResult(200, self.RSS, {}, source.url))
+            with patch.object(broken, 'submit', side_effect=BrokenProcessPool('worker died')), fetch:
+                stats = refresh_feeds_concurrently([feed.source for feed in feeds], workers=2)
+            self.assertIsNot(get_parse_pool(), broken)
+
+        self.assertEqual((stats.feeds, stats.errors, stats.inserted), (2, 0, 4))
+        for feed in feeds:
+            feed.source.refresh_from_db()
+            self.assertEqual(feed.source.error_count, 0)
+            self.assertEqual(feed.source.title, 'Parsed Feed')
+
+
+class FeedFetcherTestCase(TestCase):
+    def setUp(self):
+        import gzip
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        requests = self.requests = []
+        body = gzip.compress(FeedParsingTestCase.RSS)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive
+
+            def reply(self, status, headers=(), content=b''):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                requests.append((self.path, self.client_address[1]))
+                if self.path == '/moved':
+                    self.reply(301, [('Location', '/feed.xml')])
+                elif self.path != '/feed.xml':
+                    self.reply(404)
+                elif self.headers.get('If-None-Match') == '"v1"':
+                    self.reply(304, [('ETag', '"v1"')])
+                else:
+                    self.reply(200, [('Content-Encoding', 'gzip'), ('ETag', '"v1"')], body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def test_fetch_decodes_gzip_and_reuses_the_connection(self):
+        from api.fetcher import fetch_feed
+
+        source = Source(url=f'{self.base}/feed.xml')
+        fetched = fetch_feed(source)
+        self.assertEqual((fetched.status, fetched.content), (200, FeedParsingTestCase.RSS))
+        self.assertEqual(fetched.headers['etag'], '"v1"')
+
+        source.etag = '"v1"'
+        self.assertEqual(fetch_feed(source).status, 304)
+        self.assertEqual(len({port for _, port in self.requests}), 1)
+
+    def test_permanent_redirect_and_fetch_size_are_recorded(self):
+        from api.utils import refresh_feed
+
+        user = FeverUser.objects.create_user(email='fetcher@example.com', password='password')
+        feed = Feed.objects.create(user=user, url=f'{self.base}/moved')
+        self.assertEqual(refresh_feed(feed).inserted, 2)
+        source = Source.objects.get(id=feed.source_id)
+        self.assertEqual(source.fetch_url, f'{self.base}/feed.xml')
+        self.assertEqual(source.last_fetch_bytes, len(FeedParsingTestCase.RSS))
+
+        self.assertTrue(refresh_feed(feed).not_modified)
+        self.assertEqual([path for path, _ in self.requests], ['/moved', '/feed.xml', '/feed.xml'])
+
+    def test_oversized_and_unreachable_feeds_fail(self):
+        from api.fetcher import fetch_feed, FeedFetchError
+
+        with patch('api.fetcher.FEED_MAX_BYTES', 100), self.assertRaises(FeedFetchError):
+            fetch_feed(Source(url=f'{self.base}/feed.xml'))
+        with self.assertRaises(FeedFetchError):
+            fetch_feed(Source(url='http://127.0.0.1:1/feed.xml'))
+
+
+class SourceLeaseTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='leases@example.com', password='password')
+        now = int(time.time())
+        self.feeds = [Feed.objects.create(user=self.user, url=f'http://lease.example.com/{i}') for i in range(4)]
+        for age, feed in zip((1, 4, 3, 2), self.feeds):
+            Source.objects.filter(id=feed.source_id).update(next_refresh_on_time=now - age * 60)
+
+    def test_workers_claim_disjoint_sources_most_overdue_first(self):
+        first = Source.objects.claim('worker-a', Source.objects.all(), 2)
+        second = Source.objects.claim('worker-b', Source.objects.all(), 10)
+        self.assertEqual([s.id for s in first], [self.feeds[1].source_id, self.feeds[2].source_id])
+        self.assertEqual([s.id for s in second], [self.feeds[3].source_id, self.feeds[0].source_id])
+        self.assertEqual(Source.objects.claim('worker-c', Source.objects.all(), 10), [])
+
+    def test_expired_lease_is_claimable_again(self):
+        Source.objects.claim('crashed', Source.objects.all(), 10)
+        Source.objects.filter(claimed_by='crashed').update(lease_expires=int(time.time()) - 1)
+        self.assertEqual(len(Source.objects.claim('worker-b', Source.objects.all(), 10)), 4)
+
+    def test_release_returns_sources_to_the_pool(self):
+        claimed = Source.objects.claim('worker-a', Source.objects.all(), 10)
+        self.assertEqual(Source.objects.release('worker-b', claimed), 0)
+        self.assertEqual(Source.objects.release('worker-a', claimed), 4)
+        self.assertEqual(len(Source.objects.claim('worker-b', Source.objects.all(), 10)), 4)
+
+    def test_refresh_skips_sources_leased_by_another_worker(self):
+        from api.parsing import FetchResult
+        from api.utils import refresh_claimed_sources
+
+        held = Source.objects.claim('other', Source.objects.filter(id=self.feeds[1].source_id), 1)
+        parsed = FetchResult(304)
+        with patch('api.utils.fetch_feed', return_value=parsed) as fetch:
+            stats = refresh_claimed_sources(Source.objects.all(), worker='me', workers=1, batch_size=2)
+
+        fetched = [call.args[0].id for call in fetch.call_args_list]
+        self.assertEqual(fetched, [self.feeds[i].source_id for i in (2, 3, 0)])
+        self.assertEqual(stats.feeds, 3)
+        # Ours are released once refreshed, the other worker's lease is untouched
+        self.assertFalse(Source.objects.filter(claimed_by='me').exists())
+        self.assertEqual(list(Source.objects.filter(claimed_by='other')), held)
+
+
+class RefreshDaemonTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='daemon@example.com', password='password')
+        self.now = int(time.time())
+        self.feeds = [Feed.objects.create(user=self.user, url=f'http://daemon.example.com/{i}') for i in range(3)]
+        for offset, feed in zip((-600, -60, 3600), self.feeds):
+            Source.objects.filter(id=feed.source_id).update(next_refresh_on_time=self.now + offset)
+
+    def test_queue_pops_due_sources_most_overdue_first(self):
+        from api.daemon import RefreshQueue
+
+        queue = RefreshQueue()
+        queue.load([(1, 100), (2, 50), (3, 300)])
+        queue.push(1, 400)  # Rescheduled, the old entry is superseded
+        self.assertEqual(queue.depth(200), 1)
+        self.assertEqual(queue.lag(200), 150)
+        self.assertEqual(queue.pop_due(500, 10), [2, 3, 1])
+        self.assertEqual(len(queue), 0)
+        self.assertIsNone(queue.next_due())
+
+    def test_run_once_refreshes_due_sources_and_reschedules_them(self):
+        from api.parsing import FetchResult
+        from api.daemon import RefreshDaemon
+
+        daemon = RefreshDaemon(worker='daemon-test', workers=1, favicons=False)
+        parsed = FetchResult(304)
+        with patch('api.utils.fetch_feed', return_value=parsed) as fetch:
+            self.assertTrue(daemon.run_once())
+            self.assertFalse(daemon.run_once())
+
+        self.assertEqual([call.args[0].id for call in fetch.call_args_list],
+                         [self.feeds[0].source_id, self.feeds[1].source_id])
+        self.assertEqual(len(daemon.queue), 3)
+        self.assertEqual(daemon.queue.depth(int(time.time())), 0)
+        self.assertFalse(Source.objects.exclude(claimed_by='').exists())
+        status = daemon.update_status()
+        self.assertEqual((status['queue_depth'], status['lag_seconds'], status['refreshed']), (0, 0, 2))
+
+    def test_sources_leased_elsewhere_wait_for_the_lease(self):
+        from api.daemon import RefreshDaemon
+
+        Source.objects.claim('other', Source.objects.filter(id=self.feeds[0].source_id), 1, lease=300)
+        daemon = RefreshDaemon(worker='daemon-test', workers=1, favicons=False)
+        with patch('api.utils.fetch_feed', side_effect=OSError('boom')) as fetch:
+            daemon.run_once()
+        self.assertEqual([call.args[0].id for call in fetch.call_args_list], [self.feeds[1].source_id])
+        self.assertGreaterEqual(daemon.queue.next_due(), self.now + 300)
+
+    def test_stopped_daemon_starts_no_fetches(self):
+        from api.daemon import RefreshDaemon
+
+        daemon = RefreshDaemon(worker='daemon-test', workers=1, favicons=False)
+        daemon.stop()
+        with patch('api.utils.fetch_feed') as fetch:
+            daemon.run_once()
+            daemon.run()
+        fetch.assert_not_called()
+        self.assertEqual(daemon.queue.depth(int(time.time())), 2)
+
+    def test_stop_interrupts_a_queued_job_and_skips_favicons(self):
+        from api.daemon import RefreshDaemon
+        from api.parsing import FetchResult
+
+        daemon = RefreshDaemon(worker='daemon-test', workers=1)
+        job, _ = RefreshJob.objects.enqueue(self.user)
+
+        def fetch_then_stop(source):
+            daemon.stop()  # SIGTERM arrives during the job's first fetch
+            return FetchResult(304)
+
+        with patch('api.utils.fetch_feed', side_effect=fetch_then_stop) as fetch, \
+                patch('api.daemon.refresh_favicons') as icons:
+            daemon.run()
+        self.assertEqual(fetch.call_count, 1)
+        icons.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.PENDING)
+
+
+class RefreshJobTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='jobs@example.com', password='password')
+        self.api_key = hashlib.md5(b'jobs@example.com:password').hexdigest()
+        self.feed = Feed.objects.create(user=self.user, url='http://example.com/jobs')
+
+    def test_api_refresh_enqueues_without_fetching(self):
+        with patch('api.utils.fetch_feed') as fetch:
+            for _ in range(3):
+                response = self.client.post('/api/', {'api_key': self.api_key, 'refresh': ''})
+                self.assertEqual(response_json(response)['auth'], 1)
+        fetch.assert_not_called()
+        self.assertEqual(RefreshJob.objects.filter(user=self.user).count(), 1)
+
+    def test_duplicate_requests_merge_while_running(self):
+        job, created = RefreshJob.objects.enqueue(self.user)
+        self.assertTrue(created)
+        self.assertEqual(RefreshJob.objects.claim_next().pk, job.pk)
+        merged, created = RefreshJob.objects.enqueue(self.user)
+        self.assertFalse(created)
+        self.assertEqual(merged.pk, job.pk)
+        self.assertIsNone(RefreshJob.objects.claim_next())
+
+    def test_worker_processes_queued_jobs(self):
+        from feedparser import FeedParserDict
+        from api.utils import process_refresh_jobs
+
+        job, _ = RefreshJob.objects.enqueue(self.user)
+        parsed = FeedParserDict(feed=FeedParserDict(title='Jobs Feed'), entries=[])
+        with serve_document(parsed):
+            self.assertEqual(process_refresh_jobs(), 1)
+
+        job.refresh_from_db()
+        self.feed.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.DONE)
+        self.assertGreater(self.feed.last_refreshed_on_time, 0)
+        # A new request after completion queues a fresh job
+        self.assertTrue(RefreshJob.objects.enqueue(self.user)[1])
+
+    def test_job_cut_short_by_the_deadline_is_requeued(self):
+        from api.parsing import FetchResult
+        from api.utils import process_refresh_jobs
+
+        for i in range(2):
+            Feed.objects.create(user=self.user, url=f'http://example.com/jobs-{i}')
+        job, _ = RefreshJob.objects.enqueue(self.user)
+
+        def slow_fetch(source):
+            time.sleep(0.2)
+            return FetchResult(304)
+
+        with patch('api.utils.fetch_feed', side_effect=slow_fetch) as fetch:
+            started = time.monotonic()
+            self.assertEqual(process_refresh_jobs(workers=1, deadline=started + 0.1), 1)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertLess(time.monotonic() - started, 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.PENDING)
+
+    def test_job_finished_as_the_deadline_passes_is_done(self):
+        from api.parsing import FetchResult
+        from api.utils import process_refresh_jobs
+
+        job, _ = RefreshJob.objects.enqueue(self.user)
+
+        def slow_fetch(source):
+            time.sleep(0.2)
+            return FetchResult(304)
+
+        with patch('api.utils.fetch_feed', side_effect=slow_fetch) as fetch:
+            self.assertEqual(process_refresh_jobs(workers=1, deadline=time.monotonic() + 0.1), 1)
+        self.assertEqual(fetch.call_count, 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.DONE)
+
+    def test_deadline_run_leaves_jobs_for_later_once_out_of_time(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        job, _ = RefreshJob.objects.enqueue(self.user)
+        with patch('api.utils.fetch_feed') as fetch, \
+                patch('api.management.commands.refresh_feeds.refresh_favicons') as icons:
+            call_command('refresh_feeds', '--deadline', '30', '--reserve', '30', stdout=StringIO())
+        fetch.assert_not_called()
+        icons.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.PENDING)
+
+    def test_stale_running_job_is_expired(self):
+        job, _ = RefreshJob.objects.enqueue(self.user)
+        RefreshJob.objects.filter(pk=job.pk).update(status=RefreshJob.RUNNING, started_on_time=1)
+        new_job, created = RefreshJob.objects.enqueue(self.user)
+        self.assertTrue(created)
+        job.refresh_from_db()
+        self.assertEqual(job.status, RefreshJob.FAILED)
+
+
+class ItemIdCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='cache@example.com', password='password')
+        self.api_key = hashlib.md5(b'cache@example.com:password').hexdigest()
+        self.feed = Feed.objects.create(user=self.user, url='http://example.com/cache')
+        self.items = [
+            Item.objects.create(feed=self.feed, uid=f'c{i}', url_checksum=i, created_on_time=i, added_on_time=i)
+            for i in range(4)
+        ]
+
+    def get_ids(self, param):
+        response = self.client.get('/api/', {'api_key': self.api_key, param: ''})
+        value = response_json(response)[param]
+        return [int(i) for i in value.split(',')] if value else []
+
+    def test_pack_roundtrip(self):
+        from api.models import pack_ids, unpack_ids
+        ids = [1, 2, 3, 10, 2 ** 40]
+        self.assertEqual(unpack_ids(pack_ids(ids)), ids)
+        self.assertEqual(unpack_ids(pack_ids([])), [])
+
+    def test_cache_built_lazily_and_updated_by_marks(self):
+        from api.models import ItemIdCache
+        ids = [item.id for item in self.items]
+        self.assertEqual(self.get_ids('unread_item_ids'), ids)
+        self.assertTrue(ItemIdCache.objects.filter(user=self.user).exists())
+
+        Item.objects.mark_as_read(self.user, ids[:2])
+        Item.objects.mark_as_saved(self.user, [ids[3]])
+        self.assertEqual(self.get_ids('unread_item_ids'), ids[2:])
+        self.assertEqual(self.get_ids('saved_item_ids'), [ids[3]])
+
+        Item.objects.mark_feed_as_read(self.user, self.feed.id)
+        self.assertEqual(self.get_ids('unread_item_ids'), [])
+        Item.objects.mark_feed_as_unread(self.user, self.feed.id)
+        self.assertEqual(self.get_ids('unread_item_ids'), ids)
+
+        # Cached sets match a rebuild from the items table
+        cache = ItemIdCache.objects.get(user=self.user)
+        rebuilt = ItemIdCache.objects.rebuild(self.user)
+        self.assertEqual(cache.get_unread_ids(), rebuilt.get_unread_ids())
+        self.assertEqual(cache.get_saved_ids(), rebuilt.get_saved_ids())
+
+    def test_other_users_items_do_not_leak_into_cache(self):
+        other = FeverUser.objects.create_user(email='other@example.com', password='password')
+        self.get_ids('unread_item_ids')
+        Item.objects.mark_as_read(self.user, [self.items[0].id])
+        Item.objects.mark_as_unread(other, [self.items[0].id])
+        self.assertNotIn(self.items[0].id, self.get_ids('unread_item_ids'))
+
+    def test_ingested_items_join_cache(self):
+        from feedparser import FeedParserDict
+        from api.utils import refresh_feed
+
+        before = self.get_ids('unread_item_ids')
+        parsed = FeedParserDict(feed=FeedParserDict(), entries=[FeedParserDict(id='fresh')])
+        with serve_document(parsed):
+            refresh_feed(self.feed)
+        fresh = Item.objects.get(uid='fresh')
+        self.assertEqual(self.get_ids('unread_item_ids'), before + [fresh.id])
+
+    def test_feed_delete_invalidates_cache(self):
+        from api.models import ItemIdCache
+        self.get_ids('unread_item_ids')
+        self.feed.delete()
+        self.assertFalse(ItemIdCache.objects.filter(user=self.user).exists())
+        self.assertEqual(self.get_ids('unread_item_ids'), [])
+
+    def test_item_delete_leaves_cache(self):
+        ids = [item.id for item in self.items]
+        self.assertEqual(self.get_ids('unread_item_ids'), ids)
+        self.items[0].delete()
+        self.assertEqual(self.get_ids('unread_item_ids'), ids[1:])
+        response = self.client.get('/api/', {'api_key': self.api_key, 'items': ''})
+        self.assertEqual(response_json(response)['total_items'], 3)
+
+    def test_admin_bulk_delete_leaves_cache(self):
+        from django.contrib.admin.sites import site
+        from api.admin import ItemAdmin
+
+        ids = [item.id for item in self.items]
+        self.assertEqual(self.get_ids('unread_item_ids'), ids)
+        ItemAdmin(Item, site).delete_queryset(None, Item.objects.filter(id__in=ids[:2]))
+        self.assertEqual(self.get_ids('unread_item_ids'), ids[2:])
+        response = self.client.get('/api/', {'api_key': self.api_key, 'items': ''})
+        self.assertEqual(response_json(response)['total_items'], 2)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ItemIdCacheRebuildRaceTestCase(TransactionTestCase):
+    def test_insert_during_rebuild_reaches_the_cache(self):
+        """An item added while a rebuild is between its read and its save ends up in the cache"""
+        import threading
+        from django.db import connection
+        from api.models import ItemIdCache, pack_ids
+
+        user = FeverUser.objects.create_user(email='race@example.com', password='password')
+        feed = Feed.objects.create(user=user, url='http://example.com/race')
+        first = Item.objects.create(feed=feed, uid='a', url_checksum=1, created_on_time=1, added_on_time=1)
+        rebuild_read, release_rebuild = threading.Event(), threading.Event()
+        created = []
+
+        def paused_pack(ids):
+            # The rebuild has read the unread IDs; hold it there while the insert runs
+            if threading.current_thread().name == 'rebuild' and not rebuild_read.is_set():
+                rebuild_read.set()
+                release_rebuild.wait(5)
+            return pack_ids(ids)
+
+        def rebuild():
+            try:
+                ItemIdCache.objects.rebuild(user)
+            finally:
+                connection.close()
+
+        def insert():
+            try:
+                created.append(Item.objects.create(feed=feed, uid='b', url_checksum=2, created_on_time=2,
+                                                   added_on_time=2))
+            finally:
+                connection.close()
+
+        with patch('api.models.pack_ids', side_effect=paused_pack):
+            rebuilder = threading.Thread(target=rebuild, name='rebuild')
+            rebuilder.start()
+            self.assertTrue(rebuild_read.wait(5))
+            inserter = threading.Thread(target=insert)
+            inserter.start()
+            # The insert waits for the rebuild's lock instead of missing the cache row
+            inserter.join(0.5)
+            release_rebuild.set()
+            rebuilder.join(5)
+            inserter.join(5)
+
+        cache = ItemIdCache.objects.get(user=user)
+        self.assertEqual(cache.get_unread_ids(), [first.id, created[0].id])
+        self.assertEqual(cache.total_items, 2)
+
+
+class ItemPagingTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='paging@example.com', password='password')
+        self.api_key = hashlib.md5(b'paging@example.com:password').hexdigest()
+        self.feed = Feed.objects.create(user=self.user, url='http://example.com/paging')
+        Item.objects.bulk_create([
+            Item(feed=self.feed, user=self.user, uid=f'p{i}', url_checksum=i, created_on_time=i, added_on_time=i)
+            for i in range(120)
+        ])
+        self.ids = list(Item.objects.order_by('id').values_list('id', flat=True))
+
+    def get_items(self, **params):
+        response = self.client.get('/api/', {'api_key': self.api_key, 'items': '', **params})
+        return response_json(response)
+
+    def test_keyset_pages(self):
+        data = self.get_items()
+        self.assertEqual(data['total_items'], 120)
+        self.assertEqual([i['id'] for i in data['items']], self.ids[::-1][:50])
+
+        data = self.get_items(max_id=self.ids[70])
+        self.assertEqual([i['id'] for i in data['items']], self.ids[:70][::-1][:50])
+
+        data = self.get_items(since_id=self.ids[100])
+        self.assertEqual([i['id'] for i in data['items']], self.ids[101:])
+
+        data = self.get_items(with_ids=','.join(map(str, self.ids)))
+        self.assertEqual(len(data['items']), 50)
+
+    def test_total_items_follows_ingestion(self):
+        from feedparser import FeedParserDict
+        from api.utils import refresh_feed
+
+        self.assertEqual(self.get_items()['total_items'], 120)
+        parsed = FeedParserDict(feed=FeedParserDict(), entries=[FeedParserDict(id='new')])
+        with serve_document(parsed):
+            refresh_feed(self.feed)
+        self.assertEqual(self.get_items()['total_items'], 121)
+
+
+class StreamingJsonTestCase(TestCase):
+    async def test_stream_matches_json_response(self):
+        """Streamed output is byte-identical to JsonResponse on the materialized data"""
+        from django.http import JsonResponse
+        from api.streaming import JsonArray, JsonIdList, astream_json
+
+        rows = [{'id': i, 'title': f'T\u00e9st "{i}"', 'html': '<p>x</p>' * 50} for i in range(200)]
+        ids = list(range(1, 10000, 3))
+        lazy = {
+            'api_version': 3, 'auth': 1,
+            'items': JsonArray(iter(rows)),
+            'empty': JsonArray([]),
+            'unread_item_ids': JsonIdList(ids),
+            'saved_item_ids': JsonIdList([]),
+        }
+        plain = {
+            'api_version': 3, 'auth': 1,
+            'items': rows,
+            'empty': [],
+            'unread_item_ids': ','.join(map(str, ids)),
+            'saved_item_ids': '',
+        }
+        streamed = ''.join([chunk async for chunk in astream_json(lazy, chunk_size=1024)]).encode()
+        self.assertEqual(streamed, JsonResponse(plain).content)
+
+    async def test_async_rows_stream_like_plain_rows(self):
+        from api.streaming import JsonArray, JsonIdList, astream_json
+
+        rows = [{'id': i, 'title': f'T\u00e9st {i}'} for i in range(100)]
+
+        async def arows():
+            for row in rows:
+                yield row
+
+        streamed = ''.join([chunk async for chunk in astream_json(
+            {'items': JsonArray(arows()), 'ids': JsonIdList([1, 2, 3]), 'auth': 1}, chunk_size=256)])
+        expected = ''.join([chunk async for chunk in astream_json(
+            {'items': JsonArray(rows), 'ids': JsonIdList([1, 2, 3]), 'auth': 1})])
+        self.assertEqual(streamed, expected)
+
+
+class FaviconTestCase(TestCase):
+    def setUp(self):
+        self.alice = FeverUser.objects.create_user(email='alice@example.com', password='password')
+        self.bob = FeverUser.objects.create_user(email='bob@example.com', password='password')
+        self.feeds = [
+            Feed.objects.create(user=self.alice, url='https://blog.example.com/a.xml',
+                                site_url='https://blog.example.com/', domain='blog.example.com'),
+            Feed.objects.create(user=self.bob, url='https://blog.example.com/b.xml',
+                                site_url='https://blog.example.com/', domain='blog.example.com'),
+            Feed.objects.create(user=self.bob, url='https://other.example.org/feed',
+                                site_url='https://other.example.org/', domain='other.example.org'),
+        ]
+
+    def test_icons_shared_per_domain(self):
+        from api.favicons import refresh_favicons
+        from api.models import Favicon
+
+        def fake_fetch(site_url, domain, stopped=None):
+            if domain == 'blog.example.com':
+                return f'https://{domain}/favicon.ico', 'image/png;base64,AAAA'
+            return None, ''
+
+        with patch('api.favicons.fetch_favicon', side_effect=fake_fetch) as fetch:
+            self.assertEqual(refresh_favicons(), 2)
+            self.assertEqual(fetch.call_count, 2)
+
+            # Fresh icons and remembered failures are not fetched again
+            fetch.reset_mock()
+            self.assertEqual(refresh_favicons(), 0)
+            fetch.assert_not_called()
+
+        for feed in self.feeds:
+            feed.refresh_from_db()
+        self.assertIsNotNone(self.feeds[0].favicon_id)
+        self.assertEqual(self.feeds[0].favicon_id, self.feeds[1].favicon_id)
+        self.assertIsNone(self.feeds[2].favicon_id)
+        self.assertEqual(Favicon.objects.count(), 2)
+
+        api_key = hashlib.md5(b'bob@example.com:password').hexdigest()
+        data = response_json(self.client.get('/api/', {'api_key': api_key, 'favicons': ''}))
+        self.assertEqual(data['favicons'], [{'id': self.feeds[1].favicon_id, 'data': 'image/png;base64,AAAA'}])
+
+    def test_no_icon_fetch_starts_after_the_deadline(self):
+        from api.favicons import refresh_favicons
+        from api.models import Favicon
+
+        with patch('api.favicons.fetch_favicon') as fetch:
+            self.assertEqual(refresh_favicons(deadline=time.monotonic() - 1), 0)
+        fetch.assert_not_called()
+        # Nothing is recorded, the sites are tried again next time
+        self.assertFalse(Favicon.objects.exists())
+
+    def test_stale_icons_are_revalidated(self):
+        from api.favicons import refresh_favicons, FAVICON_TTL
+        from api.models import Favicon
+        from api.parsing import calculate_checksum
+
+        favicon = Favicon.objects.create(url='https://blog.example.com/old.ico', cache='image/png;base64,OLD',
+                                         url_checksum=calculate_checksum('blog.example.com'),
+                                         last_cached_on_time=int(time.time()) - FAVICON_TTL - 1)
+        Feed.objects.filter(domain='blog.example.com').update(favicon=favicon)
+
+        # An unreachable site keeps its previous icon
+        with patch('api.favicons.fetch_favicon', return_value=(None, '')):
+            refresh_favicons(Feed.objects.filter(domain='blog.example.com'))
+        favicon.refresh_from_db()
+        self.assertEqual(favicon.cache, 'image/png;base64,OLD')
+        self.assertGreater(favicon.last_cached_on_time, int(time.time()) - 60)
+
+    def test_icon_link_discovery(self):
+        from api.favicons import discover_icon_urls
+
+        page = ('text/html', b'<html><head><link rel="Shortcut Icon" href="/static/fav.png"></head></html>')
+        with patch('api.favicons._download', return_value=page):
+            self.assertEqual(
+                discover_icon_urls('https://blog.example.com/', 'blog.example.com'),
+                ['https://blog.example.com/static/fav.png', 'https://blog.example.com/favicon.ico'],
+            )
+
+    def test_icons_are_downloaded_on_the_shared_session(self):
+        import requests
+        from api.favicons import _download
+        from api.fetcher import get_session
+
+        with patch.object(get_session(), 'get', side_effect=requests.ConnectionError('down')) as get:
+            self.assertIsNone(_download('https://blog.example.com/favicon.ico'))
+        get.assert_called_once()
+
+
+class HotLinkTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='links@example.com', password='password')
+        self.api_key = hashlib.md5(b'links@example.com:password').hexdigest()
+        self.feeds = [
+            Feed.objects.create(user=self.user, url=f'https://site{i}.example.com/feed',
+                                site_url=f'https://site{i}.example.com/')
+            for i in range(3)
+        ]
+
+    def ingest(self, feed, uid, html):
+        from feedparser import FeedParserDict
+        from api.utils import refresh_feed
+
+        entry = FeedParserDict(id=uid, link=f'{feed.site_url}{uid}', summary=html)
+        parsed = FeedParserDict(feed=FeedParserDict(), entries=[entry])
+        with serve_document(parsed):
+            refresh_feed(feed)
+
+    def get_links(self):
+        response = self.client.get('/api/', {'api_key': self.api_key, 'links': ''})
+        return response_json(response)['links']
+
+    def test_links_extracted_and_weighted_at_ingestion(self):
+        from api.models import Link
+        hot = '<a href="https://news.example.net/story#top">Big story</a>'
+        self.ingest(self.feeds[0], 'a', f'<p>{hot} and <a href="/local">our own page</a></p>')
+        self.ingest(self.feeds[1], 'b', f'<p>Also {hot}</p><a href="mailto:x@example.com">mail</a>')
+        self.ingest(self.feeds[2], 'c', '<a href="https://elsewhere.example.net/">Other</a>')
+
+        self.assertEqual(Link.objects.count(), 4)
+        local = Link.objects.get(url='https://site0.example.com/local')
+        self.assertTrue(local.is_local)
+
+        links = self.get_links()
+        self.assertEqual([(link['url'], link['temperature']) for link in links], [
+            ('https://news.example.net/story', 2),
+            ('https://elsewhere.example.net/', 1),
+        ])
+        self.assertEqual(links[0]['title'], 'Big story')
+
+    def test_links_range_offset_and_page(self):
+        from api.links import BUCKET_SECONDS, LINKS_PER_PAGE
+        from api.models import Item
+
+        self.ingest(self.feeds[0], 'a', '<a href="https://recent.example.net/">x</a>')
+        self.ingest(self.feeds[1], 'b', '<a href="https://old.example.net/">x</a>')
+        self.ingest(self.feeds[2], 'c', '<a href="https://old.example.net/">x</a>')
+
+        # Move the "old" links ten days back and recount their buckets
+        from api.links import update_link_buckets
+        from api.models import HotLinkBucket, Link
+        from api.parsing import calculate_checksum
+        ten_days_ago = int(time.time()) - 10 * BUCKET_SECONDS
+        Link.objects.filter(url='https://old.example.net/').update(created_on_time=ten_days_ago)
+        HotLinkBucket.objects.filter(url_checksum=calculate_checksum('https://old.example.net/')).delete()
+        update_link_buckets(self.user.id, [calculate_checksum('https://old.example.net/')], ten_days_ago, ten_days_ago)
+
+        def urls(**params):
+            response = self.client.get('/api/', {'api_key': self.api_key, 'links': '', **params})
+            return [(link['url'], link['temperature']) for link in response_json(response)['links']]
+
+        self.assertEqual(urls(), [('https://recent.example.net/', 1)])
+        self.assertEqual(urls(range=14), [('https://old.example.net/', 2), ('https://recent.example.net/', 1)])
+        self.assertEqual(urls(offset=8, range=7), [('https://old.example.net/', 2)])
+        self.assertEqual(urls(range=14, page=2), [])
+
+        links = response_json(self.client.get('/api/', {'api_key': self.api_key, 'links': '', 'range': 14}))['links']
+        old_items = sorted(Item.objects.filter(uid__in=['b', 'c']).values_list('id', flat=True))
+        self.assertEqual(links[0]['item_ids'], ','.join(map(str, old_items)))
+        self.assertEqual(LINKS_PER_PAGE, 50)
+
+    def test_malformed_or_extreme_link_params_fall_back(self):
+        self.ingest(self.feeds[0], 'a', '<a href="https://recent.example.net/">x</a>')
+
+        def urls(**params):
+            response = self.client.get('/api/', {'api_key': self.api_key, 'links': '', **params})
+            self.assertEqual(response.status_code, 200)
+            return [link['url'] for link in response_json(response)['links']]
+
+        self.assertEqual(urls(range='x', offset='', page='1.5'), ['https://recent.example.net/'])
+        self.assertEqual(urls(range=-3, page=0), ['https://recent.example.net/'])
+        self.assertEqual(urls(range=10 ** 30, offset=-10 ** 30), ['https://recent.example.net/'])
+        self.assertEqual(urls(offset=10 ** 30), [])
+
+
+class RetentionTestCase(TestCase):
+    def setUp(self):
+        self.user = FeverUser.objects.create_user(email='prune@example.com', password='password')
+        self.feed = Feed.objects.create(user=self.user, url='https://prune.example.com/feed')
+        self.now = int(time.time())
+        old = self.now - 60 * 24 * 60 * 60
+        self.items = [
+            Item.objects.create(feed=self.feed, uid=str(i), url_checksum=i, created_on_time=old + i,
+                                added_on_time=old + i, read_on_time=old + i)
+            for i in range(10)
+        ]
+        # Unread and saved old items are always kept
+        ItemState.objects.filter(item_id=self.items[0].id).update(read_on_time=0)
+        ItemState.objects.filter(item_id=self.items[1].id).update(is_saved=True)
+
+    def test_policy_precedence(self):
+        from api.retention import feed_policy
+        self.assertEqual(feed_policy(self.feed, 30, 50), (30, 50))
+        self.user.retention_days = 7
+        self.assertEqual(feed_policy(self.feed, 30, 50), (7, 50))
+        self.feed.retention_days = 0
+        self.feed.retention_min_items = 5
+        self.assertEqual(feed_policy(self.feed, 30, 50), (0, 5))
+
+    def test_prune_in_batches_keeps_unread_saved_and_newest(self):
+        from api.models import ItemIdCache
+        from api.retention import prune_feed
+
+        ItemIdCache.objects.rebuild(self.user)
+        removed = prune_feed(self.feed, days=30, min_items=3, batch_size=2)
+        self.assertEqual(removed, 5)
+        kept = set(Item.objects.filter(feed=self.feed).values_list('uid', flat=True))
+        self.assertEqual(kept, {'0', '1', '7', '8', '9'})
+        self.assertEqual(ItemIdCache.objects.get(user=self.user).total_items, 5)
+        self.assertEqual(prune_feed(self.feed, days=30, min_items=3), 0)
+
+    def test_recent_items_and_disabled_policy_are_kept(self):
+        from api.retention import prune_feed
+        self.assertEqual(prune_feed(self.feed, days=90, min_items=0), 0)
+        self.assertEqual(prune_feed(self.feed, days=0, min_items=0), 0)
+        self.assertEqual(Item.objects.filter(feed=self.feed).count(), 10)
+
+    def test_pruning_recounts_hot_link_buckets(self):
+        from api.links import index_item_links
+        from api.models import HotLinkBucket
+        from api.retention import prune_feed
+
+        for item in self.items[2:4]:
+            item.description = '<a href="https://hot.example.net/">hot</a>'
+        index_item_links(self.feed, self.items[2:4])
+        self.assertEqual(sum(HotLinkBucket.objects.values_list('weight', flat=True)), 2)
+
+        prune_feed(self.feed, days=30, min_items=7)
+        self.assertFalse(Item.objects.filter(id=self.items[2].id).exists())
+        self.assertTrue(Item.objects.filter(id=self.items[3].id).exists())
+        self.assertEqual(sum(HotLinkBucket.objects.values_list('weight', flat=True)), 1)
+
+    def test_command_archives_to_table(self):
+        import zlib
+        from io import StringIO
+        from django.core.management import call_command
+        from api.models import ItemArchive
+
+        out = StringIO()
+        call_command('prune_items', '--min-items', '0', '--dry-run', stdout=out)
+        self.assertIn('Would prune 8 items', out.getvalue())
+        self.assertEqual(Item.objects.count(), 10)
+
+        call_command('prune_items', '--min-items', '0', '--archive', stdout=StringIO())
+        self.assertEqual(Item.objects.count(), 2)
+        archived = ItemArchive.objects.get(id=self.items[5].id)
+        self.assertEqual(archived.user_id, self.user.id)
+        self.assertEqual(json.loads(zlib.decompress(archived.data))['uid'], '5')
+
+
+class ItemBodyCompressionTestCase(TestCase):
+    def setUp(self):
+        from api.compression import clear_dictionary_cache
+        clear_dictionary_cache()
+        self.addCleanup(clear_dictionary_cache)
+        self.user = FeverUser.objects.create_user(email='bodies@example.com', password='password')
+        self.api_key = hashlib.md5(b'bodies@example.com:password').hexdigest()
+        self.feed = Feed.objects.create(user=self.user, url='https://bodies.example.com/feed')
+
+    def create_items(self, count):
+        return [
+            Item.objects.create(
+                feed=self.feed, uid=str(i), url_checksum=i, created_on_time=i, added_on_time=i,
+                description=f'<p class="entry-content">Paragraph number {i} about compression</p>'
+                            f'<a href="https://bodies.example.com/{i}" rel="nofollow">Continue reading</a>',
+            )
+            for i in range(count)
+        ]
+
+    def test_codec_round_trip(self):
+        from api.compression import decompress_body, encode_body, train_dictionary
+        html = '<p>Ünïcode ✓ ' + 'repeated text ' * 50 + '</p>'
+        self.assertIsNone(encode_body(None))
+        self.assertEqual(decompress_body(encode_body('')), '')
+        self.assertEqual(decompress_body(encode_body('x')), 'x')
+        self.assertLess(len(encode_body(html)), len(html.encode()))
+        self.assertEqual(decompress_body(encode_body(html)), html)
+
+        from api.models import CompressionDictionary
+        data = train_dictionary([html, html.replace('repeated', 'other')])
+        dictionary = CompressionDictionary.objects.create(data=data, created_on_time=0)
+        blob = encode_body(html, (dictionary.id, data))
+        self.assertEqual(blob[0], 2)
+        self.assertEqual(decompress_body(blob), html)
+
+    def test_bodies_are_stored_compressed_and_loaded_lazily(self):
+        item = self.create_items(1)[0]
+        self.assertTrue(item.body_size > 0)
+        self.assertLess(len(item.body), item.body_size)
+
+        item = Item.objects.get(id=item.id)
+        self.assertIn('body', item.get_deferred_fields())
+        self.assertIn('Paragraph number 0', item.description)
+
+    def test_get_items_serializes_html(self):
+        items = self.create_items(3)
+        response = self.client.get('/api/', {'api_key': self.api_key, 'items': ''})
+        html = {item['id']: item['html'] for item in response_json(response)['items']}
+        self.assertEqual(html, {item.id: item.description for item in items})
+
+    def test_train_recompress_and_report(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from api.compression import decompress_body
+
+        items = self.create_items(20)
+        plain_size = sum(len(body) for body in Item.objects.values_list('body', flat=True))
+
+        out = StringIO()
+        call_command('compress_items', '--train', '--recompress', stdout=out)
+        self.assertIn('Trained dictionary', out.getvalue())
+        self.assertIn('Recompressed 20 items', out.getvalue())
+        self.assertIn('ratio', out.getvalue())
+
+        bodies = dict(Item.objects.values_list('id', 'body'))
+        self.assertLess(sum(len(body) for body in bodies.values()), plain_size)
+        for item in items:
+            self.assertEqual(bytes(bodies[item.id])[0], 2)
+            self.assertEqual(decompress_body(bodies[item.id]), item.description)
+
+
+class SharedSourceTestCase(TestCase):
+    def setUp(self):
+        self.alice = FeverUser.objects.create_user(email='alice@example.com', password='password')
+        self.bob = FeverUser.objects.create_user(email='bob@example.com', password='password')
+        self.url = 'https://shared.example.com/feed'
+        self.alice_feed = Feed.objects.create(user=self.alice, url=self.url)
+        self.bob_feed = Feed.objects.create(user=self.bob, url=self.url, user_title='Bob\'s name')
+
+    def test_subscriptions_share_one_source(self):
+        from django.db import IntegrityError, transaction
+        self.assertEqual(Source.objects.count(), 1)
+        self.assertEqual(self.alice_feed.source_id, self.bob_feed.source_id)
+        self.assertNotEqual(self.alice_feed.id, self.bob_feed.id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Feed.objects.create(user=self.alice, url=self.url)
+
+    def test_source_is_keyed_by_url_not_the_callers_checksum(self):
+        """setup_demo style callers pass their own url_checksum; it must not pick the Source"""
+        carol = FeverUser.objects.create_user(email='carol@example.com', password='password')
+        dave = FeverUser.objects.create_user(email='dave@example.com', password='password')
+        url = 'https://other.example.com/feed'
+        short = int(hashlib.md5(url.encode()).hexdigest()[:8], 16)
+        carol_feed = Feed.objects.create(user=carol, url=url, url_checksum=short)
+        dave_feed = Feed.objects.create(user=dave, url=url)
+        self.assertEqual(carol_feed.source_id, dave_feed.source_id)
+        self.assertEqual(Source.objects.filter(url=url).count(), 1)
+
+        # A checksum that happens to be another URL's does not attach to that URL's Source
+        clash = Feed.objects.create(user=carol, url='https://third.example.com/feed',
+                                    url_checksum=self.alice_feed.source.url_checksum)
+        self.assertNotEqual(clash.source_id, self.alice_feed.source_id)
+        self.assertEqual(clash.source.url, 'https://third.example.com/feed')
+
+    def test_source_fetched_once_and_items_fanned_out(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from feedparser import FeedParserDict
+
+        parsed = FeedParserDict(
+            feed=FeedParserDict(title='Shared Feed', link='https://shared.example.com/'),
+            entries=[FeedParserDict(id=f'e{i}', link=f'https://shared.example.com/{i}', summary=f'<p>{i}</p>')
+                     for i in range(3)],
+        )
+        with serve_document(parsed) as fetch:
+            call_command('refresh_feeds', '--skip-favicons', stdout=StringIO())
+        self.assertEqual(fetch.call_count, 1)
+
+        alice_ids = set(Item.objects.filter(user=self.alice).values_list('id', flat=True))
+        bob_ids = set(Item.objects.filter(user=self.bob).values_list('id', flat=True))
+        self.assertEqual(len(alice_ids), 3)
+        self.assertEqual(len(bob_ids), 3)
+        self.assertFalse(alice_ids & bob_ids)
+
+        Item.objects.mark_feed_as_read(self.alice, self.alice_feed.id)
+        self.assertEqual(ItemState.objects.filter(user=self.bob, read_on_time=0).count(), 3)
+
+        self.bob_feed.refresh_from_db()
+        self.assertEqual(self.bob_feed.title, 'Shared Feed')
+        self.assertEqual(self.bob_feed.user_title, 'Bob\'s name')
+        self.assertGreater(self.bob_feed.last_updated_on_time, 0)
+
+    def test_edited_url_moves_the_feed_to_its_source(self):
+        from api.models import _url_checksum
+        shared = self.alice_feed.source_id
+        moved = 'https://moved.example.com/feed'
+
+        self.alice_feed.url = moved
+        self.alice_feed.save()
+        self.assertEqual(self.alice_feed.source.url, moved)
+        self.assertEqual(self.alice_feed.url_checksum, _url_checksum(moved))
+        # Bob still reads the old address
+        self.assertTrue(Source.objects.filter(id=shared).exists())
+
+        self.bob_feed.url = moved
+        self.bob_feed.save()
+        self.assertEqual(self.bob_feed.source_id, self.alice_feed.source_id)
+        self.assertFalse(Source.objects.filter(id=shared).exists())
+
+    def test_source_removed_with_last_subscription(self):
+        self.alice_feed.delete()
+        self.assertTrue(Source.objects.exists())
+        self.bob_feed.delete()
+        self.assertFalse(Source.objects.exists())
+
+
+class ApiKeyCacheTestCase(TestCase):
+    def setUp(self):
+        from api.auth_cache import api_key_cache
+        api_key_cache.clear()
+        self.user = FeverUser.objects.create_user(email='keys@example.com', password='password')
+        self.api_key = hashlib.md5(b'keys@example.com:password').hexdigest()
+
+    def test_key_lookup_is_cached(self):
+        from api.views import authenticate_api_key
+        self.assertEqual(authenticate_api_key(self.api_key).id, self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(authenticate_api_key(self.api_key.upper()).id, self.user.id)
+
+    def test_set_password_invalidates_key(self):
+        from api.views import authenticate_api_key
+        self.assertIsNotNone(authenticate_api_key(self.api_key))
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertIsNone(authenticate_api_key(self.api_key))
+        self.assertEqual(authenticate_api_key(hashlib.md5(b'keys@example.com:changed').hexdigest()).id, self.user.id)
+
+    def test_deactivated_user_is_dropped(self):
+        from api.auth_cache import api_key_cache
+        from api.views import authenticate_api_key
+        authenticate_api_key(self.api_key)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(api_key_cache.get(self.api_key))
+
+    def test_session_time_written_at_most_once_per_interval(self):
+        from asgiref.sync import async_to_sync
+        from api.auth_cache import atouch_session, SESSION_WRITE_INTERVAL
+        touch_session = async_to_sync(atouch_session)
+        now = int(time.time())
+        with self.assertNumQueries(1):
+            self.assertTrue(touch_session(self.user, now))
+        with self.assertNumQueries(0):
+            self.assertFalse(touch_session(self.user, now + SESSION_WRITE_INTERVAL - 1))
+        self.assertTrue(touch_session(self.user, now + SESSION_WRITE_INTERVAL))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_session_on_time, now + SESSION_WRITE_INTERVAL)
+
+    def test_repeat_poll_skips_auth_and_session_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.get('/api/', {'api_key': self.api_key})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/', {'api_key': self.api_key})
+        self.assertEqual(response_json(response)['auth'], 1)
+        self.assertFalse([q for q in queries if 'fever_users' in q['sql']])
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from api.auth_cache import api_key_cache
+        cache.clear()
+        api_key_cache.clear()
+        self.user = FeverUser.objects.create_user(email='etag@example.com', password='password')
+        self.api_key = hashlib.md5(b'etag@example.com:password').hexdigest()
+        self.feed = Feed.objects.create(user=self.user, title='ETag Feed', url='http://example.com/etag.xml')
+        self.item = Item.objects.create(feed=self.feed, title='One', url_checksum=1, created_on_time=1000, added_on_time=1000)
+
+    def poll(self, **params):
+        headers = {}
+        if 'etag' in params:
+            headers['If-None-Match'] = params.pop('etag')
+        return self.client.get('/api/', {'api_key': self.api_key, **params}, headers=headers)
+
+    def test_unchanged_poll_is_not_modified_without_queries(self):
+        response = self.poll(unread_item_ids='')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response_body(response)
+
+        with self.assertNumQueries(0):
+            response = self.poll(unread_item_ids='', etag=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_identical_poll_is_served_from_the_response_cache(self):
+        first = response_json(self.poll(items=''))
+        with self.assertNumQueries(0):
+            response = self.poll(items='')
+        self.assertEqual(json.loads(response.content), first)
+
+    def test_marking_changes_the_etag(self):
+        response = self.poll(unread_item_ids='')
+        etag = response['ETag']
+        self.assertEqual(response_json(response)['unread_item_ids'], str(self.item.id))
+
+        marked = self.poll(mark='item', **{'as': 'read', 'id': self.item.id})
+        self.assertFalse(marked.has_header('ETag'))
+        response_json(marked)
+
+        response = self.poll(unread_item_ids='', etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response_json(response)['unread_item_ids'], '')
+
+    def test_new_items_change_the_etag(self):
+        etag = self.poll(items='')['ETag']
+        Item.objects.create(feed=self.feed, title='Two', url_checksum=2, created_on_time=2000, added_on_time=2000)
+        response = self.poll(items='', etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_json(response)['total_items'], 2)
+
+    def test_refresh_without_changes_keeps_the_etag(self):
+        from feedparser import FeedParserDict
+        from api.utils import refresh_feed
+
+        entry = FeedParserDict(id='a', link='http://example.com/a', title='A')
+        document = FeedParserDict(feed=FeedParserDict(title='ETag Feed'), entries=[entry])
+        with serve_document(document):
+            refresh_feed(self.feed)
+        self.user.refresh_from_db()
+        version = self.user.data_version
+        etag = self.poll(items='')['ETag']
+
+        with serve_document(FeedParserDict(), status=304):
+            refresh_feed(self.feed)
+        with serve_document(document):
+            refresh_feed(self.feed)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.data_version, version)
+        self.assertEqual(self.poll(items='', etag=etag).status_code, 304)
+
+        document.feed.title = 'Renamed'
+        with serve_document(document):
+            refresh_feed(self.feed)
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.data_version, version)
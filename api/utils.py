@@ -1,86 +1,456 @@
-import feedparser
+import os
+import socket
 import time
-import calendar
-import hashlib
 import logging
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
 from urllib.parse import urlparse
-from .models import Feed, Item
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Value, When
+from .compression import active_dictionary
+from .fetcher import FeedFetchError, fetch_feed
+from .parsing import FetchResult, get_parse_pool, parse_feed, shutdown_parse_pool, wants_pool
+from .models import Feed, Item, ItemIdCache, ItemState, RefreshJob, Source
+from .response_cache import bump_versions
 
 logger = logging.getLogger(__name__)
 
-def calculate_checksum(text):
-    """Calculate checksum for URL/text"""
-    if not text:
-        return 0
-    # Use BigIntegerField compatible checksum (64-bit signed)
-    # We take first 15 hex chars (60 bits) to be safe within 63 bits (signed 64-bit)
-    return int(hashlib.md5(text.encode()).hexdigest()[:15], 16)
+# Defaults for the concurrent refresh engine
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 2
+
+# Bounds for the adaptive per-feed refresh schedule (seconds)
+MIN_REFRESH_INTERVAL = 15 * 60
+MAX_REFRESH_INTERVAL = 24 * 60 * 60
+SCHEDULE_FIELDS = ['next_refresh_on_time', 'refresh_interval', 'error_count']
+FETCH_FIELDS = ['fetch_url', 'last_fetch_ms', 'last_fetch_bytes']
+
+
+def refresh_source(source):
+    """Fetch and parse RSS feed, storing new entries for every subscriber"""
+    logger.info(f"Refreshing feed: {source.title or source.url}")
+    try:
+        parsed = parse_feed(fetch_feed(source), int(time.time()), active_dictionary())
+        return process_source(source, parsed)
+    except Exception:
+        record_refresh_failure(source)
+        raise
+
 
 def refresh_feed(feed):
-    """Fetch and parse RSS feed"""
-    logger.info(f"Refreshing feed: {feed.title or feed.url}")
-    parsed = feedparser.parse(
-        feed.url,
-        agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36"
+    """Refresh the source behind one subscription"""
+    return refresh_source(feed.source)
+
+
+def schedule_next_refresh(source, current_time, changed):
+    """
+    Decide when a successfully fetched feed is due again.
+
+    A feed that just produced new items is polled about twice per observed
+    posting gap (time since it last changed, or since it was added). Quiet
+    feeds back off by half their interval each run.
+    """
+    if changed:
+        last_change = source.last_updated_on_time or source.last_added_on_time
+        interval = (current_time - last_change) // 2 if last_change else MIN_REFRESH_INTERVAL
+    else:
+        interval = max(source.refresh_interval, MIN_REFRESH_INTERVAL) * 3 // 2
+    source.error_count = 0
+    source.refresh_interval = min(max(interval, MIN_REFRESH_INTERVAL), MAX_REFRESH_INTERVAL)
+    source.next_refresh_on_time = current_time + source.refresh_interval
+
+
+def record_refresh_failure(source):
+    """Back off exponentially from a feed that keeps failing"""
+    source.error_count = min(source.error_count + 1, 32)
+    source.refresh_interval = min(MIN_REFRESH_INTERVAL * 2 ** min(source.error_count, 10), MAX_REFRESH_INTERVAL)
+    source.next_refresh_on_time = int(time.time()) + source.refresh_interval
+    fields = SCHEDULE_FIELDS
+    if source.fetch_url:
+        # The feed may have failed where it was redirected to, start over from the subscribed URL
+        source.fetch_url = ''
+        fields = SCHEDULE_FIELDS + ['fetch_url']
+    source.save(update_fields=fields)
+
+
+@dataclass
+class RefreshResult:
+    """Outcome of storing one parsed feed"""
+    inserted: int = 0
+    skipped: int = 0
+    not_modified: bool = False
+
+
+def store_entries(feed, entries, current_time):
+    """Insert the entries one subscription does not have yet, returns the number inserted"""
+    # One query for the uids we already have, instead of one per entry
+    existing_uids = set(
+        Item.objects.filter(feed=feed, uid__in=[entry['uid'] for entry in entries]).values_list('uid', flat=True)
+    )
+
+    new_items = []
+    for entry in entries:
+        if entry['uid'] in existing_uids:
+            continue
+        item = Item(
+            feed=feed,
+            user_id=feed.user_id,
+            uid=entry['uid'],
+            title=entry['title'],
+            author=entry['author'],
+            link=entry['link'],
+            url_checksum=entry['url_checksum'],
+            created_on_time=entry['created_on_time'],
+            added_on_time=current_time
+        )
+        item.set_description(entry['description'], entry['body'])
+        new_items.append(item)
+
+    if not new_items:
+        return 0
+
+    # The (feed, uid) unique constraint makes concurrent inserts of the same entry harmless
+    Item.objects.bulk_create(new_items, batch_size=500, ignore_conflicts=True)
+
+    from .links import index_item_links
+
+    # ignore_conflicts leaves pks unset, so read back the IDs we just created
+    ids_by_uid = dict(
+        Item.objects.filter(feed=feed, uid__in=[item.uid for item in new_items]).values_list('uid', 'id')
+    )
+    for item in new_items:
+        item.id = ids_by_uid.get(item.uid)
+    new_items = [item for item in new_items if item.id is not None]
+    new_ids = sorted(item.id for item in new_items)
+    ItemState.objects.bulk_create(
+        [ItemState(item_id=item.id, user_id=feed.user_id, feed_id=feed.id, created_on_time=item.created_on_time)
+         for item in new_items],
+        batch_size=500,
     )
+    ItemIdCache.objects.apply(feed.user_id, unread_add=new_ids, total_delta=len(new_ids))
+    index_item_links(feed, new_items)
+    return len(new_items)
+
+
+def process_source(source, parsed):
+    """
+    Store a ParsedFeed and its new entries. The feed is parsed once and its
+    items are added to each subscriber's Feed, so Fever feed and item IDs
+    stay per user.
+    """
+    if parsed.status >= 400:
+        raise FeedFetchError(f"HTTP status {parsed.status}")
 
     current_time = int(time.time())
-    feed.last_refreshed_on_time = current_time
+    source.last_refreshed_on_time = current_time
+    source.last_fetch_ms, source.last_fetch_bytes = parsed.fetch_ms, parsed.fetch_bytes
+    if parsed.redirect_url:
+        source.fetch_url = parsed.redirect_url
+    subscriptions = Feed.objects.filter(source=source)
+
+    # Nothing changed since the last fetch, nothing was parsed
+    if parsed.status == 304:
+        schedule_next_refresh(source, current_time, changed=False)
+        source.save(update_fields=['last_refreshed_on_time'] + SCHEDULE_FIELDS + FETCH_FIELDS)
+        subscriptions.update(last_refreshed_on_time=current_time)
+        logger.info(f"  Not modified: {source.title or source.url}")
+        return RefreshResult(not_modified=True)
+
+    # Remember validators for the next conditional GET
+    if parsed.etag:
+        source.etag = parsed.etag
+    if parsed.modified:
+        source.last_modified = parsed.modified
 
     # Update feed metadata
-    if hasattr(parsed, 'feed'):
-        if hasattr(parsed.feed, 'title') and parsed.feed.title:
-            feed.title = parsed.feed.title
-        if hasattr(parsed.feed, 'link') and parsed.feed.link:
-            feed.site_url = parsed.feed.link
-            feed.domain = urlparse(parsed.feed.link).netloc
-
-    feed.save()
-
-    # Process entries
-    logger.info(f"  Fetched {len(parsed.entries)} entries (HTTP status: {getattr(parsed, 'status', 'N/A')})")
-    new_items_count = 0
-    for entry in parsed.entries:
-        # Generate unique ID
-        item_link = entry.get('link', '')
-        item_title = entry.get('title', '')
-        item_uid = entry.get('id', item_link)
-
-        # Check if item already exists
-        # We use the uid to check for existence, which is more reliable
-        if Item.objects.filter(feed=feed, uid=item_uid).exists():
-            continue
+    if parsed.title:
+        source.title = parsed.title
+    if parsed.site_url:
+        source.site_url = parsed.site_url
+        source.domain = urlparse(parsed.site_url).netloc
 
-        url_checksum = calculate_checksum(item_link)
+    logger.info(f"  Fetched {parsed.entry_count} entries (HTTP status: {parsed.status})")
+    entries = parsed.entries
 
-        # Create new item
-        description = entry.get('summary', '') or entry.get('description', '')
-        if hasattr(entry, 'content') and entry.content:
-            description = entry.content[0].value
+    result = RefreshResult()
+    updated = []
+    # Only users whose items or feed metadata changed get new response versions
+    changed_users = set()
+    metadata = (source.title, source.site_url, source.domain)
+    for feed in subscriptions:
+        if (feed.title, feed.site_url, feed.domain) != metadata:
+            changed_users.add(feed.user_id)
+        feed.title, feed.site_url, feed.domain = metadata
+        inserted = store_entries(feed, entries, current_time)
+        result.inserted += inserted
+        result.skipped += parsed.entry_count - inserted
+        if inserted:
+            updated.append(feed.id)
+            changed_users.add(feed.user_id)
 
-        published_time = entry.get('published_parsed') or entry.get('updated_parsed')
-        if published_time:
-            # feedparser returns UTC struct_time, so use timegm to get correct timestamp
-            created_on_time = int(calendar.timegm(published_time))
-        else:
-            created_on_time = current_time
+    schedule_next_refresh(source, current_time, changed=result.inserted > 0)
+    if result.inserted > 0:
+        source.last_updated_on_time = current_time
+    source.save()
 
-        Item.objects.create(
-            feed=feed,
-            uid=item_uid,
-            title=item_title,
-            author=entry.get('author', ''),
-            description=description,
-            link=item_link,
-            url_checksum=url_checksum,
-            created_on_time=created_on_time,
-            added_on_time=current_time
+    # Subscriptions mirror the source's metadata for get_feeds
+    Feed.objects.filter(source=source).update(
+        title=source.title,
+        site_url=source.site_url,
+        domain=source.domain,
+        last_refreshed_on_time=current_time,
+        last_updated_on_time=Case(
+            When(id__in=updated, then=Value(current_time)),
+            default=F('last_updated_on_time'),
+            output_field=BigIntegerField(),
+        ),
+    )
+    bump_versions(changed_users)
+
+    logger.info(f"  Added {result.inserted} new items to {source.title or source.url} ({result.skipped} already stored)")
+    return result
+
+
+@dataclass
+class RefreshStats:
+    """Throughput figures for a batch refresh"""
+    feeds: int = 0
+    errors: int = 0
+    not_modified: int = 0
+    inserted: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    fetch_times: list = field(default_factory=list)
+    not_started: list = field(default_factory=list)  # Sources left for the next run by a deadline
+    cut_short: bool = False  # Stopped by a deadline or stop with sources still to refresh
+
+    def merge(self, other):
+        """Fold in the figures of another batch of the same run"""
+        for name in ('feeds', 'errors', 'not_modified', 'inserted', 'skipped'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.fetch_times.extend(other.fetch_times)
+        self.not_started.extend(other.not_started)
+
+    @property
+    def feeds_per_second(self):
+        return self.feeds / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def p95_fetch_time(self):
+        if not self.fetch_times:
+            return 0.0
+        ordered = sorted(self.fetch_times)
+        # Nearest-rank percentile
+        index = max(0, -(-95 * len(ordered) // 100) - 1)
+        return ordered[index]
+
+
+def out_of_time(deadline=None, stop=None):
+    """Whether a `deadline` (a time.monotonic() value) has passed or `stop` (a threading.Event) is set"""
+    return (deadline is not None and time.monotonic() >= deadline) or (stop is not None and stop.is_set())
+
+
+def _timed_fetch(source, dictionary):
+    """
+    Fetch on a worker thread. Small documents are parsed right here; large
+    ones come back as the raw FetchResult for the parse pool.
+    """
+    started = time.monotonic()
+    try:
+        fetched = fetch_feed(source)
+    except Exception as e:
+        return None, e, time.monotonic() - started
+    duration = time.monotonic() - started
+    if wants_pool(fetched):
+        return fetched, None, duration
+    try:
+        return parse_feed(fetched, int(time.time()), dictionary), None, duration
+    except Exception as e:
+        return None, e, duration
+
+
+def refresh_feeds_concurrently(sources, workers=DEFAULT_FETCH_WORKERS, per_host=DEFAULT_PER_HOST_LIMIT, callback=None,
+                               deadline=None, stop=None):
+    """
+    Refresh many sources with their network fetches overlapped.
+
+    Fetches run on a thread pool with at most `per_host` requests in flight
+    against any one host, started in the order `sources` are given. Large
+    documents are parsed in the parse process pool so parsing uses every
+    core. Database writes stay on the calling thread and each source is
+    committed as soon as it is parsed. `callback(source, result, error)` is invoked on the
+    calling thread after every source. No new fetch is started after
+    `deadline` (a time.monotonic() value) or once `stop` (a threading.Event)
+    is set; the sources left over are listed in `not_started`.
+    """
+    stats = RefreshStats()
+    started = time.monotonic()
+
+    # Queue sources per host so a busy host never holds up the others
+    pending = defaultdict(deque)
+    for position, source in enumerate(sources):
+        pending[urlparse(source.url).netloc.lower()].append((position, source))
+    in_flight = defaultdict(int)
+
+    def next_source():
+        # The earliest source among the hosts that have a free slot
+        host = min(
+            (host for host, queue in pending.items() if queue and in_flight[host] < per_host),
+            key=lambda host: pending[host][0][0],
+            default=None,
         )
-        new_items_count += 1
+        if host is None:
+            return None, None
+        if out_of_time(deadline, stop):
+            return None, None
+        in_flight[host] += 1
+        return host, pending[host].popleft()[1]
+
+    dictionary = active_dictionary()
+
+    def store(source, parsed, error):
+        result = None
+        if error is None:
+            try:
+                # A run killed partway keeps every source finished before it
+                with transaction.atomic():
+                    result = process_source(source, parsed)
+            except Exception as e:
+                error = e
+        if error is not None:
+            stats.errors += 1
+            logger.error(f"Error refreshing source {source.id}: {error}")
+            record_refresh_failure(source)
+        else:
+            stats.inserted += result.inserted
+            stats.skipped += result.skipped
+            stats.not_modified += result.not_modified
+        if callback:
+            callback(source, result, error)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        fetches = {}
+        parses = {}
+
+        def submit_parse(source, fetched):
+            pool = get_parse_pool()
+            try:
+                future = pool.submit(parse_feed, fetched, int(time.time()), dictionary)
+            except BrokenProcessPool:
+                # The pool died since its last document; retry once on a fresh one
+                shutdown_parse_pool(pool)
+                pool = get_parse_pool()
+                future = pool.submit(parse_feed, fetched, int(time.time()), dictionary)
+            parses[future] = (source, pool)
+
+        def fill():
+            while len(fetches) < max(1, workers):
+                host, source = next_source()
+                if source is None:
+                    return
+                fetches[executor.submit(_timed_fetch, source, dictionary)] = (host, source)
+
+        fill()
+        while fetches or parses:
+            done, _ = wait([*fetches, *parses], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in parses:
+                    source, pool = parses.pop(future)
+                    try:
+                        parsed, error = future.result(), None
+                    except BrokenProcessPool as e:
+                        # A parse process died; start a fresh pool for the next documents
+                        shutdown_parse_pool(pool)
+                        parsed, error = None, e
+                    except Exception as e:
+                        parsed, error = None, e
+                    store(source, parsed, error)
+                    continue
+
+                host, source = fetches.pop(future)
+                in_flight[host] -= 1
+                parsed, error, duration = future.result()
+                stats.feeds += 1
+                stats.fetch_times.append(duration)
+                if isinstance(parsed, FetchResult):
+                    # The host's slot is free again while the document is parsed
+                    try:
+                        submit_parse(source, parsed)
+                    except Exception as e:
+                        store(source, None, e)
+                else:
+                    store(source, parsed, error)
+            fill()
+
+    leftover = sorted((entry for queue in pending.values() for entry in queue), key=lambda entry: entry[0])
+    stats.not_started = [source for _, source in leftover]
+    stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def default_worker_id():
+    """Identifies this process in source leases"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def refresh_claimed_sources(sources, worker=None, workers=DEFAULT_FETCH_WORKERS, per_host=DEFAULT_PER_HOST_LIMIT,
+                            callback=None, deadline=None, batch_size=None, lease=None, stop=None):
+    """
+    Refresh `sources` (a queryset) in leased batches, so several worker
+    processes or replicas can work through the same set without fetching a
+    source twice. Sources leased by another worker are left to it; the lease
+    of a crashed worker expires and the source becomes claimable again.
+    Stops starting fetches at `deadline` or once `stop` is set.
+    """
+    worker = worker or default_worker_id()
+    batch_size = batch_size or max(1, workers) * 4
+    stats = RefreshStats()
+    started = time.monotonic()
+    done = []
+    while True:
+        if out_of_time(deadline, stop):
+            # Sources left unstarted or unclaimed mean the run did not get through the set
+            stats.cut_short = bool(stats.not_started) or Source.objects.claimable(worker).filter(
+                id__in=sources.exclude(id__in=done).values('id')).exists()
+            break
+        batch = Source.objects.claim(worker, sources.exclude(id__in=done), batch_size, lease)
+        if not batch:
+            break
+        try:
+            batch_stats = refresh_feeds_concurrently(batch, workers, per_host, callback, deadline, stop)
+        finally:
+            # Unstarted sources go back to the pool right away, finished ones are rescheduled
+            Source.objects.release(worker, batch)
+        stats.merge(batch_stats)
+        done.extend(source.id for source in batch)
+    stats.elapsed = time.monotonic() - started
+    return stats
 
-    if new_items_count > 0:
-        feed.last_updated_on_time = current_time
-        feed.save()
 
-    logger.info(f"  Added {new_items_count} new items to {feed.title or feed.url}")
-    return new_items_count
+def process_refresh_jobs(workers=DEFAULT_FETCH_WORKERS, per_host=DEFAULT_PER_HOST_LIMIT, deadline=None, stop=None):
+    """
+    Run queued user refreshes until the queue is empty, `deadline` (a
+    time.monotonic() value) passes or `stop` (a threading.Event) is set;
+    returns the number processed. A job cut short goes back in the queue
+    for the next run.
+    """
+    processed = 0
+    while not out_of_time(deadline, stop):
+        job = RefreshJob.objects.claim_next()
+        if job is None:
+            break
+        logger.info(f"Processing refresh job {job.id} for user {job.user_id}")
+        try:
+            sources = Source.objects.filter(feeds__user_id=job.user_id)
+            stats = refresh_claimed_sources(sources, workers=workers, per_host=per_host, deadline=deadline, stop=stop)
+            if stats.cut_short:
+                job.requeue()
+            else:
+                job.finish(failed=stats.feeds > 0 and stats.errors == stats.feeds)
+        except Exception as e:
+            logger.error(f"Refresh job {job.id} failed: {e}")
+            job.finish(failed=True)
+        processed += 1
+    return processed
@@ -1,16 +1,28 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.utils import timezone
-from .models import FeverUser, Feed, Group, Item, Favicon, FeedGroup, Link
-from .utils import refresh_feed
-import hashlib
-import time
+from .models import FeverUser, Feed, Group, Item, Favicon, FeedGroup, RefreshJob, ItemIdCache
+from .auth_cache import api_key_cache, atouch_session
+from .compression import decompress_body
+from .links import get_hot_links, HOT_LINK_MAX_DAYS, HOT_LINK_MAX_PAGE, HOT_LINK_RANGE_DAYS
+from .response_cache import aget_cached_response, aget_version, cache_stream, etag_matches, is_cacheable, response_etag
+from .streaming import JsonArray, JsonIdList, astream_json
+from asgiref.sync import sync_to_async
+from functools import partial
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def int_param(value, default, low, high):
+    """A client-supplied integer clamped to [low, high], the default when missing or malformed"""
+    try:
+        return min(max(int(value), low), high)
+    except (TypeError, ValueError):
+        return default
+
+
 def authenticate_api_key(api_key):
     """
     Authenticate user by API key.
@@ -20,32 +32,74 @@ def authenticate_api_key(api_key):
     if not api_key:
         return None
 
+    api_key = api_key.lower()
+    user = api_key_cache.get(api_key)
+    if user is not None:
+        return user
     try:
-        user = FeverUser.objects.get(fever_api_key=api_key.lower())
+        user = FeverUser.objects.get(fever_api_key=api_key)
+    except FeverUser.DoesNotExist:
+        return None
+    api_key_cache.put(api_key, user)
+    return user
+
+
+async def aauthenticate_api_key(api_key):
+    """authenticate_api_key for the async endpoint"""
+    if not api_key:
+        return None
+
+    api_key = api_key.lower()
+    user = api_key_cache.get(api_key)
+    if user is not None:
         return user
+    try:
+        user = await FeverUser.objects.aget(fever_api_key=api_key)
     except FeverUser.DoesNotExist:
         return None
+    api_key_cache.put(api_key, user)
+    return user
 
 
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
-def fever_api(request):
+async def fever_api(request):
     """
-    Fever API endpoint compatible with version 3
+    Fever API endpoint compatible with version 3. Runs async under ASGI so
+    slow polls and refreshes don't hold a worker.
     """
     # Authentication
     params = request.GET.copy()
     params.update(request.POST)
     api_key = params.get('api_key', '')
-    user = authenticate_api_key(api_key)
+    user = await aauthenticate_api_key(api_key)
 
     if not user:
         return JsonResponse({'api_version': 3, 'auth': 0})
 
+    # Update last session time, coalesced so polling clients don't write on every request
+    await atouch_session(user)
+
+    # Unchanged data since the client's (or anyone's) last identical poll is answered from the
+    # ETag or the response cache, without touching the database
+    etag = None
+    if is_cacheable(params):
+        etag = response_etag(user.pk, await aget_version(user.pk), params)
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        body = await aget_cached_response(etag)
+        if body is not None:
+            return HttpResponse(body, content_type='application/json', headers={'ETag': etag})
+
     handler = FeverAPIHandler(request, user)
-    response_data = handler.process()
+    response_data = await handler.process()
 
-    return JsonResponse(response_data)
+    # Large sections (favicons, item IDs, item bodies) are encoded as they are read
+    if etag is None:
+        return StreamingHttpResponse(astream_json(response_data), content_type='application/json')
+    return StreamingHttpResponse(
+        cache_stream(etag, astream_json(response_data)), content_type='application/json', headers={'ETag': etag}
+    )
 
 
 class FeverAPIHandler:
@@ -58,60 +112,52 @@ class FeverAPIHandler:
             'api_version': 3,
             'auth': 1
         }
+        self._id_cache = None
 
-    def process(self):
+    async def process(self):
         """Process the request and return response data"""
-        # Update last session time
-        self.user.last_session_on_time = int(time.time())
-        self.user.save(update_fields=['last_session_on_time'])
-
         # Handle actions
         if 'refresh' in self.params:
-            self.handle_refresh()
+            await self.handle_refresh()
 
         if 'mark' in self.params:
-            self.handle_mark()
+            await self.handle_mark()
 
-        # Add last refreshed time
-        last_refreshed = Feed.objects.filter(user=self.user).order_by('-last_refreshed_on_time').first()
-        if last_refreshed:
-            self.response_data['last_refreshed_on_time'] = last_refreshed.last_refreshed_on_time
+        # Data retrieval, independent sections are read concurrently and
+        # added in Fever's order once all of them are in
+        sections = [self.get_last_refreshed()]
 
-        # Data retrieval
         if 'groups' in self.params:
-            self.get_groups()
+            sections.append(self.get_groups())
 
         if 'feeds' in self.params or 'groups' in self.params:
-            self.get_feeds()
+            sections.append(self.get_feeds())
 
         if 'favicons' in self.params:
-            self.get_favicons()
+            sections.append(self.get_favicons())
 
         if 'items' in self.params:
-            self.get_items()
+            sections.append(self.get_items())
 
         if 'unread_item_ids' in self.params:
-            self.get_unread_item_ids()
+            sections.append(self.get_unread_item_ids())
 
         if 'saved_item_ids' in self.params:
-            self.get_saved_item_ids()
+            sections.append(self.get_saved_item_ids())
 
         if 'links' in self.params:
-            self.get_links()
+            sections.append(self.get_links())
 
+        for section in await asyncio.gather(*sections):
+            self.response_data.update(section)
         return self.response_data
 
-    def handle_refresh(self):
-        logger.info(f"Refresh requested via API for user {self.user.email}")
-        feeds = Feed.objects.filter(user=self.user)
-        for feed in feeds:
-            try:
-                refresh_feed(feed)
-            except Exception as e:
-                logger.error(f"Error refreshing feed {feed.id}: {e}")
-                pass
-
-    def handle_mark(self):
+    async def handle_refresh(self):
+        # The worker picks the job up; clients follow progress via last_refreshed_on_time
+        job, created = await sync_to_async(RefreshJob.objects.enqueue)(self.user)
+        logger.info(f"Refresh requested via API for user {self.user.email} (job {job.id}, {'queued' if created else 'merged'})")
+
+    async def handle_mark(self):
         if 'as' not in self.params or 'id' not in self.params:
             return
 
@@ -120,90 +166,101 @@ class FeverAPIHandler:
         item_ids = self.params['id']
         before = self.params.get('before')
 
+        # Marking runs in a transaction, which the async ORM does not offer
+        mark = None
         if mark_type == 'item':
             ids = [int(i) for i in item_ids.split(',')]
             if as_type == 'read':
-                Item.objects.mark_as_read(self.user, ids)
+                mark = partial(Item.objects.mark_as_read, self.user, ids)
             elif as_type == 'unread':
-                Item.objects.mark_as_unread(self.user, ids)
+                mark = partial(Item.objects.mark_as_unread, self.user, ids)
             elif as_type == 'saved':
-                Item.objects.mark_as_saved(self.user, ids)
+                mark = partial(Item.objects.mark_as_saved, self.user, ids)
             elif as_type == 'unsaved':
-                Item.objects.mark_as_unsaved(self.user, ids)
+                mark = partial(Item.objects.mark_as_unsaved, self.user, ids)
 
         elif mark_type == 'feed':
             feed_id = int(item_ids)
             if as_type == 'read':
-                Item.objects.mark_feed_as_read(self.user, feed_id, before)
+                mark = partial(Item.objects.mark_feed_as_read, self.user, feed_id, before)
             elif as_type == 'unread':
-                items = Item.objects.filter(feed_id=feed_id, feed__user=self.user)
-                if before:
-                    items = items.filter(created_on_time__lte=int(before))
-                items.update(read_on_time=0)
+                mark = partial(Item.objects.mark_feed_as_unread, self.user, feed_id, before)
 
         elif mark_type == 'group':
             group_id = int(item_ids)
             if as_type == 'read':
-                Item.objects.mark_group_as_read(self.user, group_id, before)
+                mark = partial(Item.objects.mark_group_as_read, self.user, group_id, before)
             elif as_type == 'unread':
-                feed_ids = FeedGroup.objects.filter(group_id=group_id, group__user=self.user).values_list('feed_id', flat=True)
-                items = Item.objects.filter(feed_id__in=feed_ids)
-                if before:
-                    items = items.filter(created_on_time__lte=int(before))
-                items.update(read_on_time=0)
+                mark = partial(Item.objects.mark_group_as_unread, self.user, group_id, before)
+
+        if mark is not None:
+            await sync_to_async(mark)()
 
-    def get_groups(self):
+    async def get_last_refreshed(self):
+        last_refreshed = await Feed.objects.filter(user=self.user).order_by('-last_refreshed_on_time').values_list(
+            'last_refreshed_on_time', flat=True).afirst()
+        if last_refreshed is None:
+            return {}
+        return {'last_refreshed_on_time': last_refreshed}
+
+    async def get_groups(self):
         groups = Group.objects.filter(user=self.user).values('id', 'title')
-        self.response_data['groups'] = [
+        return {'groups': [
             {'id': g['id'], 'title': g['title']}
-            for g in groups
-        ]
+            async for g in groups
+        ]}
 
-    def get_feeds(self):
-        feeds = Feed.objects.filter(user=self.user).select_related('favicon')
-        feeds_data = []
-
-        for feed in feeds:
-            feeds_data.append({
-                'id': feed.id,
-                'favicon_id': feed.favicon_id if feed.favicon_id else 0,
-                'title': feed.user_title or feed.title or feed.url,
-                'url': feed.url,
-                'site_url': feed.site_url or '',
-                'is_spark': 1 if feed.is_spark else 0,
-                'last_updated_on_time': feed.last_updated_on_time
-            })
+    async def get_feeds(self):
+        feeds = Feed.objects.filter(user=self.user)
+        section = {}
 
         if 'feeds' in self.params:
-            self.response_data['feeds'] = feeds_data
+            section['feeds'] = [
+                {
+                    'id': feed.id,
+                    'favicon_id': feed.favicon_id if feed.favicon_id else 0,
+                    'title': feed.user_title or feed.title or feed.url,
+                    'url': feed.url,
+                    'site_url': feed.site_url or '',
+                    'is_spark': 1 if feed.is_spark else 0,
+                    'last_updated_on_time': feed.last_updated_on_time
+                }
+                async for feed in feeds
+            ]
 
         # Feed-group relationships
         feed_groups = FeedGroup.objects.filter(feed__user=self.user, feed__is_spark=False).values('group_id', 'feed_id')
 
         # Group feeds by group_id
         groups_dict = {}
-        for fg in feed_groups:
+        async for fg in feed_groups:
             group_id = fg['group_id']
             if group_id not in groups_dict:
                 groups_dict[group_id] = []
             groups_dict[group_id].append(str(fg['feed_id']))
 
-        self.response_data['feeds_groups'] = [
+        section['feeds_groups'] = [
             {'group_id': gid, 'feed_ids': ','.join(fids)}
             for gid, fids in groups_dict.items()
         ]
+        return section
 
-    def get_favicons(self):
-        favicons = Favicon.objects.all().values('id', 'cache')
-        self.response_data['favicons'] = [
+    async def get_favicons(self):
+        # Empty caches mark sites without a usable icon, no feed points at them
+        favicons = Favicon.objects.exclude(cache='').values('id', 'cache').aiterator(chunk_size=100)
+        return {'favicons': JsonArray(
             {'id': f['id'], 'data': f['cache']}
-            for f in favicons
-        ]
+            async for f in favicons
+        )}
+
+    # Columns serialized by get_items, loaded with .values() instead of model instances
+    ITEM_FIELDS = ('id', 'feed_id', 'title', 'author', 'body', 'link', 'state__is_saved', 'state__read_on_time', 'created_on_time')
 
-    def get_items(self):
-        items_qs = Item.objects.filter(feed__user=self.user)
+    async def get_items(self):
+        items_qs = Item.objects.filter(user=self.user)
 
-        self.response_data['total_items'] = items_qs.count()
+        # Maintained by ingestion and retention instead of counting on every page
+        section = {'total_items': (await self.get_id_cache()).total_items}
 
         # Filter by feed_ids or group_ids
         if 'feed_ids' in self.params:
@@ -215,14 +272,15 @@ class FeverAPIHandler:
             feed_ids = FeedGroup.objects.filter(group_id__in=group_ids).values_list('feed_id', flat=True)
             items_qs = items_qs.filter(feed_id__in=feed_ids)
 
-        # Pagination
+        # Pagination, keyset scans over the (user, id) index
         if 'max_id' in self.params:
             max_id = int(self.params['max_id'])
             if max_id > 0:
                 items_qs = items_qs.filter(id__lt=max_id)
             items_qs = items_qs.order_by('-id')[:50]
         elif 'with_ids' in self.params:
-            item_ids = [int(i) for i in self.params['with_ids'].split(',')]
+            # Fever caps with_ids at 50 items per request
+            item_ids = [int(i) for i in self.params['with_ids'].split(',')[:50]]
             items_qs = items_qs.filter(id__in=item_ids)
         elif 'since_id' in self.params:
             since_id = int(self.params['since_id'])
@@ -230,47 +288,41 @@ class FeverAPIHandler:
         else:
             items_qs = items_qs.order_by('-id')[:50]
 
-        items_data = []
-        for item in items_qs:
-            items_data.append({
-                'id': item.id,
-                'feed_id': item.feed_id,
-                'title': item.title or '',
-                'author': item.author or '',
-                'html': item.description or '',
-                'url': item.link or '',
-                'is_saved': 1 if item.is_saved else 0,
-                'is_read': 1 if item.read_on_time > 0 else 0,
-                'created_on_time': item.created_on_time
-            })
-
-        self.response_data['items'] = items_data
-
-    def get_unread_item_ids(self):
-        unread_ids = Item.objects.filter(
-            feed__user=self.user,
-            read_on_time=0
-        ).values_list('id', flat=True)
-        self.response_data['unread_item_ids'] = ','.join(map(str, unread_ids))
-
-    def get_saved_item_ids(self):
-        saved_ids = Item.objects.filter(
-            feed__user=self.user,
-            is_saved=True
-        ).values_list('id', flat=True)
-        self.response_data['saved_item_ids'] = ','.join(map(str, saved_ids))
-
-    def get_links(self):
-        links = Link.objects.filter(feed__user=self.user).order_by('-weight')[:50]
-        self.response_data['links'] = [
+        section['items'] = JsonArray(
             {
-                'id': link.id,
-                'feed_id': link.feed_id,
-                'item_id': link.item_id,
-                'url': link.url or '',
-                'title': link.title or '',
-                'weight': link.weight,
-                'created_on_time': link.created_on_time
+                'id': item['id'],
+                'feed_id': item['feed_id'],
+                'title': item['title'] or '',
+                'author': item['author'] or '',
+                'html': decompress_body(item['body']) or '',
+                'url': item['link'] or '',
+                'is_saved': 1 if item['state__is_saved'] else 0,
+                'is_read': 1 if item['state__read_on_time'] else 0,
+                'created_on_time': item['created_on_time']
             }
-            for link in links
-        ]
+            async for item in items_qs.values(*self.ITEM_FIELDS).aiterator(chunk_size=50)
+        )
+        return section
+
+    def get_id_cache(self):
+        """The user's ItemIdCache, read once and shared by the sections running concurrently"""
+        if self._id_cache is None:
+            self._id_cache = asyncio.ensure_future(sync_to_async(ItemIdCache.objects.get_for_user)(self.user))
+        return self._id_cache
+
+    async def get_unread_item_ids(self):
+        unread_ids = (await self.get_id_cache()).get_unread_ids()
+        return {'unread_item_ids': JsonIdList(unread_ids)}
+
+    async def get_saved_item_ids(self):
+        saved_ids = (await self.get_id_cache()).get_saved_ids()
+        return {'saved_item_ids': JsonIdList(saved_ids)}
+
+    async def get_links(self):
+        links = await sync_to_async(get_hot_links)(
+            self.user,
+            offset=int_param(self.params.get('offset'), 0, 0, HOT_LINK_MAX_DAYS),
+            days=int_param(self.params.get('range'), HOT_LINK_RANGE_DAYS, 1, HOT_LINK_MAX_DAYS),
+            page=int_param(self.params.get('page'), 1, 1, HOT_LINK_MAX_PAGE),
+        )
+        return {'links': links}
@@ -1,9 +1,7 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from .models import FeverUser, Feed, Group, Item
-from .utils import refresh_feed
+from .models import RefreshJob
 
 
 def index(request):
@@ -38,12 +36,7 @@ def logout_view(request):
 
 @login_required
 def refresh_feeds_view(request):
-    """Manually refresh all feeds for the current user"""
+    """Queue a refresh of all feeds for the current user"""
     if request.method == 'POST':
-        feeds = Feed.objects.filter(user=request.user)
-        for feed in feeds:
-            try:
-                refresh_feed(feed)
-            except Exception:
-                pass
+        RefreshJob.objects.enqueue(request.user)
     return redirect('index')
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Local HTTP stand-in for real feed hosts. Serves synthetic RSS for
+/feeds/<n>.xml, with ETags so repeated refreshes can answer 304.
+
+Listens on all interfaces so 127.0.0.1, 127.0.0.2, ... act as separate hosts
+for the per-host fetch limit (Linux routes all of 127.0.0.0/8 to loopback).
+"""
+import argparse
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from synthetic import render_rss
+
+FEED_PATH = re.compile(r'^/feeds/(\d+)\.xml$')
+
+
+class FeedServer:
+    """
+    Serves `items_per_feed` items per feed ending just before `next_item`,
+    plus `new_items` items from `next_item` on, so a refresh both skips
+    stored entries and inserts new ones.
+    """
+
+    def __init__(self, next_item, items_per_feed=20, new_items=5, host='', port=0, delay=0.0):
+        self.next_item = next_item
+        self.items_per_feed = items_per_feed
+        self.new_items = new_items
+        self.delay = delay
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def base_url(self, host_n=0):
+        return f'http://127.0.0.{1 + host_n}:{self.port}'
+
+    def etag(self, feed_n):
+        return f'"{feed_n}-{self.next_item}-{self.new_items}"'
+
+    def body(self, feed_n):
+        first = max(0, self.next_item - self.items_per_feed + self.new_items)
+        return render_rss(feed_n, range(first, self.next_item + self.new_items))
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, as real feed hosts offer
+
+            def do_GET(self):
+                match = FEED_PATH.match(self.path)
+                if not match:
+                    self.send_error(404)
+                    return
+                if server.delay:
+                    time.sleep(server.delay)
+                feed_n = int(match.group(1))
+                etag = server.etag(feed_n)
+                not_modified = self.headers.get('If-None-Match') == etag
+                with server._lock:
+                    server.requests += 1
+                    server.not_modified += not_modified
+                if not_modified:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                body = server.body(feed_n)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/rss+xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--next-item', type=int, default=100, help='First item number not yet generated')
+    parser.add_argument('--items-per-feed', type=int, default=20)
+    parser.add_argument('--new-items', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds of simulated network latency')
+    args = parser.parse_args()
+    server = FeedServer(args.next_item, args.items_per_feed, args.new_items, port=args.port, delay=args.delay)
+    print(f'Serving synthetic feeds on {server.base_url()}/feeds/<n>.xml')
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
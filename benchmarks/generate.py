@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Benchmark data generator, an extension of setup_demo.py: N users, each with
+M feeds of K items, a chosen share of them read or saved. Items go through the
+same ingestion path as a refresh (store_entries), so item states, the ID cache
+and hot links are populated exactly as in production.
+
+Feed URLs point at the local feed server (feed_server.py), spread over
+`hosts` loopback addresses.
+"""
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Never touch the development database unless asked to
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', f'sqlite:///{ROOT / "benchmarks" / "bench.sqlite3"}')
+
+import setup_demo  # noqa: E402,F401  Configures Django
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from api.compression import compress_body  # noqa: E402
+from api.models import Favicon, FeverUser, Feed, FeedGroup, Group, Item  # noqa: E402
+from api.parsing import calculate_checksum  # noqa: E402
+from api.utils import store_entries  # noqa: E402
+from synthetic import feed_url, item_entry  # noqa: E402
+
+EMAIL_PREFIX = 'bench-'
+PASSWORD = 'benchpassword'
+GROUP_TITLES = ['Tech News', 'Blogs', 'Development']  # As in setup_demo
+# A tiny valid PNG, the favicons payload size is what matters
+FAVICON_DATA = 'image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+
+
+def user_email(user_n):
+    return f'{EMAIL_PREFIX}{user_n}@example.com'
+
+
+def reset_database():
+    """Fresh schema for SQLite; on other databases only earlier benchmark users are removed"""
+    if connection.vendor == 'sqlite':
+        name = connection.settings_dict['NAME']
+        connection.close()
+        if os.path.exists(name):
+            os.remove(name)
+    call_command('migrate', verbosity=0)
+    FeverUser.objects.filter(email__startswith=EMAIL_PREFIX).delete()
+
+
+def entries_for(feed_n, item_numbers):
+    """The dicts normalize_entries would produce for these synthetic items"""
+    entries = []
+    for item_n in item_numbers:
+        uid, title, link, html, created = item_entry(feed_n, item_n)
+        entries.append({
+            'uid': uid,
+            'title': title,
+            'author': f'author{feed_n}@example.com',
+            'description': html,
+            'body': compress_body(html),
+            'link': link,
+            'url_checksum': calculate_checksum(link),
+            'created_on_time': created,
+        })
+    return entries
+
+
+def generate(users=5, feeds=20, items=100, read_ratio=0.8, saved_ratio=0.02, port=8100, hosts=4, seed=1):
+    """Create the data set, returns the users created"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    created = []
+    for user_n in range(users):
+        user = FeverUser.objects.create_user(email=user_email(user_n), password=PASSWORD)
+        groups = [Group.objects.create(user=user, title=title) for title in GROUP_TITLES]
+
+        for feed_i in range(feeds):
+            feed_n = user_n * feeds + feed_i
+            base_url = f'http://127.0.0.{1 + feed_n % hosts}:{port}'
+            favicon, _ = Favicon.objects.get_or_create(
+                url_checksum=calculate_checksum(f'https://site{feed_n}.example.com/'),
+                defaults={'url': f'https://site{feed_n}.example.com/favicon.ico', 'cache': FAVICON_DATA,
+                          'last_cached_on_time': now},
+            )
+            feed = Feed.objects.create(
+                user=user,
+                title=f'Synthetic feed {feed_n}',
+                url=feed_url(base_url, feed_n),
+                site_url=f'https://site{feed_n}.example.com/',
+                domain=f'site{feed_n}.example.com',
+                favicon=favicon,
+            )
+            FeedGroup.objects.create(feed=feed, group=groups[feed_i % len(groups)])
+            store_entries(feed, entries_for(feed_n, range(items)), now)
+
+        item_ids = list(Item.objects.filter(user=user).values_list('id', flat=True))
+        Item.objects.mark_as_read(user, rng.sample(item_ids, int(len(item_ids) * read_ratio)))
+        Item.objects.mark_as_saved(user, rng.sample(item_ids, int(len(item_ids) * saved_ratio)))
+        created.append(user)
+    return created
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--feeds', type=int, default=20, help='Feeds per user')
+    parser.add_argument('--items', type=int, default=100, help='Items per feed')
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    parser.add_argument('--saved-ratio', type=float, default=0.02)
+    parser.add_argument('--port', type=int, default=8100, help='Port of the feed server')
+    parser.add_argument('--hosts', type=int, default=4, help='Loopback addresses to spread feeds over')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    reset_database()
+    users = generate(args.users, args.feeds, args.items, args.read_ratio, args.saved_ratio,
+                     args.port, args.hosts, args.seed)
+    print(f'Generated {len(users)} users, {args.users * args.feeds} feeds, '
+          f'{args.users * args.feeds * args.items} items in {time.monotonic() - started:.1f}s')
+    print(f'Log in as {user_email(0)} / {PASSWORD}')
+
+
+if __name__ == '__main__':
+    main()
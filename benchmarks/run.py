@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Fever API and refresh pipeline benchmarks.
+
+Generates a data set (see generate.py), measures latency and queries per
+request for every Fever parameter FeverAPIHandler.process handles, then the
+refresh throughput against the local feed server. Results are written as JSON;
+pass --compare with an earlier result to see the change per measurement.
+
+    python benchmarks/run.py --users 5 --feeds 20 --items 100
+    python benchmarks/run.py --compare benchmarks/results/<earlier>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import generate  # Configures Django against the benchmark database
+
+from asgiref.sync import async_to_sync  # noqa: E402
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from api.auth_cache import api_key_cache  # noqa: E402
+from api.models import Feed, Item, Source  # noqa: E402
+from api.utils import refresh_feeds_concurrently  # noqa: E402
+from feed_server import FeedServer  # noqa: E402
+
+RESULTS_DIR = generate.ROOT / 'benchmarks' / 'results'
+
+
+def api_cases(user):
+    """(name, params) for each Fever parameter, including the paging variants of items"""
+    item_ids = list(Item.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+    middle = item_ids[len(item_ids) // 2] if item_ids else 0
+    feed = Feed.objects.filter(user=user).first()
+    return [
+        ('auth', {}),
+        ('groups', {'groups': ''}),
+        ('feeds', {'feeds': ''}),
+        ('favicons', {'favicons': ''}),
+        ('items', {'items': ''}),
+        ('items_since_id', {'items': '', 'since_id': middle}),
+        ('items_max_id', {'items': '', 'max_id': middle}),
+        ('items_with_ids', {'items': '', 'with_ids': ','.join(map(str, item_ids[:50]))}),
+        ('items_feed_ids', {'items': '', 'feed_ids': feed.id if feed else 0}),
+        ('unread_item_ids', {'unread_item_ids': ''}),
+        ('saved_item_ids', {'saved_item_ids': ''}),
+        ('links', {'links': ''}),
+        ('mark_item', {'mark': 'item', 'as': 'read', 'id': middle}),
+        ('mark_feed', {'mark': 'feed', 'as': 'read', 'id': feed.id if feed else 0, 'before': int(time.time())}),
+        ('refresh', {'refresh': ''}),
+    ]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, -(-pct * len(ordered) // 100) - 1)]
+
+
+async def drain(response):
+    async for _ in response.streaming_content:
+        pass
+
+
+def timed_request(client, params, headers=None):
+    """Latency in ms (body fully read) and query count for one request"""
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.post('/api/', params, headers=headers or {})
+        if response.streaming and response.is_async:
+            async_to_sync(drain)(response)
+        elif response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = (time.perf_counter() - started) * 1000
+    return response, elapsed, len(queries)
+
+
+def summarize(latencies, queries):
+    return {
+        'median_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'min_ms': round(min(latencies), 3),
+        'queries': max(queries),
+    }
+
+
+def bench_api(user, repeat):
+    client = Client()
+    base = {'api_key': user.fever_api_key}
+    results = {}
+    for name, params in api_cases(user):
+        latencies, queries = [], []
+        for _ in range(repeat):
+            # Measure the uncached path; the cached paths are measured separately below
+            cache.clear()
+            api_key_cache.clear()
+            _, elapsed, count = timed_request(client, {**base, **params})
+            latencies.append(elapsed)
+            queries.append(count)
+        results[name] = summarize(latencies, queries)
+
+    # Repeat polls: same parameters from the response cache, and a conditional request answered 304
+    params = {**base, 'items': ''}
+    response, _, _ = timed_request(client, params)
+    etag = response.get('ETag', '')
+    for name, headers in (('items_cached', {}), ('items_not_modified', {'If-None-Match': etag})):
+        latencies, queries = [], []
+        for _ in range(repeat):
+            _, elapsed, count = timed_request(client, params, headers)
+            latencies.append(elapsed)
+            queries.append(count)
+        results[name] = summarize(latencies, queries)
+    return results
+
+
+def bench_refresh(server, workers, per_host):
+    """Two passes over every source: one with new items, one answered 304"""
+    results = {}
+    for name in ('changed', 'not_modified'):
+        requests_before = server.requests
+        # Keep the per-feed progress lines out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = refresh_feeds_concurrently(list(Source.objects.all()), workers=workers, per_host=per_host)
+        results[name] = {
+            'feeds': stats.feeds,
+            'errors': stats.errors,
+            'inserted': stats.inserted,
+            'skipped': stats.skipped,
+            'not_modified': stats.not_modified,
+            'elapsed_s': round(stats.elapsed, 3),
+            'feeds_per_second': round(stats.feeds_per_second, 2),
+            'p95_fetch_s': round(stats.p95_fetch_time, 4),
+            'http_requests': server.requests - requests_before,
+        }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=generate.ROOT, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current, previous_path):
+    """Print the relative change of every latency and query count against an earlier run"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f'\nCompared with {previous.get("commit")} ({previous_path}):')
+    for name, now in current['api'].items():
+        before = previous.get('api', {}).get(name)
+        if not before:
+            continue
+        change = (now['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0
+        queries = now['queries'] - before['queries']
+        print(f'  {name:22} {before["median_ms"]:9.2f} -> {now["median_ms"]:9.2f} ms ({change:+6.1f}%)'
+              f'  queries {before["queries"]} -> {now["queries"]}' + (f' ({queries:+d})' if queries else ''))
+    for name, now in current['refresh'].items():
+        before = previous.get('refresh', {}).get(name)
+        if before:
+            print(f'  refresh {name:14} {before["feeds_per_second"]:9.2f} -> {now["feeds_per_second"]:9.2f} feeds/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--feeds', type=int, default=20, help='Feeds per user')
+    parser.add_argument('--items', type=int, default=100, help='Items per feed')
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    parser.add_argument('--saved-ratio', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=20, help='Requests per API measurement')
+    parser.add_argument('--port', type=int, default=8100, help='Port for the local feed server')
+    parser.add_argument('--hosts', type=int, default=4, help='Loopback addresses to spread feeds over')
+    parser.add_argument('--delay', type=float, default=0.0, help='Simulated network latency per feed fetch')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--per-host', type=int, default=2)
+    parser.add_argument('--skip-refresh', action='store_true')
+    parser.add_argument('--output', help='Result file (default benchmarks/results/<time>-<commit>.json)')
+    parser.add_argument('--compare', metavar='RESULT', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+    started = time.monotonic()
+    generate.reset_database()
+    users = generate.generate(args.users, args.feeds, args.items, args.read_ratio, args.saved_ratio,
+                              args.port, args.hosts, args.seed)
+    print(f'Generated data in {time.monotonic() - started:.1f}s')
+
+    result = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': connection.vendor,
+        'config': config,
+        'api': bench_api(users[0], args.repeat),
+        'refresh': {},
+    }
+    for name, row in result['api'].items():
+        print(f'  {name:22} median {row["median_ms"]:8.2f} ms  p95 {row["p95_ms"]:8.2f} ms  {row["queries"]:3d} queries')
+
+    if not args.skip_refresh:
+        with FeedServer(args.items, port=args.port, delay=args.delay) as server:
+            result['refresh'] = bench_refresh(server, args.workers, args.per_host)
+        for name, row in result['refresh'].items():
+            print(f'  refresh {name:14} {row["feeds_per_second"]:8.2f} feeds/s  p95 fetch {row["p95_fetch_s"]:.3f}s  '
+                  f'{row["inserted"]} inserted, {row["not_modified"]} not modified, {row["errors"]} errors')
+
+    output = args.output
+    if not output:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        output = RESULTS_DIR / f'{stamp}-{result["commit"]}.json'
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
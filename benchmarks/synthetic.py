@@ -0,0 +1,64 @@
+"""
+Deterministic synthetic feed content shared by the data generator and the
+local feed server, so a refresh sees exactly the items the generator stored.
+"""
+import random
+import time
+from email.utils import formatdate
+from xml.sax.saxutils import escape
+
+# Items are one hour apart, item 0 newest, counting back from the start of the current hour so they
+# fall inside the hot links range; hour-aligned so the generator and the feed server agree
+ITEM_SPACING = 60 * 60
+NOW = int(time.time()) // ITEM_SPACING * ITEM_SPACING
+
+WORDS = (
+    'feed reader server cache index query latency python django item group favicon '
+    'stream batch parse fetch render network scale worker async bucket version token '
+    'request response client update refresh unread saved link hot archive compress'
+).split()
+
+# Shared targets make the hot links ranking non-trivial
+HOT_TARGETS = [f'https://news.example.org/story/{n}' for n in range(50)]
+
+
+def feed_path(feed_n):
+    return f'/feeds/{feed_n}.xml'
+
+
+def feed_url(base_url, feed_n):
+    return base_url.rstrip('/') + feed_path(feed_n)
+
+
+def item_entry(feed_n, item_n):
+    """One item as (uid, title, link, html, created_on_time), stable for a given (feed, item)"""
+    rng = random.Random(feed_n * 1_000_003 + item_n)
+    paragraphs = []
+    for _ in range(rng.randint(2, 6)):
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(30, 90)))
+        paragraphs.append(f'<p>{words}</p>')
+    for target in rng.sample(HOT_TARGETS, rng.randint(0, 3)):
+        paragraphs.append(f'<p>See <a href="{target}">{target.rsplit("/", 1)[-1]}</a>.</p>')
+    link = f'https://site{feed_n}.example.com/posts/{item_n}'
+    title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 9))).capitalize()
+    return link, title, link, ''.join(paragraphs), NOW - item_n * ITEM_SPACING
+
+
+def render_rss(feed_n, item_numbers):
+    """RSS 2.0 document for a feed holding the given item numbers, newest first"""
+    items = []
+    for item_n in sorted(item_numbers):
+        uid, title, link, html, created = item_entry(feed_n, item_n)
+        items.append(
+            f'<item><guid>{escape(uid)}</guid><title>{escape(title)}</title><link>{escape(link)}</link>'
+            f'<author>author{feed_n}@example.com</author><pubDate>{formatdate(created, usegmt=True)}</pubDate>'
+            f'<description>{escape(html)}</description></item>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0"><channel>'
+        f'<title>Synthetic feed {feed_n}</title><link>https://site{feed_n}.example.com/</link>'
+        f'<description>Benchmark feed {feed_n}</description>'
+        + ''.join(items)
+        + '</channel></rss>'
+    ).encode()
@@ -5,11 +5,13 @@ echo "Applying database migrations..."
 python manage.py migrate
 
 if [ "$1" = "worker" ]; then
-    echo "Starting worker..."
-    exec /bin/bash /app/scripts/background_refresh.sh
+    echo "Starting refresh daemon..."
+    exec python manage.py refresh_daemon
 else
     echo "Collecting static files..."
     python manage.py collectstatic --noinput
-    echo "Starting Gunicorn..."
-    exec gunicorn feverish.wsgi:application --bind 0.0.0.0:8000
+    # The Fever endpoint is async, one uvicorn process serves many concurrent polls
+    echo "Starting Uvicorn..."
+    exec uvicorn feverish.asgi:application --host 0.0.0.0 --port 8000 \
+        --proxy-headers --forwarded-allow-ips='*' --workers "${WEB_WORKERS:-1}"
 fi
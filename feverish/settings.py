@@ -101,7 +101,9 @@ WSGI_APPLICATION = 'feverish.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
-        conn_max_age=600
+        # Persistent connections are per thread and leak under ASGI, where
+        # async ORM calls run in executor threads
+        conn_max_age=int(os.environ.get('CONN_MAX_AGE', 0))
     )
 }
 
@@ -186,3 +188,6 @@ STATICFILES_DIRS = [
 
 # Template directories
 TEMPLATES[0]['DIRS'] = [BASE_DIR / 'templates']
+
+# Processes parsing large fetched feeds during refreshes, 0 parses everything on the fetch threads
+FEVER_PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', os.cpu_count() or 1))
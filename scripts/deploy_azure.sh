@@ -42,13 +42,18 @@ az containerapp create \
   --resource-group $RG \
   --yaml deploy/feverish-web.generated.yaml
 
-# Deploy Worker Job
-echo "Deploying Worker Job..."
+# Deploy Worker App
+echo "Deploying Worker App..."
+# The worker used to be an hourly scheduled job; the refresh daemon replaces it
+if az containerapp job show --name feverish-worker --resource-group $RG > /dev/null 2>&1; then
+  echo "Removing the scheduled worker job..."
+  az containerapp job delete --name feverish-worker --resource-group $RG --yes
+fi
 envsubst < deploy/feverish-worker.yaml > deploy/feverish-worker.generated.yaml
 echo "--- Generated Worker YAML ---"
 cat deploy/feverish-worker.generated.yaml
 echo "-----------------------------"
-az containerapp job create \
+az containerapp create \
   --name feverish-worker \
   --resource-group $RG \
   --yaml deploy/feverish-worker.generated.yaml